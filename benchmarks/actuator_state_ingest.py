@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Measures the number of actuator states per second that can be inserted into
+the `actuators_actuatorstate` table.
+
+The script builds the table in a SQLite database (the leaf server database
+engine) and inserts the same synthetic controller ticks in two ways:
+
+* per row, the way states posted one at a time are saved: one lookup of the
+  actuator and one ``INSERT`` per state, each in its own transaction
+* in batches, the way ``ActuatorStateIngester`` does: one lookup of every
+  actuator in the batch and ``executemany()`` in chunks of ``--batch-size``
+  rows, all in one transaction
+
+Usage::
+
+    python benchmarks/actuator_state_ingest.py --actuators 50 --ticks 2000
+"""
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+from itertools import islice
+
+INSERT = (
+    'INSERT INTO actuators_actuatorstate (actuator_id, timestamp, value) '
+    'VALUES (?, ?, ?)'
+)
+
+
+def create_tables(conn, actuators):
+    conn.execute(
+        'CREATE TABLE actuators_actuator ('
+        'id integer NOT NULL PRIMARY KEY AUTOINCREMENT)'
+    )
+    conn.execute(
+        'CREATE TABLE actuators_actuatorstate ('
+        'id integer NOT NULL PRIMARY KEY AUTOINCREMENT, '
+        'timestamp integer NOT NULL, value real NOT NULL, '
+        'actuator_id integer NOT NULL '
+        'REFERENCES actuators_actuator (id))'
+    )
+    conn.execute(
+        'CREATE INDEX actuators_actuatorstate_actuator_id_timestamp '
+        'ON actuators_actuatorstate (actuator_id, timestamp)'
+    )
+    conn.executemany(
+        'INSERT INTO actuators_actuator (id) VALUES (?)',
+        ((pk + 1, ) for pk in range(actuators))
+    )
+    conn.commit()
+
+
+def make_ticks(actuators, ticks):
+    """ One state per actuator per tick """
+    return [
+        [(pk + 1, tick, float(tick % 2)) for pk in range(actuators)]
+        for tick in range(ticks)
+    ]
+
+
+def insert_per_row(conn, ticks):
+    for tick in ticks:
+        for row in tick:
+            conn.execute(
+                'SELECT id FROM actuators_actuator WHERE id = ?', row[:1]
+            ).fetchone()
+            conn.execute(INSERT, row)
+            conn.commit()
+
+
+def insert_batched(conn, ticks, batch_size):
+    for tick in ticks:
+        series_ids = sorted(set(row[0] for row in tick))
+        conn.execute(
+            'SELECT id FROM actuators_actuator WHERE id IN ({})'.format(
+                ', '.join('?' * len(series_ids))
+            ), series_ids
+        ).fetchall()
+        rows = iter(tick)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            conn.executemany(INSERT, batch)
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--actuators', type=int, default=50)
+    parser.add_argument('--ticks', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument(
+        '--db', help='Path of the database to create (default: a temp file)'
+    )
+    args = parser.parse_args()
+
+    if args.db:
+        db_path = args.db
+    else:
+        fd, db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = args.actuators * args.ticks
+        print('Inserting {} ticks of {} actuator states'.format(
+            args.ticks, args.actuators
+        ))
+        for name, insert in (
+                ('per row', insert_per_row),
+                ('batched', lambda conn, ticks: insert_batched(
+                    conn, ticks, args.batch_size
+                ))):
+            # Each method starts from empty tables
+            conn.execute('DROP TABLE IF EXISTS actuators_actuatorstate')
+            conn.execute('DROP TABLE IF EXISTS actuators_actuator')
+            create_tables(conn, args.actuators)
+            ticks = make_ticks(args.actuators, args.ticks)
+            start = time.perf_counter()
+            insert(conn, ticks)
+            elapsed = time.perf_counter() - start
+            print('  {}: {:.0f} states/s ({:.2f} s)'.format(
+                name, rows / elapsed, elapsed
+            ))
+    finally:
+        conn.close()
+        if not args.db:
+            os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Measures the effect of the composite (series, timestamp) index on the time
+series tables (`sensors_datapoint` and `actuators_actuatorstate`).
+
+The script builds a synthetic copy of the `sensors_datapoint` table in a
+SQLite database (the leaf server database engine), runs the queries issued by
+the history filters, ``latest()`` and paginated list views, and prints the
+query plan and the median run time of each query before and after the index
+from ``sensors/migrations/0004_datapoint_index_together.py`` is created.
+
+Usage::
+
+    python benchmarks/time_series_indexes.py --rows 10000000
+"""
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import statistics
+
+QUERIES = (
+    (
+        'latest()',
+        'SELECT id, sensing_point_id, timestamp, value '
+        'FROM sensors_datapoint WHERE sensing_point_id = :series '
+        'ORDER BY timestamp DESC LIMIT 1'
+    ),
+    (
+        'min_time/max_time filter',
+        'SELECT id, sensing_point_id, timestamp, value '
+        'FROM sensors_datapoint WHERE sensing_point_id = :series '
+        'AND timestamp >= :min_time AND timestamp <= :max_time '
+        'ORDER BY timestamp ASC'
+    ),
+    (
+        'first page of list',
+        'SELECT id, sensing_point_id, timestamp, value '
+        'FROM sensors_datapoint WHERE sensing_point_id = :series '
+        'ORDER BY timestamp ASC LIMIT 100'
+    ),
+)
+
+
+def populate(conn, rows, series, interval):
+    conn.execute(
+        'CREATE TABLE sensors_datapoint ('
+        'id integer NOT NULL PRIMARY KEY AUTOINCREMENT, '
+        'timestamp integer NOT NULL, value real NOT NULL, '
+        'sensing_point_id integer NOT NULL)'
+    )
+    conn.execute(
+        'CREATE INDEX sensors_datapoint_sensing_point_id '
+        'ON sensors_datapoint (sensing_point_id)'
+    )
+    readings = (
+        (i // series * interval, float(i % 1000), i % series + 1)
+        for i in range(rows)
+    )
+    conn.executemany(
+        'INSERT INTO sensors_datapoint (timestamp, value, sensing_point_id) '
+        'VALUES (?, ?, ?)', readings
+    )
+    conn.commit()
+
+
+def run_queries(conn, params, repeat):
+    for name, sql in QUERIES:
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - start)
+        print('  {}: {:.3f} ms'.format(
+            name, statistics.median(timings) * 1000
+        ))
+        for row in plan:
+            print('    {}'.format(row[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--series', type=int, default=50)
+    parser.add_argument(
+        '--interval', type=int, default=5,
+        help='Seconds between readings of one sensing point'
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument(
+        '--db', help='Path of the database to create (default: a temp file)'
+    )
+    args = parser.parse_args()
+
+    if args.db:
+        db_path = args.db
+    else:
+        fd, db_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    try:
+        print('Populating {} rows for {} sensing points'.format(
+            args.rows, args.series
+        ))
+        start = time.perf_counter()
+        populate(conn, args.rows, args.series, args.interval)
+        print('Populated in {:.1f} s'.format(time.perf_counter() - start))
+        last_timestamp = (args.rows // args.series) * args.interval
+        params = {
+            'series': args.series // 2,
+            # One day of readings from the middle of the history
+            'min_time': last_timestamp // 2,
+            'max_time': last_timestamp // 2 + 24 * 60 * 60,
+        }
+        print('Before (index on sensing_point_id only):')
+        run_queries(conn, params, args.repeat)
+        start = time.perf_counter()
+        conn.execute(
+            'CREATE INDEX sensors_datapoint_sensing_point_id_timestamp '
+            'ON sensors_datapoint (sensing_point_id, timestamp)'
+        )
+        conn.commit()
+        print('Created index in {:.1f} s'.format(time.perf_counter() - start))
+        print('After (index on sensing_point_id, timestamp):')
+        run_queries(conn, params, args.repeat)
+    finally:
+        conn.close()
+        if not args.db:
+            os.remove(db_path)
+
+
+if __name__ == '__main__':
+    main()
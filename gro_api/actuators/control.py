@@ -0,0 +1,203 @@
+"""
+This module defines a control engine that computes the state that every
+actuator should be in from the current set points of the trays, the latest
+readings of the sensing points and the effects of the control profile of each
+actuator.
+
+Everything that the engine needs is loaded with a fixed number of queries per
+tick (the latest readings and actuator states come from the latest value
+stores and the active overrides from :data:`override_index`), so the cost of a
+tick does not depend on the number of actuators.
+"""
+import time
+from array import array
+from collections import namedtuple, defaultdict
+from django.db import connections, router
+from django.contrib.contenttypes.models import ContentType
+from ..layout.models import Tray
+from ..recipes.models import RecipeRun, SetPoint
+from ..sensors.models import SensingPoint, latest_data_points
+from .models import (
+    Actuator, ActuatorEffect, latest_actuator_states, override_index
+)
+
+#: The state that an actuator should be in. `value` is `None` if there is not
+#: enough data to decide. `reason` is "override" if the state comes from an
+#: active override, "control" if it was computed from the set points and
+#: readings and "no_data" otherwise.
+DesiredState = namedtuple('DesiredState', ('actuator_id', 'value', 'reason'))
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+class ControlEngine:
+    """
+    Computes the desired state of every actuator with a bang-bang controller
+    with hysteresis.
+
+    For every effect of the control profile of an actuator, the deficit is the
+    distance between the set point of the property and its current value, in
+    the direction in which the actuator moves the property (given by the sign
+    of :attr:`~gro_api.actuators.models.ActuatorEffect.effect_on_active`). An
+    effect asks for the actuator to be turned on if the deficit exceeds the
+    :attr:`~gro_api.actuators.models.ActuatorEffect.threshold` of the effect
+    and off once the set point has been reached. In between, the actuator
+    keeps its last recorded state. The actuator is on if any of its effects
+    asks for it. Actuators with an active override take the value of the
+    override instead.
+
+    Resources that are located in a tray are controlled towards the set points
+    of that tray. Other resources (such as the air in the enclosure) are
+    controlled towards the mean of the set points of every tray.
+    """
+    #: The maximum age in seconds of readings that are taken into account
+    max_reading_age = 10 * 60
+
+    def load_set_points(self, now):
+        """
+        Returns a dictionary mapping `(tray id, property id)` to the current
+        set point of the property for the tray
+        """
+        runs = {}
+        active_runs = RecipeRun.objects.filter(
+            start_timestamp__lte=now, end_timestamp__gte=now
+        ).order_by('-start_timestamp', '-pk').select_related('compiled')
+        # Earlier runs take precedence, like in
+        # `Tray.update_current_recipe_run`
+        for run in active_runs:
+            runs[run.tray_id] = run
+        set_points = {}
+        stored_runs = []
+        for tray_id, run in runs.items():
+            if run.is_lazy:
+                for property_id, (timestamp, value) in \
+                        run.get_set_points_at(now).items():
+                    if value is not None:
+                        set_points[(tray_id, property_id)] = value
+            else:
+                stored_runs.append(run.pk)
+        if not stored_runs:
+            return set_points
+        opts = SetPoint._meta
+        connection = connections[router.db_for_read(SetPoint)]
+        qn = connection.ops.quote_name
+        # The latest set point of each property of each run, in one query
+        latest = (
+            '{table}.{timestamp} = (SELECT MAX(latest.{timestamp}) FROM '
+            '{table} latest WHERE latest.{run} = {table}.{run} AND '
+            'latest.{property} = {table}.{property} AND '
+            'latest.{timestamp} <= %s)'
+        ).format(
+            table=qn(opts.db_table),
+            timestamp=qn(opts.get_field('timestamp').column),
+            run=qn(opts.get_field('recipe_run').column),
+            property=qn(opts.get_field('property').column),
+        )
+        stored_set_points = SetPoint.objects.filter(
+            recipe_run__in=stored_runs
+        ).extra(where=[latest], params=[now]).order_by('pk').values_list(
+            'tray', 'property', 'value'
+        )
+        for tray_id, property_id, value in stored_set_points:
+            if value is not None:
+                set_points[(tray_id, property_id)] = value
+        return set_points
+
+    def load_readings(self, now):
+        """
+        Returns a dictionary mapping `(resource id, property id)` to the mean
+        of the recent readings of the active sensing points of the resource
+        """
+        sensing_points = list(SensingPoint.objects.filter(
+            is_active=True, sensor__isnull=False
+        ).values_list('pk', 'sensor__resource', 'property'))
+        data_points = latest_data_points.get_many(
+            [pk for pk, resource_id, property_id in sensing_points]
+        )
+        readings = defaultdict(list)
+        for pk, resource_id, property_id in sensing_points:
+            data_point = data_points.get(pk, None)
+            if data_point is not None and \
+                    now - data_point.timestamp <= self.max_reading_age:
+                readings[(resource_id, property_id)].append(data_point.value)
+        return {key: mean(values) for key, values in readings.items()}
+
+    def evaluate(self, now=None):
+        """
+        Returns a list of :class:`DesiredState` tuples for every actuator at
+        the time `now` (the current time by default)
+        """
+        if now is None:
+            now = time.time()
+        tray_type_id = ContentType.objects.get_for_model(Tray).pk
+        actuators = list(Actuator.objects.order_by('pk').values_list(
+            'pk', 'control_profile', 'resource', 'resource__location_type',
+            'resource__location_id'
+        ))
+        effects = defaultdict(list)
+        for profile_id, property_id, effect_on_active, threshold in \
+                ActuatorEffect.objects.values_list(
+                    'control_profile', 'property', 'effect_on_active',
+                    'threshold'
+                ):
+            if effect_on_active:
+                effects[profile_id].append(
+                    (property_id, 1 if effect_on_active > 0 else -1, threshold)
+                )
+        set_points = self.load_set_points(now)
+        shared_set_points = defaultdict(list)
+        for (tray_id, property_id), value in set_points.items():
+            shared_set_points[property_id].append(value)
+        shared_set_points = {
+            property_id: mean(values) for property_id, values in
+            shared_set_points.items()
+        }
+        readings = self.load_readings(now)
+        actuator_ids = [row[0] for row in actuators]
+        last_states = latest_actuator_states.get_many(actuator_ids)
+
+        # Flatten the (actuator, effect) pairs that have both a set point and
+        # a reading into parallel arrays
+        owners = array('l')
+        deficits = array('d')
+        thresholds = array('d')
+        for index, (pk, profile_id, resource_id, location_type_id,
+                    location_id) in enumerate(actuators):
+            for property_id, direction, threshold in effects[profile_id]:
+                if location_type_id == tray_type_id:
+                    set_point = set_points.get((location_id, property_id))
+                else:
+                    set_point = shared_set_points.get(property_id)
+                reading = readings.get((resource_id, property_id))
+                if set_point is None or reading is None:
+                    continue
+                owners.append(index)
+                deficits.append((set_point - reading) * direction)
+                thresholds.append(threshold)
+
+        # 1 means on, 0 means keep the last state and -1 means off
+        votes = [None] * len(actuators)
+        for index, deficit, threshold in zip(owners, deficits, thresholds):
+            vote = 1 if deficit > threshold else 0 if deficit > 0 else -1
+            if votes[index] is None or vote > votes[index]:
+                votes[index] = vote
+
+        results = []
+        for index, pk in enumerate(actuator_ids):
+            override = override_index.get(pk, now)
+            if override is not None:
+                results.append(DesiredState(pk, override.value, 'override'))
+                continue
+            vote = votes[index]
+            if vote is None:
+                results.append(DesiredState(pk, None, 'no_data'))
+                continue
+            if vote == 0:
+                last_state = last_states.get(pk, None)
+                value = 1.0 if last_state and last_state.value else 0.0
+            else:
+                value = 1.0 if vote > 0 else 0.0
+            results.append(DesiredState(pk, value, 'control'))
+        return results
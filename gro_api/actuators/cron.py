@@ -0,0 +1,75 @@
+import time
+import logging
+from django.conf import settings
+from django_cron import CronJobBase, Schedule
+from ..resources.models import RetentionPolicy
+from .models import (
+    ActuatorType, Actuator, actuator_state_rollups, actuator_state_archive
+)
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateActuatorStateRollups(CronJobBase):
+    """
+    This job folds the :class:`~gro_api.actuators.models.ActuatorState`
+    objects recorded since it last ran into the hourly and daily
+    :class:`~gro_api.actuators.models.ActuatorStateRollup` objects every 5
+    minutes.
+    """
+    RUN_EVERY_MINS = 5
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'actuators.update_actuator_state_rollups'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', UpdateActuatorStateRollups.code)
+        if not settings.SERVER_TYPE == settings.LEAF:
+            logger.error('This cron job should only be run on leaf servers')
+            return
+        count = actuator_state_rollups.fold()
+        logger.info('Folded %d actuator states into rollups', count)
+
+
+class ArchiveActuatorStates(CronJobBase):
+    """
+    This job moves the :class:`~gro_api.actuators.models.ActuatorState`
+    objects that are older than the retention period of their actuator into
+    the archive every hour. The retention period of an actuator is the longest
+    :class:`~gro_api.resources.models.RetentionPolicy` of the properties its
+    type affects, and states are kept forever if any of those properties has
+    no policy.
+    """
+    RUN_EVERY_MINS = 60
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'actuators.archive_actuator_states'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', ArchiveActuatorStates.code)
+        if not settings.SERVER_TYPE == settings.LEAF:
+            logger.error('This cron job should only be run on leaf servers')
+            return
+        now = time.time()
+        policies = {
+            policy.property_id: policy for policy in
+            RetentionPolicy.objects.all()
+        }
+        for actuator_type in ActuatorType.objects.prefetch_related(
+                'properties'):
+            try:
+                policy = max((
+                    policies[prop.pk] for prop in
+                    actuator_type.properties.all()
+                ), key=lambda policy: policy.days)
+            except (KeyError, ValueError):
+                continue
+            actuator_ids = Actuator.objects.filter(
+                actuator_type=actuator_type
+            ).values_list('pk', flat=True)
+            count = actuator_state_archive.archive(
+                actuator_ids, policy.get_cutoff(now)
+            )
+            logger.info(
+                'Archived %d actuator states for %s', count, actuator_type
+            )
@@ -0,0 +1,47 @@
+"""
+Time-weighted summaries of the states of binary actuators
+"""
+
+
+def scan_duty_cycle(previous, chunks, start, end, width):
+    """
+    Compute the time that a binary actuator spent on, the time for which its
+    state is known and the number of times it switched in each bucket of
+    `width` seconds between the timestamps `start` (inclusive) and `end`
+    (exclusive), in one pass over its states.
+
+    :param previous: The `(timestamp, value)` tuple of the last state before
+        `start`, or `None` if the state at `start` is unknown
+    :param chunks: An iterable of lists of `(timestamp, value)` tuples for the
+        states between `start` and `end`, in timestamp order
+    :returns: A dictionary mapping the start of each bucket that holds a known
+        state to an `[on time, known time, switches]` list
+    """
+    buckets = {}
+
+    def add_time(lower, upper, is_on):
+        while lower < upper:
+            bucket_start = lower // width * width
+            stop = min(upper, bucket_start + width)
+            bucket = buckets.setdefault(bucket_start, [0, 0, 0])
+            if is_on:
+                bucket[0] += stop - lower
+            bucket[1] += stop - lower
+            lower = stop
+
+    state = bool(previous[1]) if previous is not None else None
+    last_timestamp = start
+    for chunk in chunks:
+        for timestamp, value in chunk:
+            is_on = bool(value)
+            if state is not None:
+                add_time(last_timestamp, timestamp, state)
+                if is_on != state:
+                    buckets.setdefault(
+                        timestamp // width * width, [0, 0, 0]
+                    )[2] += 1
+            state = is_on
+            last_timestamp = timestamp
+    if state is not None:
+        add_time(last_timestamp, end, state)
+    return buckets
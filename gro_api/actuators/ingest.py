@@ -0,0 +1,9 @@
+from ..gro_api.ingest import TimeSeriesIngester
+from .models import ActuatorState, latest_actuator_states
+
+
+class ActuatorStateIngester(TimeSeriesIngester):
+    """ Inserts batches of actuator states in a compact format """
+    model = ActuatorState
+    series_field = 'actuator'
+    latest_store = latest_actuator_states
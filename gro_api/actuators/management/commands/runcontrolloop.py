@@ -0,0 +1,51 @@
+import json
+import time
+import logging
+from django.core.management.base import BaseCommand
+from ...control import ControlEngine
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute the desired state of every actuator at a fixed interval and '
+        'write the states that changed to stdout as JSON lines'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='The number of seconds between two ticks'
+        )
+        parser.add_argument(
+            '--once', action='store_true', default=False,
+            help='Run a single tick and exit'
+        )
+        parser.add_argument(
+            '--all', action='store_true', default=False,
+            help='Write every state on every tick, not only the changed ones'
+        )
+
+    def handle(self, *args, **options):
+        engine = ControlEngine()
+        previous = {}
+        while True:
+            start = time.time()
+            states = engine.evaluate(start)
+            for state in states:
+                if options['all'] or previous.get(state.actuator_id) != state:
+                    self.stdout.write(json.dumps({
+                        'actuator': state.actuator_id,
+                        'timestamp': int(start),
+                        'value': state.value,
+                        'reason': state.reason,
+                    }))
+            previous = {state.actuator_id: state for state in states}
+            logger.debug(
+                'Evaluated %d actuators in %.3f s', len(states),
+                time.time() - start
+            )
+            if options['once']:
+                break
+            time.sleep(max(0, options['interval'] - (time.time() - start)))
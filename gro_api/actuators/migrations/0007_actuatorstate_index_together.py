@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actuators', '0006_auto_20150902_1801'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='actuatorstate',
+            index_together=set([('actuator', 'timestamp')]),
+        ),
+    ]
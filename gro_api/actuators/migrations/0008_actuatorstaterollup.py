@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actuators', '0007_actuatorstate_index_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActuatorStateRollup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(3600, 'Hourly'), (86400, 'Daily')])),
+                ('timestamp', models.IntegerField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('count', models.PositiveIntegerField()),
+                ('actuator', models.ForeignKey(to='actuators.Actuator', related_name='rollups+')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ActuatorStateRollupMark',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('last_pk', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='actuatorstaterollup',
+            unique_together=set([('actuator', 'resolution', 'timestamp')]),
+        ),
+    ]
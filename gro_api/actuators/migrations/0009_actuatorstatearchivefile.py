@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actuators', '0008_actuatorstaterollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActuatorStateArchiveFile',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('month', models.IntegerField()),
+                ('min_timestamp', models.IntegerField()),
+                ('max_timestamp', models.IntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('actuator', models.ForeignKey(to='actuators.Actuator', related_name='archive_files+')),
+            ],
+            options={
+                'ordering': ['month'],
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='actuatorstatearchivefile',
+            unique_together=set([('actuator', 'month')]),
+        ),
+    ]
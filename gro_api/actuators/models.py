@@ -1,6 +1,11 @@
 import time
 from django.db import models
-from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Case, When, Value
+from ..gro_api.cache import LatestValueStore
+from ..gro_api.rollups import RollupModel, RollupMarkModel, TimeSeriesRollup
+from ..gro_api.archive import ArchiveFileModel, TimeSeriesArchive
+from ..gro_api.events import EventSource, event_buffer
+from ..gro_api.intervals import ModelIntervalIndex
 from ..resources.models import (
     ResourceType, ResourceProperty, ResourceEffect, Resource
 )
@@ -89,21 +94,40 @@ class Actuator(models.Model):
     )
 
     def update_override(self):
+        Actuator.update_overrides([self])
+
+    @classmethod
+    def update_overrides(cls, actuators):
+        """
+        Set the :attr:`current_override` of every actuator in the list
+        `actuators` to the override that is active for it right now. An active
+        override stays current until it ends, after which the earliest
+        override that has started and not ended yet (if any) takes its place.
+        The overrides are read from :data:`override_index` and the actuators
+        that changed are saved with one update.
+        """
         current_time = time.time()
-        if self.current_override and \
-                current_time > self.current_override.end_timestamp:
-            self.current_override = None
-            self.save()
-        if not self.current_override:
-            try:
-                next_override = ActuatorOverride.objects.filter(
-                    actuator=self, end_timestamp__gte=time.time()
-                ).earliest()
-                if current_time >= next_override.start_timestamp:
-                    self.current_override = next_override
-                    self.save()
-            except ObjectDoesNotExist:
-                pass
+        pending = [
+            actuator for actuator in actuators if not (
+                actuator.current_override and
+                current_time <= actuator.current_override.end_timestamp
+            )
+        ]
+        if not pending:
+            return
+        changed = {}
+        for actuator in pending:
+            override = override_index.get(actuator.pk, current_time)
+            if actuator.current_override_id != (override and override.pk):
+                changed[actuator.pk] = override and override.pk
+            actuator.current_override = override
+        if changed:
+            cls.objects.filter(pk__in=changed.keys()).update(
+                current_override=Case(*(
+                    When(pk=pk, then=Value(override_id)) for pk, override_id
+                    in changed.items() if override_id is not None
+                ), default=Value(None), output_field=models.IntegerField())
+            )
 
     def __str__(self):
         return self.name
@@ -113,7 +137,41 @@ class ActuatorState(models.Model):
     class Meta:
         ordering = ['timestamp']
         get_latest_by = 'timestamp'
+        index_together = ('actuator', 'timestamp')
 
     actuator = models.ForeignKey(Actuator, related_name='states+')
     timestamp = models.IntegerField(blank=True, default=time.time)
     value = models.FloatField()
+
+
+class ActuatorStateRollup(RollupModel):
+    class Meta(RollupModel.Meta):
+        unique_together = ('actuator', 'resolution', 'timestamp')
+
+    actuator = models.ForeignKey(Actuator, related_name='rollups+')
+
+
+class ActuatorStateRollupMark(RollupMarkModel):
+    pass
+
+
+class ActuatorStateArchiveFile(ArchiveFileModel):
+    class Meta(ArchiveFileModel.Meta):
+        unique_together = ('actuator', 'month')
+
+    actuator = models.ForeignKey(Actuator, related_name='archive_files+')
+
+
+latest_actuator_states = LatestValueStore(ActuatorState, 'actuator')
+actuator_state_rollups = TimeSeriesRollup(
+    ActuatorState, ActuatorStateRollup, ActuatorStateRollupMark, 'actuator'
+)
+actuator_state_archive = TimeSeriesArchive(
+    ActuatorState, ActuatorStateArchiveFile, 'actuator', actuator_state_rollups,
+    latest_actuator_states
+)
+event_buffer.register(EventSource(
+    'actuatorState', ActuatorState, 'actuator', 'resource'
+))
+#: The overrides that have not ended yet, by actuator
+override_index = ModelIntervalIndex(ActuatorOverride, 'actuator')
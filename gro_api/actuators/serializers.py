@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from ..gro_api.serializers import BaseSerializer
+from ..sensors.serializers import OptionalHyperlinkedIdentityField
 from .models import (
     ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState
 )
@@ -112,3 +113,5 @@ class ActuatorSerializer(BaseSerializer):
 class ActuatorStateSerializer(BaseSerializer):
     class Meta:
         model = ActuatorState
+
+    serializer_url_field = OptionalHyperlinkedIdentityField
@@ -1,8 +1,15 @@
+import time
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from ..gro_api.test import APITestCase, run_with_any_layout
+from ..gro_api.test import APITestCase, run_with_any_layout, run_with_layouts
 from ..resources.models import ResourceType, ResourceProperty, ResourceEffect
-from .models import ActuatorType, ControlProfile, Actuator
+from ..recipes.models import Recipe, RecipeRun, SetPoint, ActuatorOverride
+from ..sensors.models import (
+    SensorType, Sensor, SensingPoint, DataPoint, latest_data_points
+)
+from .models import (
+    ActuatorType, ControlProfile, Actuator, ActuatorState, override_index
+)
 from .serializers import ActuatorTypeSerializer, ActuatorSerializer
 
 class ActuatorAuthMixin:
@@ -18,10 +25,41 @@ class ActuatorAuthMixin:
 
     def setUp(self):
         self.client.force_authenticate(user=self.user)
+        # The resources that `create_actuator` has installed actuators in, by
+        # location
+        self.resources = {}
 
     def tearDown(self):
         self.client.force_authenticate()
 
+    def create_actuator(self, location=None):
+        # Only one resource of a type is allowed per location, so actuators
+        # created in the same location share a resource
+        location = location or self.url_for_object('enclosure', 1)
+        if location not in self.resources:
+            air_id = ResourceType.objects.get_by_natural_key('A').pk
+            res = self.client.post(self.url_for_object('resource'), data={
+                'resource_type': self.url_for_object('resourceType', air_id),
+                'location': location
+            })
+            self.assertEqual(res.status_code, 201)
+            self.resources[location] = res.data['url']
+        heater_id = ActuatorType.objects.get_by_natural_key(
+            'Relay-Controlled Air Heater'
+        ).pk
+        control_profile_id = ControlProfile.objects.get_by_natural_key(
+            'Relay-Controlled Air Heater', 'Default Profile'
+        ).pk
+        res = self.client.post(self.url_for_object('actuator'), data={
+            'actuator_type': self.url_for_object('actuatorType', heater_id),
+            'control_profile': self.url_for_object(
+                'controlProfile', control_profile_id
+            ),
+            'resource': self.resources[location],
+        })
+        self.assertEqual(res.status_code, 201)
+        return Actuator.objects.get(pk=res.data['url'].split('/')[-2])
+
 class ActuatorTypeTestCase(ActuatorAuthMixin, APITestCase):
     @run_with_any_layout
     def test_visible_fields(self):
@@ -186,6 +224,210 @@ class ActuatorTestCase(ActuatorAuthMixin, APITestCase):
         res = self.client.put(actuator['url'], data=actuator_info)
         self.assertEqual(res.status_code, 400)
 
-class ActuatorStateTestCase(APITestCase):
-    # TODO: Test state routes
-    pass
+    @run_with_any_layout
+    def test_current_override(self):
+        now = int(time.time())
+        actuators = [self.create_actuator() for _ in range(3)]
+        expired = ActuatorOverride.objects.create(
+            actuator=actuators[0], start_timestamp=now - 100,
+            end_timestamp=now - 50, value=1
+        )
+        actuators[0].current_override = expired
+        actuators[0].save()
+        active = [
+            ActuatorOverride.objects.create(
+                actuator=actuator, start_timestamp=now - start,
+                end_timestamp=now + 1000, value=value
+            ) for actuator, start, value in (
+                (actuators[1], 10, 2), (actuators[1], 20, 3),
+                (actuators[2], 10, 4)
+            )
+        ]
+        # Overrides that have not started yet don't count
+        ActuatorOverride.objects.create(
+            actuator=actuators[0], start_timestamp=now + 500,
+            end_timestamp=now + 1000, value=5
+        )
+        res = self.client.get(self.url_for_object('actuator'))
+        self.assertEqual(res.status_code, 200)
+        values = {
+            int(row['url'].split('/')[-2]): row['override_value']
+            for row in res.data['results']
+        }
+        self.assertEqual(
+            [values[actuator.pk] for actuator in actuators], [None, 3, 4]
+        )
+        self.assertEqual([
+            actuator.current_override_id for actuator in
+            Actuator.objects.filter(pk__in=[a.pk for a in actuators])
+            .order_by('pk')
+        ], [None, active[1].pk, active[2].pk])
+        # The current override is kept until it ends
+        active[0].start_timestamp = now - 30
+        active[0].save()
+        res = self.client.get(self.url_for_object('actuator', actuators[1].pk))
+        self.assertEqual(res.data['override_value'], 3)
+
+    @run_with_any_layout
+    def test_override_index(self):
+        now = int(time.time())
+        actuator = self.create_actuator()
+        self.assertIsNone(override_index.get(actuator.pk))
+        overrides = [
+            ActuatorOverride.objects.create(
+                actuator=actuator, start_timestamp=now + start,
+                end_timestamp=now + end, value=start
+            ) for start, end in ((0, 100), (10, 500), (200, 300))
+        ]
+        self.assertEqual([
+            override_index.get(actuator.pk, now + offset)
+            for offset in (50, 150, 250, 600)
+        ], [overrides[0], overrides[1], overrides[1], None])
+        self.assertEqual(
+            override_index.get_all(now + 50), {actuator.pk: overrides[0]}
+        )
+        # Changes should be picked up without waiting for the next check
+        overrides[1].delete()
+        self.assertEqual(
+            override_index.get(actuator.pk, now + 250), overrides[2]
+        )
+
+    @run_with_layouts('tray')
+    def test_desired_states(self):
+        now = int(time.time())
+        res = self.client.post(self.url_for_object('tray'), data={
+            'parent': self.url_for_object('enclosure', 1),
+            'x': 0, 'y': 0, 'z': 0, 'length': 1, 'width': 1, 'height': 1
+        })
+        self.assertEqual(res.status_code, 201)
+        tray_id = int(res.data['url'].split('/')[-2])
+        heater = self.create_actuator(location=res.data['url'])
+        other = self.create_actuator()
+        air_temp = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        recipe = Recipe.objects.create(name='test', file='recipes/test')
+        run = RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_id, start_timestamp=now - 100,
+            end_timestamp=now + 1000
+        )
+        for offset, value in ((-90, 10), (-50, 25), (50, 40)):
+            SetPoint.objects.create(
+                tray_id=tray_id, property=air_temp, recipe_run=run,
+                timestamp=now + offset, value=value
+            )
+        sensor = Sensor.objects.create(
+            index=1000, sensor_type=SensorType.objects.get(name='DHT22'),
+            resource=heater.resource
+        )
+        sensing_point = SensingPoint.objects.create(
+            index=1000, sensor=sensor, property=air_temp, is_pseudo=False
+        )
+        ActuatorOverride.objects.create(
+            actuator=other, start_timestamp=now - 10, end_timestamp=now + 100,
+            value=0.5
+        )
+        url = self.url_for_object('actuator') + 'desired_states/'
+
+        def get_states():
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            return [(row['value'], row['reason']) for row in res.data]
+
+        self.assertEqual(get_states(), [(None, 'no_data'), (0.5, 'override')])
+        # The reading is more than the threshold below the set point
+        DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=now - 20, value=20
+        )
+        self.assertEqual(get_states()[0], (1.0, 'control'))
+        # Within the threshold, the last state is kept
+        data_point = DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=now - 10, value=24.5
+        )
+        latest_data_points.update([data_point])
+        self.assertEqual(get_states()[0], (0.0, 'control'))
+        ActuatorState.objects.create(actuator=heater, timestamp=now, value=1)
+        self.assertEqual(get_states()[0], (1.0, 'control'))
+        data_point = DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=now - 5, value=25.5
+        )
+        latest_data_points.update([data_point])
+        self.assertEqual(get_states()[0], (0.0, 'control'))
+
+class ActuatorStateTestCase(ActuatorAuthMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user.groups.add(Group.objects.get(name='Firmware'))
+
+    @run_with_any_layout
+    def test_ingest(self):
+        first = self.create_actuator()
+        second = self.create_actuator()
+        state_url = self.url_for_object('actuator', first.pk) + 'state/'
+        res = self.client.get(state_url)
+        self.assertEqual(res.status_code, 500)
+        url = self.url_for_object('actuatorState') + 'ingest/'
+        data = {
+            'actuators': [first.pk, second.pk],
+            'data': [[0, 100, 1], [1, 100, 0], [0, 200, 0]],
+        }
+        res = self.client.post(url, data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['count'], 3)
+        res = self.client.get(state_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((res.data['timestamp'], res.data['value']), (200, 0))
+        res = self.client.post(url, data=[[second.pk + 1000, 300, 1]])
+        self.assertEqual(res.status_code, 400)
+        # Lists of states can also be posted to the list view
+        actuator_url = self.url_for_object('actuator', first.pk)
+        data = [
+            {'actuator': actuator_url, 'timestamp': t, 'value': 1}
+            for t in (300, 400)
+        ]
+        res = self.client.post(
+            self.url_for_object('actuatorState') + '?many=true', data=data
+        )
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(len(res.data), 2)
+        res = self.client.get(state_url)
+        self.assertEqual((res.data['timestamp'], res.data['value']), (400, 1))
+        res = self.client.post(
+            self.url_for_object('actuatorState'), data=data[0]
+        )
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(ActuatorState.objects.count(), 6)
+
+    @run_with_any_layout
+    def test_duty_cycle(self):
+        actuator = self.create_actuator()
+        idle = self.create_actuator()
+        ActuatorState.objects.bulk_create([
+            ActuatorState(actuator=actuator, timestamp=t, value=v)
+            for t, v in ((1050, 1), (1130, 0), (1150, 1), (1250, 0))
+        ])
+        url = self.url_for_object('actuatorState') + 'duty_cycle/'
+        res = self.client.get(url, {
+            'bucket': 100, 'min_time': 1100, 'max_time': 1299
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([
+            (row['timestamp'], row['on_time'], row['known_time'],
+             row['duty_cycle'], row['switches']) for row in res.data
+        ], [(1100, 80, 100, 0.8, 2), (1200, 50, 100, 0.5, 1)])
+        self.assertTrue(res.data[0]['actuator'].endswith(
+            self.url_for_object('actuator', actuator.pk)
+        ))
+        # Only the known part of a bucket is counted
+        res = self.client.get(url, {
+            'bucket': 100, 'min_time': 1000, 'max_time': 1099,
+            'actuator': [actuator.pk, idle.pk]
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(row['on_time'], row['known_time']) for row in res.data],
+            [(50, 50)]
+        )
+        res = self.client.get(url, {
+            'bucket': 100, 'min_time': 1000, 'actuator': idle.pk + 1000
+        })
+        self.assertEqual(res.status_code, 400)
@@ -1,16 +1,29 @@
 import time
 import django_filters
-from django.core.exceptions import ObjectDoesNotExist
+from rest_framework import status
+from rest_framework.reverse import reverse
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.field_mapping import get_detail_view_name
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.decorators import detail_route
-from rest_framework.exceptions import APIException
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
 from ..gro_api.permissions import EnforceReadOnly
 from ..gro_api.filters import HistoryFilterMixin
+from ..gro_api.history import (
+    HistoryAggregateMixin, HistoryExportMixin, HistoryIngestMixin,
+    HistoryListMixin, parse_positive_int
+)
+from ..gro_api.pagination import TimeSeriesPagination
+from ..gro_api.parsers import PackedRows, PackedTimeSeriesParser
 from .models import (
-    ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState
+    ActuatorType, ControlProfile, ActuatorEffect, Actuator, ActuatorState,
+    latest_actuator_states, actuator_state_rollups, actuator_state_archive
 )
+from .ingest import ActuatorStateIngester
+from .duty_cycle import scan_duty_cycle
+from .control import ControlEngine
 from .serializers import (
     ActuatorTypeSerializer, ControlProfileSerializer, ActuatorEffectSerializer,
     ActuatorSerializer, ActuatorStateSerializer
@@ -43,29 +56,50 @@ class ActuatorEffectViewSet(ModelViewSet):
 
 class ActuatorViewSet(ModelViewSet):
     """ A physical actuator instance """
-    queryset = Actuator.objects.all()
+    queryset = Actuator.objects.select_related('current_override')
     serializer_class = ActuatorSerializer
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.update_override()
+        Actuator.update_overrides([instance])
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
 
-        for instance in queryset:
-            instance.update_override()
-
         page = self.paginate_queryset(queryset)
         if page is not None:
+            Actuator.update_overrides(page)
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(queryset, many=True)
+        actuators = list(queryset)
+        Actuator.update_overrides(actuators)
+        serializer = self.get_serializer(actuators, many=True)
         return Response(serializer.data)
 
+    @list_route(methods=["get"])
+    def desired_states(self, request):
+        """
+        Get the state that every actuator should be in right now, as computed
+        by the control engine from the current set points, the latest sensor
+        readings and active overrides. `value` is `null` if there is not
+        enough data to decide, and `reason` is one of "override", "control"
+        and "no_data".
+        """
+        view_name = get_detail_view_name(Actuator)
+        return Response([
+            {
+                'actuator': reverse(
+                    view_name, kwargs={'pk': state.actuator_id},
+                    request=request
+                ),
+                'value': state.value,
+                'reason': state.reason,
+            } for state in ControlEngine().evaluate()
+        ])
+
     # TODO: Remove this once frontend switches to new override endpoint
     @detail_route(methods=["post"])
     def override(self, request, pk=None):
@@ -95,14 +129,13 @@ class ActuatorViewSet(ModelViewSet):
         serializer: gro_api.actuators.serializers.ActuatorStateSerializer
         """
         instance = self.get_object()
-        try:
-            queryset = ActuatorState.objects.filter(origin=instance).latest()
-        except ObjectDoesNotExist:
+        state = latest_actuator_states.get(instance.pk)
+        if state is None:
             raise APIException(
                 'No state has been recorded for this actuator yet'
             )
         serializer = ActuatorStateSerializer(
-            queryset, context={'request': request}
+            state, context={'request': request}
         )
         return Response(serializer.data)
 
@@ -113,23 +146,138 @@ class ActuatorStateFilter(HistoryFilterMixin):
         fields = ['actuator', 'min_time', 'max_time']
 
 
-class ActuatorStateViewSet(ModelViewSet):
+class ActuatorStateViewSet(HistoryAggregateMixin, HistoryExportMixin,
+                           HistoryIngestMixin, HistoryListMixin,
+                           ModelViewSet):
     """ The state of an actuator at a given time """
     queryset = ActuatorState.objects.all()
     serializer_class = ActuatorStateSerializer
+    pagination_class = TimeSeriesPagination
     filter_class = ActuatorStateFilter
+    series_field = 'actuator'
+    rollup = actuator_state_rollups
+    archive = actuator_state_archive
+    export_fields = ('actuator', 'timestamp', 'value')
+    ingester_class = ActuatorStateIngester
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [
+        PackedTimeSeriesParser
+    ]
+    #: The maximum number of buckets in one duty cycle response
+    max_duty_cycle_buckets = 100000
+
+    def get_binary_actuator_ids(self):
+        """
+        Returns the ids of the binary actuators given in the query parameter
+        `actuator`, or of every binary actuator if there are none
+        """
+        actuators = Actuator.objects.filter(actuator_type__is_binary=True)
+        try:
+            actuator_ids = set(
+                int(pk) for pk in self.request.query_params.getlist('actuator')
+            )
+        except ValueError:
+            raise ValidationError('Actuators must be given as primary keys')
+        if not actuator_ids:
+            return list(actuators.order_by('pk').values_list('pk', flat=True))
+        found = set(actuators.filter(pk__in=actuator_ids).values_list(
+            'pk', flat=True
+        ))
+        invalid = actuator_ids - found
+        if invalid:
+            raise ValidationError(
+                'Invalid binary actuator ids: {}'.format(
+                    ', '.join(str(pk) for pk in sorted(invalid))
+                )
+            )
+        return sorted(actuator_ids)
+
+    @list_route(methods=['get'])
+    def duty_cycle(self, request):
+        """
+        Get the fraction of time that binary actuators were on, and the number
+        of times they switched, in fixed-width time buckets. The bucket width
+        in seconds is read from the query parameter `bucket`, and the time
+        range from `min_time` and `max_time` (which defaults to now). The
+        query parameter `actuator` (which can be repeated) restricts the
+        results to the given actuators. Time before the first recorded state
+        of an actuator is not counted, so `known_time` can be shorter than the
+        bucket.
+        """
+        params = request.query_params
+        width = parse_positive_int(params, 'bucket')
+        min_time = parse_positive_int(params, 'min_time')
+        now = int(time.time())
+        max_time = parse_positive_int(params, 'max_time', now)
+        # The last state lasts until now at most
+        end = min(max_time + 1, now)
+        if end <= min_time:
+            raise ValidationError('The time range is empty.')
+        actuator_ids = self.get_binary_actuator_ids()
+        first_bucket = min_time // width * width
+        bucket_count = (end - 1 - first_bucket) // width + 1
+        if bucket_count * len(actuator_ids) > self.max_duty_cycle_buckets:
+            raise ValidationError(
+                'Too many buckets. Use a larger bucket, a shorter time range '
+                'or fewer actuators.'
+            )
+        results = []
+        for actuator_id in actuator_ids:
+            buckets = scan_duty_cycle(
+                self.get_previous_row(actuator_id, min_time),
+                self.iterate_series(actuator_id, min_time, end - 1),
+                min_time, end, width
+            )
+            actuator_url = self.get_series_url(actuator_id)
+            for timestamp in sorted(buckets):
+                on_time, known_time, switches = buckets[timestamp]
+                results.append({
+                    'actuator': actuator_url,
+                    'timestamp': timestamp,
+                    'on_time': on_time,
+                    'known_time': known_time,
+                    'duty_cycle': on_time / known_time if known_time else None,
+                    'switches': switches,
+                })
+        return Response(results)
 
     def create(self, request, *args, **kwargs):
+        if isinstance(request.data, PackedRows):
+            return self.ingest(request)
         many = request.query_params.get('many', False)
         serializer = self.get_serializer(data=request.data, many=many)
-        serializer.is_value(raise_exception=True)
+        serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
 
     def perform_create(self, serializer):
         if getattr(serializer, 'many', False):
-            ActuatorState.objects.bulk_create([
-                ActuatorState(**child_attrs) for child_attrs in
-                serializer.validated_data
+            self.ingester_class().insert([
+                (
+                    attrs['actuator'].pk,
+                    int(attrs.get('timestamp', time.time())), attrs['value']
+                ) for attrs in serializer.validated_data
             ])
         else:
-            serializer.save()
+            latest_actuator_states.update([serializer.save()])
+
+    def perform_update(self, serializer):
+        old_position = (
+            serializer.instance.actuator_id, serializer.instance.timestamp
+        )
+        instance = serializer.save()
+        latest_actuator_states.invalidate(
+            {old_position[0], instance.actuator_id}
+        )
+        actuator_state_rollups.refold(
+            [old_position, (instance.actuator_id, instance.timestamp)]
+        )
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        latest_actuator_states.invalidate([instance.actuator_id])
+        actuator_state_rollups.refold(
+            [(instance.actuator_id, instance.timestamp)]
+        )
@@ -11,3 +11,11 @@ class Command(BaseCommand):
         caches['default'].delete(Enclosure.get_cache_key())
         from gro_api.gro_api.utils import system_layout
         system_layout.clear_cache()
+        caches['shared'].clear()
+        from gro_api.gro_api.events import event_buffer
+        event_buffer.clear()
+        from gro_api.actuators.models import override_index
+        override_index.clear()
+        from gro_api.recipes.models import CompiledRecipe, recipe_run_index
+        CompiledRecipe.steps_cache.clear()
+        recipe_run_index.clear()
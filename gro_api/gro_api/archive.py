@@ -0,0 +1,269 @@
+"""
+This module defines compressed archives of old rows of the time series models
+in this project. Rows that are older than the retention period of their series
+are moved out of the database into one gzipped CSV file per series and month
+under ``settings.ARCHIVE_ROOT``, which keeps the hot tables (and their indexes)
+small on leaf servers.
+
+Each time series app defines a concrete subclass of :class:`ArchiveFileModel`
+that indexes the archive files and a :class:`TimeSeriesArchive` that ties it to
+the raw model.
+"""
+import io
+import os
+import csv
+import gzip
+import heapq
+import datetime
+from itertools import groupby
+from django.conf import settings
+from django.db import models, transaction
+from .history import iterate_history
+
+
+class ArchiveFileModel(models.Model):
+    """
+    Describes the archive file of one series for the calendar month (in UTC)
+    starting at :attr:`month`. Subclasses must add a foreign key to the series
+    model and should make it unique together with :attr:`month`.
+    """
+    class Meta:
+        abstract = True
+        ordering = ['month']
+
+    month = models.IntegerField()
+    min_timestamp = models.IntegerField()
+    max_timestamp = models.IntegerField()
+    count = models.PositiveIntegerField()
+
+
+def get_month(timestamp):
+    """ Returns the timestamp of the start of the month of `timestamp` """
+    date = datetime.datetime.utcfromtimestamp(timestamp)
+    start = datetime.datetime(date.year, date.month, 1)
+    return int((start - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+class TimeSeriesArchive:
+    """
+    Moves rows of a time series model (a model with a foreign key identifying
+    the series, a `timestamp` and a `value`) between the database and the
+    archive files, and reads them back.
+
+    Archive files hold `timestamp,value` lines sorted by timestamp. Rows are
+    deleted from the database in the same transaction in which they are
+    written out, so a crash can duplicate at most one batch in the archive but
+    never loses rows. Only rows that have already been folded into the rollups
+    are archived, so aggregates over archived ranges can still be read from
+    the rollups.
+
+    :param model: The time series model
+    :param archive_model: The subclass of :class:`ArchiveFileModel` for `model`
+    :param str series_field: The name of the foreign key that identifies the
+        series a row belongs to, on both `model` and `archive_model`
+    :param rollup: The :class:`~gro_api.gro_api.rollups.TimeSeriesRollup` of
+        `model`
+    :param latest_store: The :class:`~gro_api.gro_api.cache.LatestValueStore`
+        of `model`, if it has one. Archived series are invalidated in it.
+    """
+    #: The maximum number of rows written and deleted in one transaction
+    batch_size = 2000
+
+    def __init__(self, model, archive_model, series_field, rollup,
+                 latest_store=None):
+        self.model = model
+        self.archive_model = archive_model
+        self.series_field = series_field
+        self.series_attname = model._meta.get_field(series_field).attname
+        self.rollup = rollup
+        # Refolded rollups have to include the rows that were archived
+        rollup.archive = self
+        self.latest_store = latest_store
+
+    def get_path(self, series_id, month):
+        opts = self.model._meta
+        date = datetime.datetime.utcfromtimestamp(month)
+        return os.path.join(
+            settings.ARCHIVE_ROOT, opts.app_label, opts.model_name,
+            str(series_id), '{:04d}-{:02d}.csv.gz'.format(date.year, date.month)
+        )
+
+    def read_file(self, path):
+        with gzip.open(path, 'rt', newline='') as archive_file:
+            for timestamp, value in csv.reader(archive_file):
+                yield int(timestamp), float(value)
+
+    def write_file(self, path, rows, append=True):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab' if append else 'wb') as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode='wb') as archive_file:
+                text_file = io.TextIOWrapper(
+                    archive_file, encoding='ascii', newline=''
+                )
+                writer = csv.writer(text_file, lineterminator='\n')
+                writer.writerows(
+                    (int(timestamp), float(value)) for timestamp, value in rows
+                )
+                # Flush into the gzip stream without closing it
+                text_file.detach()
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+    def write(self, series_id, month, rows):
+        """
+        Add `rows`, a list of `(timestamp, value)` tuples in timestamp order
+        that all fall in `month`, to the archive of the series `series_id`
+        """
+        path = self.get_path(series_id, month)
+        try:
+            record = self.archive_model.objects.get(**{
+                self.series_field: series_id, 'month': month
+            })
+        except self.archive_model.DoesNotExist:
+            record = self.archive_model(**{
+                self.series_attname: series_id, 'month': month,
+                'min_timestamp': rows[0][0], 'max_timestamp': rows[-1][0],
+                'count': 0
+            })
+        if record.count and rows[0][0] < record.max_timestamp:
+            # Rows that arrived late have to be merged into the file to keep
+            # it sorted. Appending is the common case.
+            merged = list(heapq.merge(
+                self.read_file(path), rows, key=lambda row: row[0]
+            ))
+            self.write_file(path + '.tmp', merged, append=False)
+            os.replace(path + '.tmp', path)
+        else:
+            self.write_file(path, rows)
+        record.min_timestamp = min(record.min_timestamp, rows[0][0])
+        record.max_timestamp = max(record.max_timestamp, rows[-1][0])
+        record.count += len(rows)
+        record.save()
+
+    def archive(self, series_ids, cutoff):
+        """
+        Move the rows of the series `series_ids` that are older than the
+        timestamp `cutoff` from the database to the archive and return the
+        number of rows moved
+        """
+        self.rollup.fold()
+        last_pk = self.rollup.get_mark()
+        count = 0
+        archived_ids = set()
+        for series_id in series_ids:
+            queryset = self.model.objects.filter(**{
+                self.series_field: series_id, 'timestamp__lt': cutoff,
+                'pk__lte': last_pk
+            })
+            chunks = iterate_history(
+                queryset, ('timestamp', 'value', 'pk'), self.batch_size
+            )
+            for chunk in chunks:
+                with transaction.atomic():
+                    months = groupby(chunk, lambda row: get_month(row[0]))
+                    for month, rows in months:
+                        self.write(series_id, month, [
+                            (timestamp, value) for timestamp, value, pk in rows
+                        ])
+                    pks = [row[2] for row in chunk]
+                    for start in range(0, len(pks), 500):
+                        self.model.objects.filter(
+                            pk__in=pks[start:start + 500]
+                        ).delete()
+                count += len(chunk)
+                archived_ids.add(series_id)
+        if self.latest_store is not None and archived_ids:
+            # The cached latest row of a series may have just been archived
+            self.latest_store.invalidate(archived_ids)
+        return count
+
+    def read(self, series_ids=None, min_time=None, max_time=None):
+        """
+        Generate `(series id, timestamp, value)` tuples for the archived rows
+        of the series `series_ids` (or of every series if it is `None`) between
+        `min_time` and `max_time` inclusive, in timestamp order. Returns `None`
+        if no rows in that range have been archived.
+        """
+        records = self.archive_model.objects.all()
+        if series_ids is not None:
+            records = records.filter(**{
+                '{}__in'.format(self.series_field): series_ids
+            })
+        if min_time is not None:
+            records = records.filter(max_timestamp__gte=min_time)
+        if max_time is not None:
+            records = records.filter(min_timestamp__lte=max_time)
+        records = list(records.order_by(self.series_field, 'month').values_list(
+            self.series_field, 'month'
+        ))
+        if not records:
+            return None
+        streams = [
+            self.read_series(series_id, [month for _, month in months],
+                             min_time, max_time)
+            for series_id, months in groupby(records, lambda row: row[0])
+        ]
+        return heapq.merge(*streams, key=lambda row: row[1])
+
+    def get_filters(self, query_params):
+        """
+        Returns the `(series_ids, min_time, max_time)` arguments of
+        :meth:`read` given by the query parameters of a history list view, or
+        `None` if the series filter is invalid
+        """
+        series_ids = None
+        if query_params.get(self.series_field, None):
+            try:
+                series_ids = [int(query_params[self.series_field])]
+            except ValueError:
+                return None
+        bounds = []
+        for name in ('min_time', 'max_time'):
+            try:
+                bounds.append(float(query_params[name]))
+            except (KeyError, ValueError):
+                bounds.append(None)
+        return (series_ids, ) + tuple(bounds)
+
+    def read_filtered(self, query_params):
+        """
+        Like :meth:`read`, but reads the series and time range from the query
+        parameters of a history list view
+        """
+        filters = self.get_filters(query_params)
+        if filters is None:
+            return None
+        return self.read(*filters)
+
+    def read_previous(self, series_id, timestamp, after=None):
+        """
+        Returns the `(timestamp, value)` tuple of the last archived row of the
+        series `series_id` before `timestamp`, or `None` if there is no such
+        row. Only rows after the timestamp `after` are looked at if it is
+        given.
+        """
+        records = self.archive_model.objects.filter(**{
+            self.series_field: series_id, 'min_timestamp__lt': timestamp
+        })
+        if after is not None:
+            records = records.filter(max_timestamp__gt=after)
+        for month in records.order_by('-month').values_list(
+                'month', flat=True):
+            previous = None
+            for row in self.read_file(self.get_path(series_id, month)):
+                if row[0] >= timestamp:
+                    break
+                previous = row
+            if previous is not None and (after is None or previous[0] > after):
+                return previous
+        return None
+
+    def read_series(self, series_id, months, min_time, max_time):
+        for month in months:
+            for timestamp, value in self.read_file(
+                    self.get_path(series_id, month)):
+                if min_time is not None and timestamp < min_time:
+                    continue
+                if max_time is not None and timestamp > max_time:
+                    return
+                yield series_id, timestamp, value
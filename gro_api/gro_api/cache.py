@@ -0,0 +1,202 @@
+"""
+This module defines caches that are shared between all of the worker processes
+serving a farm. Keys are prefixed with the name of the farm being accessed so
+that a root server can keep the state of several farms in one cache.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, router
+
+if settings.SERVER_TYPE == settings.LEAF:
+    get_farm_name = lambda: None
+else:
+    from .middleware import get_request_cache
+    get_farm_name = lambda: get_request_cache().get('farm')
+
+
+def get_shared_cache():
+    """ Returns the cache that is shared between all worker processes """
+    return caches['shared']
+
+
+def get_farm_cache_key(*parts):
+    """
+    Builds a key in the shared cache that is specific to the farm referenced
+    by the current request
+    """
+    return ':'.join(str(part) for part in (get_farm_name(),) + parts)
+
+
+class LatestValueStore:
+    """
+    Keeps the most recent row of each series of a time series model (a model
+    with a foreign key identifying the series, a `timestamp` and a `value`) in
+    the shared cache so that the current value of a series can be read without
+    sorting its history.
+
+    The store is write-through: views that insert rows must pass them to
+    :meth:`update`. Series that are not cached yet are read from the database
+    once, either by the first read or by the first update, and then served
+    from the cache.
+
+    :param model: The time series model
+    :param str series_field: The name of the foreign key on `model` that
+        identifies the series a row belongs to
+    """
+    def __init__(self, model, series_field):
+        self.model = model
+        self.series_field = series_field
+        self.series_attname = model._meta.get_field(series_field).attname
+
+    def get_cache_key(self, series_id):
+        opts = self.model._meta
+        return get_farm_cache_key(
+            'latest', opts.app_label, opts.model_name, series_id
+        )
+
+    def to_entry(self, instance):
+        return (
+            instance.pk, getattr(instance, self.series_attname),
+            instance.timestamp, instance.value
+        )
+
+    def to_instance(self, entry):
+        pk, series_id, timestamp, value = entry
+        return self.model(**{
+            'pk': pk, self.series_attname: series_id, 'timestamp': timestamp,
+            'value': value
+        })
+
+    def get(self, series_id):
+        """
+        Returns an unsaved instance of the model holding the most recent row
+        for the series `series_id`, or `None` if the series is empty. Rows
+        inserted in bulk do not have a primary key.
+        """
+        cache = get_shared_cache()
+        key = self.get_cache_key(series_id)
+        entry = cache.get(key)
+        if entry is None:
+            try:
+                instance = self.model.objects.filter(
+                    **{self.series_attname: series_id}
+                ).latest()
+            except ObjectDoesNotExist:
+                return None
+            entry = self.to_entry(instance)
+            # Use `add` so that we never overwrite a newer row written by
+            # another worker since we read from the database
+            cache.add(key, entry, None)
+        return self.to_instance(entry)
+
+    def get_many(self, series_ids):
+        """
+        Returns a dictionary mapping the ids in `series_ids` to unsaved
+        instances holding the most recent row of each series. Empty series are
+        left out. Takes one cache read for all of the series and one query
+        for every 500 series that are not cached.
+        """
+        cache = get_shared_cache()
+        keys = {self.get_cache_key(series_id): series_id for series_id in
+                series_ids}
+        entries = {
+            keys[key]: entry for key, entry in
+            cache.get_many(list(keys.keys())).items()
+        }
+        missing = [
+            series_id for series_id in series_ids if series_id not in entries
+        ]
+        for start in range(0, len(missing), 500):
+            for instance in self.query_latest(missing[start:start + 500]):
+                entry = self.to_entry(instance)
+                entries[entry[1]] = entry
+                cache.add(self.get_cache_key(entry[1]), entry, None)
+        return {
+            series_id: self.to_instance(entry) for series_id, entry in
+            entries.items()
+        }
+
+    def query_latest(self, series_ids):
+        """
+        Returns a queryset of the most recent row of each of the series
+        `series_ids`, using a single greatest-per-group query. The row of each
+        series is found with one descending seek on the (series, timestamp)
+        index instead of a scan of its history.
+        """
+        opts = self.model._meta
+        series_field = opts.get_field(self.series_field)
+        series_opts = series_field.related_model._meta
+        connection = connections[router.db_for_read(self.model)]
+        qn = connection.ops.quote_name
+        sql = (
+            '{table}.{pk} IN (SELECT (SELECT latest.{pk} FROM {table} latest '
+            'WHERE latest.{series} = series.{series_pk} '
+            'ORDER BY latest.{timestamp} DESC, latest.{pk} DESC LIMIT 1) '
+            'FROM {series_table} series WHERE series.{series_pk} IN ({ids}))'
+        ).format(
+            table=qn(opts.db_table), pk=qn(opts.pk.column),
+            series=qn(series_field.column),
+            timestamp=qn(opts.get_field('timestamp').column),
+            series_table=qn(series_opts.db_table),
+            series_pk=qn(series_opts.pk.column),
+            ids=', '.join(['%s'] * len(series_ids))
+        )
+        return self.model.objects.extra(
+            where=[sql], params=list(series_ids)
+        ).order_by()
+
+    def update(self, instances):
+        """
+        Record that the rows `instances` were saved. The most recent rows of
+        series that are not in the cache are read from the database, because
+        there is no way of knowing whether the new rows are more recent than
+        the ones stored before.
+        """
+        self.update_entries(self.to_entry(instance) for instance in instances)
+
+    def update_entries(self, entries):
+        """
+        Like :meth:`update`, but takes `(pk, series id, timestamp, value)`
+        tuples instead of model instances
+        """
+        newest = {}
+        for entry in entries:
+            current = newest.get(entry[1], None)
+            if current is None or entry[2] >= current[2]:
+                newest[entry[1]] = entry
+        if not newest:
+            return
+        cache = get_shared_cache()
+        keys = {
+            self.get_cache_key(series_id): entry for series_id, entry in
+            newest.items()
+        }
+        cached = cache.get_many(list(keys.keys()))
+        updates = {}
+        for key, cached_entry in cached.items():
+            entry = keys[key]
+            if entry[2] >= cached_entry[2]:
+                updates[key] = entry
+        # A concurrent `get` may have read one of the missing series from the
+        # database before the new rows were inserted and be about to cache
+        # that row. It only adds to the cache, so setting the current row
+        # first keeps the stale one out.
+        missing = [
+            entry[1] for key, entry in keys.items() if key not in cached
+        ]
+        for start in range(0, len(missing), 500):
+            for instance in self.query_latest(missing[start:start + 500]):
+                entry = self.to_entry(instance)
+                updates[self.get_cache_key(entry[1])] = entry
+        if updates:
+            cache.set_many(updates, None)
+
+    def invalidate(self, series_ids):
+        """
+        Forget the cached rows for the series `series_ids`. This should be
+        called whenever rows are changed or deleted.
+        """
+        get_shared_cache().delete_many([
+            self.get_cache_key(series_id) for series_id in series_ids
+        ])
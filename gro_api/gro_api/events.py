@@ -0,0 +1,329 @@
+"""
+This module defines a server-sent events stream of new rows of the time series
+models in this project, so that clients can be notified of new sensor readings
+and actuator states instead of polling for them.
+
+New rows are read from the database by a per-process :class:`EventBuffer`
+that polls every registered :class:`EventSource` at most once per
+:attr:`~EventBuffer.poll_interval` no matter how many clients are subscribed.
+Because rows are read back from the database, rows inserted by any worker
+process are delivered to the subscribers of every other one.
+
+Every open stream holds a worker thread, so each process serves at most
+:attr:`EventStreamView.max_streams` of them at once and turns further
+subscribers away with a 503 response, leaving its other threads free for the
+rest of the API.
+"""
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.views import APIView
+from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+
+class TooManyStreams(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = (
+        'Too many event streams are open on this server. Try again later.'
+    )
+
+
+class EventSource:
+    """
+    A time series model (a model with a foreign key identifying the series, a
+    `timestamp` and a `value`) whose new rows are sent as events named `name`
+
+    :param str name: The name of the events
+    :param model: The time series model
+    :param str series_field: The name of the foreign key on `model` that
+        identifies the series a row belongs to. Subscribers can filter events
+        with a query parameter of the same name.
+    :param str resource_lookup: The lookup from the series model to the
+        :class:`~gro_api.resources.models.Resource` it belongs to
+    """
+    def __init__(self, name, model, series_field, resource_lookup):
+        self.name = name
+        self.model = model
+        self.series_field = series_field
+        self.series_attname = model._meta.get_field(series_field).attname
+        self.resource_lookup = resource_lookup
+
+    @property
+    def series_model(self):
+        return self.model._meta.get_field(self.series_field).related_model
+
+    def get_max_pk(self):
+        return self.model.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+
+    def fetch(self, after_pk, limit):
+        """
+        Returns a list of at most `limit` `(pk, series id, timestamp, value)`
+        tuples for the rows with a primary key greater than `after_pk`
+        """
+        return list(self.model.objects.filter(pk__gt=after_pk).order_by(
+            'pk'
+        ).values_list('pk', self.series_attname, 'timestamp', 'value')[:limit])
+
+    def get_series_ids(self, query_params):
+        """
+        Returns the set of series ids that a subscriber with the query
+        parameters `query_params` is interested in, or `None` for every series
+        """
+        try:
+            series_ids = [
+                int(pk) for pk in query_params.getlist(self.series_field)
+            ]
+            resource_ids = [
+                int(pk) for pk in query_params.getlist('resource')
+            ]
+        except ValueError:
+            raise ValidationError('Filters must be primary keys')
+        if not series_ids and any(
+                query_params.getlist(source.series_field) for source in
+                event_buffer.sources.values()):
+            # The subscriber only asked for series of other sources
+            return set()
+        if not resource_ids:
+            return set(series_ids) or None
+        queryset = self.series_model.objects.filter(**{
+            '{}__in'.format(self.resource_lookup): resource_ids
+        })
+        if series_ids:
+            queryset = queryset.filter(pk__in=series_ids)
+        return set(queryset.values_list('pk', flat=True))
+
+
+class EventBuffer:
+    """
+    Holds the most recent rows of every registered :class:`EventSource` for
+    the subscribers in the current process. Subscribers keep their own
+    position in each source and read the rows after it, so a slow subscriber
+    never holds up the others. Subscribers that fall further behind than the
+    buffer reaches read directly from the database instead.
+    """
+    #: The minimum number of seconds between two polls of the database
+    poll_interval = 0.5
+    #: The maximum number of rows kept for each source
+    size = 10000
+
+    def __init__(self):
+        self.sources = OrderedDict()
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.floors = {}
+        self.last_poll = 0
+
+    def register(self, source):
+        self.sources[source.name] = source
+
+    def clear(self):
+        """ Forget every buffered row, e.g. after the database is flushed """
+        with self.lock:
+            self.rows = {}
+            self.floors = {}
+            self.last_poll = 0
+
+    def poll(self):
+        """
+        Read the rows that were inserted since the last poll, unless the last
+        poll was less than :attr:`poll_interval` seconds ago
+        """
+        with self.lock:
+            now = time.time()
+            if now - self.last_poll < self.poll_interval:
+                return
+            self.last_poll = now
+            for name, source in self.sources.items():
+                if name not in self.rows:
+                    # Everything before the first poll has to be read from
+                    # the database
+                    self.rows[name] = deque(maxlen=self.size)
+                    self.floors[name] = source.get_max_pk()
+                    continue
+                rows = self.rows[name]
+                last_pk = rows[-1][0] if rows else self.floors[name]
+                new_rows = source.fetch(last_pk, self.size)
+                overflow = len(rows) + len(new_rows) - self.size
+                if overflow > 0:
+                    self.floors[name] = (
+                        rows[overflow - 1][0] if overflow <= len(rows) else
+                        new_rows[overflow - len(rows) - 1][0]
+                    )
+                rows.extend(new_rows)
+
+    def get_cursor(self):
+        """ Returns the position of the newest row of every source """
+        self.poll()
+        with self.lock:
+            return {
+                name: rows[-1][0] if rows else self.floors[name]
+                for name, rows in self.rows.items()
+            }
+
+    def read(self, name, after_pk):
+        """
+        Returns the rows of the source `name` with a primary key greater than
+        `after_pk`
+        """
+        with self.lock:
+            if after_pk >= self.floors.get(name, after_pk + 1):
+                rows = self.rows[name]
+                index = len(rows)
+                while index and rows[index - 1][0] > after_pk:
+                    index -= 1
+                return [rows[i] for i in range(index, len(rows))]
+        return self.sources[name].fetch(after_pk, self.size)
+
+
+event_buffer = EventBuffer()
+
+
+def encode_cursor(cursor):
+    return ','.join(
+        '{}:{}'.format(name, pk) for name, pk in sorted(cursor.items())
+    )
+
+
+def decode_cursor(encoded):
+    cursor = {}
+    try:
+        for position in encoded.split(','):
+            name, pk = position.split(':')
+            cursor[name] = int(pk)
+    except ValueError:
+        raise ValidationError('Invalid event id "{}"'.format(encoded))
+    return cursor
+
+
+class StreamCounter:
+    """ Counts the event streams that are open in the current process """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def open(self, limit):
+        """
+        Count a new stream and return `True`, or return `False` if `limit`
+        streams are open already
+        """
+        with self.lock:
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+    def close(self):
+        with self.lock:
+            self.count -= 1
+
+
+open_streams = StreamCounter()
+
+
+class EventStream:
+    """
+    The content of an event stream response. WSGI servers close the response
+    once they are done with it, even if the stream was never read, which is
+    when the stream stops being counted in :data:`open_streams`.
+    """
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            open_streams.close()
+
+
+class EventStreamView(APIView):
+    """
+    Stream new sensor readings and actuator states as server-sent events. Each
+    event is named after the kind of row it holds and its data is the row as
+    JSON. The query parameters `sensing_point`, `actuator` and `resource`
+    (which can each be repeated) restrict the stream to the given series.
+
+    Streams are closed after a while so that they do not tie up a worker
+    process indefinitely. Clients should reconnect with the `Last-Event-ID`
+    header (or the `last_event_id` query parameter) set to the id of the last
+    event they received, which is what `EventSource` does automatically.
+    Servers that already have as many streams open as they can serve respond
+    with status 503.
+    """
+    permission_classes = (AllowAny, )
+    #: The number of seconds after which a stream is closed
+    max_duration = 30
+    #: The number of milliseconds clients should wait before reconnecting
+    retry = 1000
+    #: The number of seconds between comments that keep idle streams open
+    keep_alive = 15
+    #: The maximum number of streams open at once in one process. It has to
+    #: stay below the number of threads per process set in uwsgi.ini.
+    max_streams = 4
+
+    def get(self, request):
+        if settings.SERVER_TYPE != settings.LEAF:
+            raise NotFound('Event streams are only available on leaf servers')
+        filters = {
+            name: source.get_series_ids(request.query_params)
+            for name, source in event_buffer.sources.items()
+        }
+        cursor = event_buffer.get_cursor()
+        last_event_id = request.META.get(
+            'HTTP_LAST_EVENT_ID', request.query_params.get('last_event_id')
+        )
+        if last_event_id:
+            cursor.update(decode_cursor(last_event_id))
+        if not open_streams.open(self.max_streams):
+            raise TooManyStreams()
+        response = StreamingHttpResponse(
+            EventStream(self.stream(cursor, filters)),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Tell nginx not to buffer the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def stream(self, cursor, filters):
+        yield 'retry: {}\n\n'.format(self.retry)
+        start = last_write = time.time()
+        while True:
+            lines = []
+            for name, source in event_buffer.sources.items():
+                series_ids = filters[name]
+                for pk, series_id, timestamp, value in event_buffer.read(
+                        name, cursor[name]):
+                    cursor[name] = pk
+                    if series_ids is not None and series_id not in series_ids:
+                        continue
+                    lines.append(
+                        'id: {}\nevent: {}\ndata: {}\n\n'.format(
+                            encode_cursor(cursor), name, json.dumps({
+                                'id': pk, source.series_field: series_id,
+                                'timestamp': timestamp, 'value': value,
+                            })
+                        )
+                    )
+            now = time.time()
+            if lines:
+                yield ''.join(lines)
+                last_write = now
+            elif now - last_write >= self.keep_alive:
+                yield ':\n\n'
+                last_write = now
+            if now - start >= self.max_duration:
+                break
+            time.sleep(event_buffer.poll_interval)
+            event_buffer.poll()
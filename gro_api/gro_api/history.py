@@ -0,0 +1,643 @@
+"""
+This module defines helpers for the append-only time series models in this
+project (:class:`~gro_api.sensors.models.DataPoint` and
+:class:`~gro_api.actuators.models.ActuatorState`) and viewset mixins that
+expose them.
+"""
+import io
+import csv
+import json
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from itertools import islice, accumulate
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.db.models import F, Min, Max, Sum, Count, ExpressionWrapper
+from django.db.models import IntegerField
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.response import Response
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.field_mapping import get_detail_view_name
+from .pagination import filter_after
+
+
+def parse_positive_int(query_params, name, default=None):
+    """
+    Read the query parameter `name` from `query_params` as a positive integer.
+    Raises a :class:`~rest_framework.exceptions.ValidationError` if the value
+    is missing (and no default was given) or invalid.
+    """
+    value = query_params.get(name, None)
+    if value is None:
+        if default is None:
+            raise ValidationError(
+                'The query parameter "{}" is required.'.format(name)
+            )
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise ValidationError(
+            'The query parameter "{}" must be a positive integer.'.format(name)
+        )
+    return value
+
+
+def iterate_history(queryset, fields, chunk_size=2000):
+    """
+    Generate lists of at most `chunk_size` tuples holding the values of
+    `fields` for each row of `queryset` in (timestamp, pk) order. Each chunk is
+    read with a separate keyset query, so memory use does not depend on the
+    size of `queryset`. (:meth:`QuerySet.iterator` reads the whole result set
+    into memory on SQLite.)
+    """
+    queryset = queryset.order_by('timestamp', 'pk')
+    fields = tuple(fields)
+    row_length = len(fields)
+    if 'timestamp' not in fields:
+        fields += ('timestamp',)
+    timestamp_index = fields.index('timestamp')
+    fields += ('pk',)
+    chunk = list(queryset.values_list(*fields)[:chunk_size])
+    while chunk:
+        yield [row[:row_length] for row in chunk]
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]
+        chunk = list(filter_after(
+            queryset, last[timestamp_index], last[-1]
+        ).values_list(*fields)[:chunk_size])
+
+
+def merge_history(chunks, rows, key, chunk_size=2000):
+    """
+    Merge the sorted iterable `rows` into `chunks`, a sorted iterable of lists
+    of rows such as the one generated by :func:`iterate_history`, and generate
+    lists of at most `chunk_size` rows in the order given by `key`
+    """
+    merged = heapq.merge(
+        (row for chunk in chunks for row in chunk), rows, key=key
+    )
+    while True:
+        chunk = list(islice(merged, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def bucket_history(queryset, series_field, width):
+    """
+    Group the rows in `queryset` by `series_field` and by the bucket of width
+    `width` seconds that their timestamp falls into, and compute the minimum,
+    maximum, sum and number of values in each group. All of the work is done
+    by the database, so the number of rows returned is the number of buckets
+    rather than the number of rows in `queryset`.
+    """
+    bucket = ExpressionWrapper(
+        F('timestamp') / width * width, output_field=IntegerField()
+    )
+    # The default ordering on `timestamp` would be added to the GROUP BY
+    # clause, so it has to be replaced
+    return queryset.annotate(bucket=bucket).values(
+        series_field, 'bucket'
+    ).annotate(
+        min_value=Min('value'), max_value=Max('value'),
+        sum_value=Sum('value'), count=Count('pk')
+    ).order_by(series_field, 'bucket')
+
+
+def bucket_rollups(queryset, series_field, width):
+    """
+    Like :func:`bucket_history`, but for a queryset of
+    :class:`~gro_api.gro_api.rollups.RollupModel` rows of a single resolution
+    that divides `width`
+    """
+    bucket = ExpressionWrapper(
+        F('timestamp') / width * width, output_field=IntegerField()
+    )
+    return queryset.annotate(bucket=bucket).values(
+        series_field, 'bucket'
+    ).annotate(
+        min_value=Min('min_value'), max_value=Max('max_value'),
+        sum_value=Sum('sum_value'), count=Sum('count')
+    ).order_by(series_field, 'bucket')
+
+
+def merge_bucket(buckets, key, min_value, max_value, sum_value, count):
+    """
+    Merge the summary of a set of values into the summary stored in `buckets`
+    under `key` as a `[min, max, sum, count]` list
+    """
+    bucket = buckets.get(key, None)
+    if bucket is None:
+        buckets[key] = [min_value, max_value, sum_value, count]
+    else:
+        bucket[0] = min(bucket[0], min_value)
+        bucket[1] = max(bucket[1], max_value)
+        bucket[2] += sum_value
+        bucket[3] += count
+
+
+def resample(timestamps, values, start, step, count, method):
+    """
+    Resample a series onto the grid of `count` timestamps starting at `start`
+    and spaced `step` seconds apart and return a list of `count` values (or
+    `None` where the series has no value). `timestamps` and `values` are
+    sequences in timestamp order.
+
+    With the "locf" method, each grid point gets the last value recorded at or
+    before it. With the "mean" method, each grid point gets the mean of the
+    values recorded in the `step` seconds starting at it. Either way, the grid
+    points are located in the series by binary search, so the cost does not
+    grow with the number of rows per grid point.
+    """
+    grid = range(start, start + count * step, step)
+    if method == 'locf':
+        indexes = [bisect_right(timestamps, timestamp) - 1 for timestamp in grid]
+        return [values[index] if index >= 0 else None for index in indexes]
+    sums = array('d', [0.0])
+    sums.extend(accumulate(values))
+    bounds = [bisect_left(timestamps, timestamp) for timestamp in grid]
+    bounds.append(bisect_left(timestamps, start + count * step))
+    return [
+        (sums[upper] - sums[lower]) / (upper - lower) if upper > lower else None
+        for lower, upper in zip(bounds, bounds[1:])
+    ]
+
+
+class HistorySeriesMixin:
+    """
+    Base class of the viewset mixins that return results per series.
+    Subclasses must define the attribute :attr:`series_field`, which is the
+    name of the foreign key that identifies the series a row belongs to, and
+    can define :attr:`archive` to include archived rows.
+    """
+    #: The name of the foreign key that identifies a series in the model
+    series_field = None
+    #: The :class:`~gro_api.gro_api.archive.TimeSeriesArchive` of the model, if
+    #: any
+    archive = None
+
+    def get_series_url(self, pk):
+        model_field = self.get_queryset().model._meta.get_field(
+            self.series_field
+        )
+        return reverse(
+            get_detail_view_name(model_field.related_model),
+            kwargs={'pk': pk}, request=self.request
+        )
+
+    def get_previous_row(self, series_id, timestamp):
+        """
+        Returns the `(timestamp, value)` tuple of the last row of the series
+        `series_id` before `timestamp`, including archived rows, or `None` if
+        there is no such row
+        """
+        rows = self.get_queryset().filter(**{
+            self.series_field: series_id, 'timestamp__lt': timestamp
+        }).order_by('-timestamp', '-pk').values_list('timestamp', 'value')[:1]
+        row = rows[0] if rows else None
+        if self.archive is not None:
+            # Rows that arrived late can be older than archived ones, so the
+            # archive is checked even if the database has an earlier row
+            archived = self.archive.read_previous(
+                series_id, timestamp, row[0] if row is not None else None
+            )
+            if archived is not None:
+                return archived
+        return row
+
+    def iterate_series(self, series_id, min_time, max_time):
+        """
+        Generate lists of `(timestamp, value)` tuples for the rows of the
+        series `series_id` between `min_time` and `max_time` inclusive, in
+        timestamp order, including archived rows
+        """
+        queryset = self.get_queryset().filter(**{
+            self.series_field: series_id, 'timestamp__gte': min_time,
+            'timestamp__lte': max_time
+        })
+        chunks = iterate_history(queryset, ('timestamp', 'value'))
+        if self.archive is not None:
+            archived = self.archive.read([series_id], min_time, max_time)
+            if archived is not None:
+                chunks = merge_history(
+                    chunks, (row[1:] for row in archived), key=itemgetter(0)
+                )
+        return chunks
+
+
+class HistoryAggregateMixin(HistorySeriesMixin):
+    """
+    Adds an ``aggregate`` route to a viewset over a time series model. See
+    :class:`HistorySeriesMixin` for the required attributes. Subclasses can
+    also define :attr:`rollup` to read whole hours and days from rollups.
+    """
+    #: The :class:`~gro_api.gro_api.rollups.TimeSeriesRollup` of the model, if
+    #: any
+    rollup = None
+
+    def get_rollup_queryset(self, width):
+        """
+        Returns the rollups that cover the rows matched by the filters of the
+        list view when grouped into buckets of `width` seconds, or `None` if
+        the filters and `width` are not aligned to any rollup resolution
+        """
+        if self.rollup is None:
+            return None
+        resolution = self.rollup.get_resolution(width)
+        if resolution is None:
+            return None
+        params = self.request.query_params
+        try:
+            min_time = params.get('min_time', None)
+            if min_time is not None and int(min_time) % resolution:
+                return None
+            max_time = params.get('max_time', None)
+            if max_time is not None and (int(max_time) + 1) % resolution:
+                return None
+        except ValueError:
+            return None
+        rollups = self.rollup.rollup_model.objects.filter(
+            resolution=resolution
+        )
+        return self.filter_class(params, queryset=rollups).qs
+
+    def get_buckets(self, queryset, width):
+        """
+        Returns a dictionary mapping `(series id, bucket timestamp)` to
+        `[min, max, sum, count]` for the rows in `queryset`
+        """
+        buckets = {}
+        rollups = self.get_rollup_queryset(width)
+        with transaction.atomic():
+            if rollups is not None:
+                # Rows up to the high-water mark are summarized by the
+                # rollups and the rest are read from the raw table
+                queryset = queryset.filter(pk__gt=self.rollup.get_mark())
+                groups = bucket_rollups(rollups, self.series_field, width)
+                for row in groups:
+                    merge_bucket(
+                        buckets, (row[self.series_field], row['bucket']),
+                        row['min_value'], row['max_value'], row['sum_value'],
+                        row['count']
+                    )
+            elif self.archive is not None:
+                # Archived rows are only summarized by the rollups, so they
+                # have to be read back when the rollups can't be used
+                archived = self.archive.read_filtered(
+                    self.request.query_params
+                )
+                for series_id, timestamp, value in archived or ():
+                    merge_bucket(
+                        buckets, (series_id, timestamp // width * width),
+                        value, value, value, 1
+                    )
+            for row in bucket_history(queryset, self.series_field, width):
+                merge_bucket(
+                    buckets, (row[self.series_field], row['bucket']),
+                    row['min_value'], row['max_value'], row['sum_value'],
+                    row['count']
+                )
+        return buckets
+
+    @list_route(methods=['get'])
+    def aggregate(self, request):
+        """
+        Get the minimum, maximum, mean and number of values recorded for each
+        series in fixed-width time buckets. The bucket width in seconds is read
+        from the query parameter `bucket`. The same filters as the list view
+        can be applied. Whole hours and days are read from precomputed rollups
+        when `bucket`, `min_time` and `max_time` are aligned to them.
+        """
+        width = parse_positive_int(request.query_params, 'bucket')
+        queryset = self.filter_queryset(self.get_queryset())
+        buckets = self.get_buckets(queryset, width)
+        series_urls = {}
+        results = []
+        for (series_id, timestamp) in sorted(buckets):
+            min_value, max_value, sum_value, count = buckets[
+                (series_id, timestamp)
+            ]
+            if series_id not in series_urls:
+                series_urls[series_id] = self.get_series_url(series_id)
+            results.append({
+                self.series_field: series_urls[series_id],
+                'timestamp': timestamp,
+                'min': min_value,
+                'max': max_value,
+                'mean': sum_value / count,
+                'count': count,
+            })
+        return Response(results)
+
+
+class HistoryAlignMixin(HistorySeriesMixin):
+    """
+    Adds an ``align`` route to a viewset over a time series model that
+    resamples several series onto a common time grid. See
+    :class:`HistorySeriesMixin` for the required attributes.
+    """
+    #: The methods that series can be resampled with
+    align_methods = ('locf', 'mean')
+    #: The maximum number of values in one response
+    max_aligned_values = 100000
+
+    def get_aligned_series_ids(self):
+        """
+        Returns the list of series ids given in the query parameter named
+        after :attr:`series_field`, in order and without duplicates
+        """
+        series_ids = []
+        try:
+            for pk in self.request.query_params.getlist(self.series_field):
+                if int(pk) not in series_ids:
+                    series_ids.append(int(pk))
+        except ValueError:
+            raise ValidationError(
+                'Invalid {} id "{}"'.format(self.series_field, pk)
+            )
+        if not series_ids:
+            raise ValidationError(
+                'The query parameter "{}" is required.'.format(
+                    self.series_field
+                )
+            )
+        series_model = self.get_queryset().model._meta.get_field(
+            self.series_field
+        ).related_model
+        found = set(series_model.objects.filter(
+            pk__in=series_ids
+        ).values_list('pk', flat=True))
+        missing = [pk for pk in series_ids if pk not in found]
+        if missing:
+            raise ValidationError(
+                'Invalid {} ids: {}'.format(
+                    self.series_field, ', '.join(str(pk) for pk in missing)
+                )
+            )
+        return series_ids
+
+    def get_series_arrays(self, series_id, min_time, max_time, method):
+        """
+        Returns a tuple of arrays holding the timestamps and values of the
+        rows of the series `series_id` between `min_time` and `max_time`
+        inclusive. For the "locf" method, the last row before `min_time` (if
+        it has not been archived) is included as well so that its value can be
+        carried forward.
+        """
+        timestamps = array('q')
+        values = array('d')
+        if method == 'locf':
+            previous = self.get_previous_row(series_id, min_time)
+            if previous is not None:
+                timestamps.append(previous[0])
+                values.append(previous[1])
+        for chunk in self.iterate_series(series_id, min_time, max_time):
+            chunk_timestamps, chunk_values = zip(*chunk)
+            timestamps.extend(chunk_timestamps)
+            values.extend(chunk_values)
+        return timestamps, values
+
+    @list_route(methods=['get'])
+    def align(self, request):
+        """
+        Resample several series onto a common time grid. The series are given
+        by repeating the query parameter named after the series (e.g.
+        `sensing_point`), and the grid runs from `min_time` to `max_time` in
+        steps of `step` seconds. The query parameter `method` selects between
+        "locf" (the default), which carries the last recorded value forward
+        to each grid point, and "mean", which averages the values recorded in
+        the step starting at each grid point. Responds with the list of series,
+        the grid timestamps and one row of values (`null` where a series has
+        no value) per grid timestamp, with one column per series.
+        """
+        params = request.query_params
+        min_time = parse_positive_int(params, 'min_time')
+        max_time = parse_positive_int(params, 'max_time')
+        step = parse_positive_int(params, 'step')
+        method = params.get('method', 'locf')
+        if method not in self.align_methods:
+            raise ValidationError(
+                'Invalid method "{}". Valid methods are {}.'.format(
+                    method, ', '.join(self.align_methods)
+                )
+            )
+        if max_time < min_time:
+            raise ValidationError('"max_time" must not be before "min_time".')
+        series_ids = self.get_aligned_series_ids()
+        count = (max_time - min_time) // step + 1
+        if count * len(series_ids) > self.max_aligned_values:
+            raise ValidationError(
+                'The grid holds too many values. Use a larger step, a shorter '
+                'time range or fewer series.'
+            )
+        columns = []
+        with transaction.atomic():
+            for series_id in series_ids:
+                timestamps, values = self.get_series_arrays(
+                    series_id, min_time, max_time, method
+                )
+                columns.append(resample(
+                    timestamps, values, min_time, step, count, method
+                ))
+        return Response({
+            self.series_field: [
+                self.get_series_url(series_id) for series_id in series_ids
+            ],
+            'timestamps': list(range(min_time, min_time + count * step, step)),
+            'values': [list(row) for row in zip(*columns)],
+        })
+
+
+class HistoryExportMixin:
+    """
+    Adds an ``export`` route to a viewset over a time series model that
+    streams every row of the filtered queryset. Subclasses must define the
+    attribute :attr:`export_fields`, which is a list of the names of the model
+    fields to export, and can define :attr:`archive` to include archived rows.
+    """
+    #: The names of the model fields to write for each row
+    export_fields = None
+    #: The :class:`~gro_api.gro_api.archive.TimeSeriesArchive` of the model, if
+    #: any
+    archive = None
+    #: The formats that the export can be written in
+    export_content_types = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def merge_archive(self, chunks):
+        """
+        Merge the archived rows that match the filters of the list view into
+        `chunks`
+        """
+        archived = self.archive.read_filtered(self.request.query_params)
+        if archived is None:
+            return chunks
+        positions = {self.archive.series_field: 0, 'timestamp': 1, 'value': 2}
+        getter = itemgetter(*(positions[field] for field in self.export_fields))
+        return merge_history(
+            chunks, (getter(row) for row in archived),
+            key=itemgetter(self.export_fields.index('timestamp'))
+        )
+
+    def export_csv(self, chunks):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+
+        def write(rows):
+            writer.writerows(rows)
+            text = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return text
+
+        yield write([self.export_fields])
+        for chunk in chunks:
+            yield write(chunk)
+
+    def export_ndjson(self, chunks):
+        fields = self.export_fields
+        for chunk in chunks:
+            yield ''.join(
+                json.dumps(dict(zip(fields, row))) + '\n' for row in chunk
+            )
+
+    @list_route(methods=['get'])
+    def export(self, request):
+        """
+        Stream every row matching the filters of the list view in timestamp
+        order, including rows that have been archived. The query parameter
+        `output` selects between "csv" (the default) and "ndjson" (one JSON
+        object per line). Related objects are written as primary keys.
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in self.export_content_types:
+            raise ValidationError(
+                'Invalid output format "{}". Valid formats are {}.'.format(
+                    output, ', '.join(sorted(self.export_content_types))
+                )
+            )
+        queryset = self.filter_queryset(self.get_queryset())
+        chunks = iterate_history(queryset, self.export_fields)
+        if self.archive is not None:
+            chunks = self.merge_archive(chunks)
+        content = getattr(self, 'export_{}'.format(output))(chunks)
+        response = StreamingHttpResponse(
+            content, content_type=self.export_content_types[output]
+        )
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+            queryset.model._meta.model_name, output
+        )
+        return response
+
+
+class HistoryListMixin:
+    """
+    Includes archived rows in the results of the list route of a viewset over
+    a time series model that is paginated by
+    :class:`~gro_api.gro_api.pagination.TimeSeriesPagination`. Subclasses can
+    define :attr:`archive`.
+
+    Archived rows are returned as unsaved model instances whose primary key is
+    the negated id of their series. That orders them before the stored rows
+    with the same timestamp and keeps every cursor position unique, since a
+    series has at most one archived row per timestamp.
+    """
+    #: The :class:`~gro_api.gro_api.archive.TimeSeriesArchive` of the model, if
+    #: any
+    archive = None
+
+    def read_archive(self, cursor, limit):
+        """
+        Returns at most `limit` archived rows that match the filters of the
+        list view and come after `cursor` in (timestamp, pk) order, or before
+        it in reverse order for reverse cursors
+        """
+        filters = self.archive.get_filters(self.request.query_params)
+        if filters is None:
+            return []
+        series_ids, min_time, max_time = filters
+        if cursor is not None:
+            if cursor.reverse:
+                max_time = cursor.timestamp if max_time is None else \
+                    min(max_time, cursor.timestamp)
+            else:
+                min_time = cursor.timestamp if min_time is None else \
+                    max(min_time, cursor.timestamp)
+        rows = self.archive.read(series_ids, min_time, max_time)
+        if rows is None:
+            return []
+        rows = (
+            (timestamp, -series_id, value) for series_id, timestamp, value in
+            rows
+        )
+        if cursor is not None:
+            position = (cursor.timestamp, cursor.pk)
+            if cursor.reverse:
+                rows = (row for row in rows if row[:2] < position)
+            else:
+                rows = (row for row in rows if row[:2] > position)
+        if cursor is not None and cursor.reverse:
+            page = heapq.nlargest(limit, rows)
+        else:
+            # Rows are only sorted by timestamp, so every row with the same
+            # timestamp as the last one needed has to be read
+            page = []
+            for row in rows:
+                if len(page) >= limit and row[0] > page[-1][0]:
+                    break
+                page.append(row)
+            page = sorted(page)[:limit]
+        model = self.get_queryset().model
+        return [
+            model(**{
+                'pk': pk, self.archive.series_attname: -pk,
+                'timestamp': timestamp, 'value': value
+            }) for timestamp, pk, value in page
+        ]
+
+    def paginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        extra_sources = []
+        if self.archive is not None:
+            extra_sources.append(self.read_archive)
+        return self.paginator.paginate_queryset(
+            queryset, self.request, view=self, extra_sources=extra_sources
+        )
+
+
+class HistoryIngestMixin:
+    """
+    Adds an ``ingest`` route to a viewset over a time series model that
+    inserts batches of rows in a compact format. Subclasses must define the
+    attribute :attr:`ingester_class`, which is a subclass of
+    :class:`~gro_api.gro_api.ingest.TimeSeriesIngester` for the model.
+    """
+    #: The class used to validate and insert batches
+    ingester_class = None
+
+    @list_route(methods=['post'])
+    def ingest(self, request):
+        """
+        Insert a batch of rows. The body is either a list of
+        `[series id, timestamp, value]` rows or an object with a list of
+        series ids and a list of `data` rows that refer to series by their
+        position in that list. The query parameter `on_conflict` can be set to
+        "ignore" or "replace" to skip or overwrite rows that already exist.
+        Responds with the number of rows inserted.
+        """
+        ingester = self.ingester_class(
+            request.query_params.get('on_conflict', None)
+        )
+        count = ingester.ingest(request.data)
+        return Response({'count': count}, status=status.HTTP_201_CREATED)
@@ -0,0 +1,257 @@
+"""
+This module defines a fast path for inserting batches of rows into the time
+series models in this project. Unlike the default `?many=true` create views,
+it does not run a hyperlinked serializer or build a model instance for every
+row, and it checks every referenced series with a single query.
+"""
+import time
+from itertools import islice
+from django.db import connections, router, transaction, IntegrityError
+from rest_framework.exceptions import ValidationError
+from .parsers import PackedRows
+
+
+class TimeSeriesIngester:
+    """
+    Validates and inserts batches of rows for a time series model (a model with
+    a foreign key identifying the series, a `timestamp` and a `value`).
+    Subclasses must define the attributes :attr:`model` and
+    :attr:`series_field`.
+
+    Rows are `(series, timestamp, value)` lists or objects with the keys
+    `series_field`, "timestamp" and "value", where `series` is the primary key
+    of the related object. A batch can either be a list of rows or an object of
+    the form ``{"<series_field>s": [id, ...], "data": [row, ...]}``, in which
+    case the series of each row is an index into the list of ids. Missing
+    timestamps default to the current time. Batches parsed by
+    :class:`~gro_api.gro_api.parsers.PackedTimeSeriesParser` are used as is.
+
+    If the model has a unique constraint on :attr:`conflict_fields`, rows that
+    conflict with existing rows are rejected by default. With `on_conflict`
+    set to "ignore", they are skipped, and with "replace", they overwrite the
+    existing rows. Either way, the database resolves the conflicts during the
+    insert, so retrying a batch does not cost a query per row.
+    """
+    #: The time series model to insert rows into
+    model = None
+    #: The name of the foreign key on :attr:`model` that identifies a series
+    series_field = None
+    #: The :class:`~gro_api.gro_api.cache.LatestValueStore` to update, if any
+    latest_store = None
+    #: The maximum number of rows to insert in one statement
+    batch_size = 500
+    #: The fields of the series model to load for :meth:`filter_rows`
+    series_fields = ()
+    #: The fields of the unique constraint that rows can conflict on, if any
+    conflict_fields = None
+    #: The :class:`~gro_api.gro_api.rollups.TimeSeriesRollup` to refold
+    #: replaced rows in, if any
+    rollup = None
+    #: The ways in which conflicting rows can be handled
+    conflict_modes = ('ignore', 'replace')
+
+    def __init__(self, on_conflict=None):
+        if on_conflict is not None:
+            if self.conflict_fields is None:
+                raise ValidationError(
+                    'Rows of this model can not conflict with each other'
+                )
+            if on_conflict not in self.conflict_modes:
+                raise ValidationError(
+                    'Invalid on_conflict mode "{}". Valid modes are {}.'.format(
+                        on_conflict, ', '.join(self.conflict_modes)
+                    )
+                )
+        self.on_conflict = on_conflict
+
+    @property
+    def series_attname(self):
+        return self.model._meta.get_field(self.series_field).attname
+
+    @property
+    def series_model(self):
+        return self.model._meta.get_field(self.series_field).related_model
+
+    def parse_row(self, index, row, series_ids=None):
+        try:
+            if isinstance(row, dict):
+                series = row[self.series_field]
+                timestamp = row.get('timestamp', None)
+                value = row['value']
+            else:
+                series, timestamp, value = row
+            series = int(series)
+            if series_ids is not None:
+                if series < 0:
+                    raise IndexError()
+                series = series_ids[series]
+            if timestamp is None:
+                timestamp = time.time()
+            return series, int(timestamp), float(value)
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise ValidationError(
+                'Row {} of the batch is invalid: {}'.format(index, row)
+            )
+
+    def parse(self, data):
+        """
+        Convert the batch `data` into a list of `(series, timestamp, value)`
+        tuples with primary keys as series
+        """
+        if isinstance(data, PackedRows):
+            return data
+        series_ids = None
+        if isinstance(data, dict):
+            try:
+                series_ids = [
+                    int(series) for series in
+                    data['{}s'.format(self.series_field)]
+                ]
+                data = data['data']
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError(
+                    'Batch objects must contain a list of "{}s" ids and a '
+                    'list of "data" rows'.format(self.series_field)
+                )
+        if not isinstance(data, (list, tuple)):
+            raise ValidationError('Expected a list of rows')
+        return [
+            self.parse_row(index, row, series_ids) for index, row in
+            enumerate(data)
+        ]
+
+    def check_series(self, rows):
+        """
+        Make sure that every series referenced in `rows` exists, using a single
+        query, and load the :attr:`series_fields` of each of them into
+        :attr:`series`
+        """
+        series_ids = set(row[0] for row in rows)
+        self.series = {
+            values[0]: values[1:] for values in
+            self.series_model.objects.filter(pk__in=series_ids).values_list(
+                'pk', *self.series_fields
+            )
+        }
+        missing = series_ids - set(self.series)
+        if missing:
+            raise ValidationError(
+                'Invalid {} ids: {}'.format(
+                    self.series_field,
+                    ', '.join(str(pk) for pk in sorted(missing))
+                )
+            )
+
+    def filter_rows(self, rows):
+        """
+        Returns the rows of `rows` that should be inserted. By default, all
+        of them are.
+        """
+        return rows
+
+    def get_insert_sql(self, connection):
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}, {}, {}) VALUES (%s, %s, %s)'.format(
+            qn(opts.db_table), qn(opts.get_field(self.series_field).column),
+            qn(opts.get_field('timestamp').column),
+            qn(opts.get_field('value').column)
+        )
+        if self.on_conflict is None:
+            return sql
+        if connection.vendor == 'sqlite':
+            return 'INSERT OR {}{}'.format(
+                self.on_conflict.upper(), sql[len('INSERT'):]
+            )
+        if connection.vendor == 'postgresql':
+            if self.on_conflict == 'ignore':
+                action = 'NOTHING'
+            else:
+                action = 'UPDATE SET {0} = EXCLUDED.{0}'.format(
+                    qn(opts.get_field('value').column)
+                )
+            return '{} ON CONFLICT ({}) DO {}'.format(sql, ', '.join(
+                qn(opts.get_field(field).column) for field in
+                self.conflict_fields
+            ), action)
+        raise NotImplementedError(
+            'Conflict handling is not implemented for {} databases'.format(
+                connection.vendor
+            )
+        )
+
+    def find_existing(self, rows):
+        """
+        Returns the list of `(series, timestamp)` tuples of the rows in `rows`
+        that already exist in the database, using a single query
+        """
+        keys = set((row[0], row[1]) for row in rows)
+        timestamps = [key[1] for key in keys]
+        existing = self.model.objects.filter(**{
+            '{}__in'.format(self.series_field): set(key[0] for key in keys),
+            'timestamp__gte': min(timestamps),
+            'timestamp__lte': max(timestamps),
+        }).values_list(self.series_attname, 'timestamp')
+        return [key for key in existing if key in keys]
+
+    def insert(self, rows):
+        """
+        Insert `rows` in batches of :attr:`batch_size` in a single transaction
+        and return the number of rows inserted. Rows are passed to the database
+        as they are, without building model instances.
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        sql = self.get_insert_sql(connection)
+        rows = iter(rows)
+        newest = {}
+        replaced = []
+        count = total = 0
+        try:
+            with transaction.atomic(using=using):
+                cursor = connection.cursor()
+                while True:
+                    batch = list(islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    if self.on_conflict == 'replace' and \
+                            self.rollup is not None:
+                        replaced.extend(self.find_existing(batch))
+                    cursor.executemany(sql, batch)
+                    # Ignored rows are not counted by the database
+                    count += cursor.rowcount if cursor.rowcount >= 0 else \
+                        len(batch)
+                    total += len(batch)
+                    for row in batch:
+                        current = newest.get(row[0], None)
+                        if current is None or row[1] >= current[1]:
+                            newest[row[0]] = row
+                if replaced:
+                    self.rollup.refold(replaced)
+        except IntegrityError:
+            if self.conflict_fields is None:
+                raise
+            raise ValidationError(
+                'The batch contains rows that already exist. Set on_conflict '
+                'to "ignore" or "replace" to skip or overwrite them.'
+            )
+        if self.latest_store is not None:
+            if count < total:
+                # Some rows were ignored, so the newest row of a series in the
+                # batch is not necessarily the stored one
+                self.latest_store.invalidate(list(newest))
+            else:
+                self.latest_store.update_entries(
+                    (None, series, timestamp, value) for series, timestamp,
+                    value in newest.values()
+                )
+        return count
+
+    def ingest(self, data):
+        """
+        Validate and insert the batch `data` and return the number of rows
+        inserted
+        """
+        rows = self.parse(data)
+        self.check_series(rows)
+        return self.insert(self.filter_rows(rows))
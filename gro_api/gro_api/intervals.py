@@ -0,0 +1,202 @@
+"""
+This module defines in-memory indexes of models that describe intervals of time
+(such as :class:`~gro_api.recipes.models.ActuatorOverride`), so that the
+interval that is active for an object at a given time can be found without
+querying the database.
+"""
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from itertools import accumulate
+from django.db.models.signals import post_save, post_delete
+from .cache import get_shared_cache, get_farm_cache_key, get_farm_name
+
+
+class IntervalIndex:
+    """
+    An immutable index of closed intervals grouped by key.
+
+    The intervals of each key are kept sorted by start time in an array, next
+    to an array holding the latest end time of the intervals up to each
+    position. Both arrays are sorted, so the earliest-starting interval that
+    contains a given time is found with one binary search.
+
+    :param intervals: An iterable of `(key, start, end, item)` tuples. Items
+        with the same start time are kept in the order they are given in.
+    """
+    def __init__(self, intervals):
+        grouped = defaultdict(list)
+        for key, start, end, item in intervals:
+            grouped[key].append((start, end, item))
+        self.series = {}
+        for key, rows in grouped.items():
+            rows.sort(key=lambda row: row[0])
+            self.series[key] = (
+                array('q', (row[0] for row in rows)),
+                array('q', accumulate((row[1] for row in rows), max)),
+                [row[2] for row in rows]
+            )
+
+    def get(self, key, timestamp):
+        """
+        Returns the item of the earliest-starting interval of `key` that
+        contains `timestamp`, or `None` if there is no such interval
+        """
+        series = self.series.get(key, None)
+        if series is None:
+            return None
+        starts, reaches, items = series
+        # The first interval that reaches `timestamp` is the earliest-starting
+        # one that might contain it
+        index = bisect_left(reaches, timestamp)
+        if index < len(starts) and starts[index] <= timestamp:
+            return items[index]
+        return None
+
+    def get_overlapping(self, key, start, end):
+        """
+        Returns the item of the earliest-starting interval of `key` that
+        overlaps the interval from `start` to `end`, or `None` if there is no
+        such interval. Intervals that end exactly at `start` do not overlap
+        it, so that back-to-back intervals can be scheduled.
+        """
+        series = self.series.get(key, None)
+        if series is None:
+            return None
+        starts, reaches, items = series
+        # The first interval that reaches past `start` ends after it, and
+        # every later interval starts no earlier than it does
+        index = bisect_right(reaches, start)
+        if index < len(starts) and starts[index] <= end:
+            return items[index]
+        return None
+
+    def get_all(self, timestamp):
+        """
+        Returns a dictionary mapping every key with an interval that contains
+        `timestamp` to the item of the earliest-starting one
+        """
+        active = {}
+        for key in self.series:
+            item = self.get(key, timestamp)
+            if item is not None:
+                active[key] = item
+        return active
+
+
+class ModelIntervalIndex:
+    """
+    A per-process :class:`IntervalIndex` of the instances of `model` keyed by
+    the foreign key `key_field`.
+
+    The index only holds the intervals that had not ended when it was built,
+    so it can answer queries about the present and the future but not about
+    the past. It is rebuilt after instances are saved or deleted in this
+    process, and, at most :attr:`check_interval` seconds later, in every other
+    process, which learn about the change from a version counter in the shared
+    cache.
+
+    :param model: The model to index
+    :param str key_field: The name of the foreign key that the intervals are
+        grouped by
+    :param str start_field: The name of the field that holds the start time
+    :param str end_field: The name of the field that holds the end time
+    """
+    #: The minimum number of seconds between two checks of the version counter
+    check_interval = 1
+
+    def __init__(self, model, key_field, start_field='start_timestamp',
+                 end_field='end_timestamp'):
+        self.model = model
+        self.key_attname = model._meta.get_field(key_field).attname
+        self.start_field = start_field
+        self.end_field = end_field
+        opts = model._meta
+        self.version_key = 'intervalIndex:{}.{}'.format(
+            opts.app_label, opts.model_name
+        )
+        # Maps farm names to (index, version, time of last check) tuples
+        self.indexes = {}
+        post_save.connect(self.invalidate, sender=model, weak=False)
+        post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def invalidate(self, **kwargs):
+        """ Rebuild the index in every process the next time it is used """
+        self.indexes.pop(get_farm_name(), None)
+        cache = get_shared_cache()
+        key = get_farm_cache_key(self.version_key)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def clear(self):
+        """ Forget the index of this process, e.g. after a database flush """
+        self.indexes = {}
+
+    def build(self, now):
+        queryset = self.model.objects.filter(**{
+            '{}__gte'.format(self.end_field): now
+        }).order_by(self.key_attname, self.start_field, 'pk')
+        return IntervalIndex(
+            (
+                getattr(instance, self.key_attname),
+                getattr(instance, self.start_field),
+                getattr(instance, self.end_field), instance
+            ) for instance in queryset
+        )
+
+    def get_index(self, fresh=False):
+        """
+        Returns the :class:`IntervalIndex` of the current farm. If `fresh` is
+        true, the version counter is checked even if it was checked less than
+        :attr:`check_interval` seconds ago.
+        """
+        now = time.time()
+        farm_name = get_farm_name()
+        index, version, last_check = self.indexes.get(
+            farm_name, (None, None, 0)
+        )
+        if index is not None and not fresh and \
+                now - last_check < self.check_interval:
+            return index
+        # The version has to be read before the rows, so that changes made
+        # while the index is built cause another rebuild
+        current_version = get_shared_cache().get(
+            get_farm_cache_key(self.version_key), 0
+        )
+        if index is None or current_version != version:
+            index = self.build(now)
+        self.indexes[farm_name] = (index, current_version, now)
+        return index
+
+    def get(self, key, timestamp=None):
+        """
+        Returns the earliest-starting instance with the key `key` that is
+        active at `timestamp` (the current time by default), or `None`
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return self.get_index().get(key, timestamp)
+
+    def get_overlapping(self, key, start, end):
+        """
+        Returns the earliest-starting instance with the key `key` that
+        overlaps the interval from `start` to `end` (see
+        :meth:`IntervalIndex.get_overlapping`), or `None`. The interval must
+        not start in the past. Changes made by other processes are always
+        taken into account, so this can be used to check for conflicts
+        before saving a new instance.
+        """
+        return self.get_index(fresh=True).get_overlapping(key, start, end)
+
+    def get_all(self, timestamp=None):
+        """
+        Returns a dictionary mapping keys to the earliest-starting instance
+        that is active at `timestamp` (the current time by default)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return self.get_index().get_all(timestamp)
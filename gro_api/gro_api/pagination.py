@@ -1,4 +1,151 @@
-from rest_framework.pagination import LimitOffsetPagination
+import base64
+import binascii
+from collections import OrderedDict
+from rest_framework.settings import api_settings
+from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 
 class Pagination(LimitOffsetPagination):
     max_limit = 1000
+
+
+def filter_after(queryset, timestamp, pk, reverse=False):
+    """
+    Restrict `queryset` to the rows that come after the position
+    (`timestamp`, `pk`) in (timestamp, pk) order, or before it if `reverse` is
+    true. The range condition on `timestamp` is kept separate so that it can
+    use the (series, timestamp) indexes.
+    """
+    if reverse:
+        return queryset.filter(timestamp__lte=timestamp).exclude(
+            timestamp=timestamp, pk__gte=pk
+        )
+    else:
+        return queryset.filter(timestamp__gte=timestamp).exclude(
+            timestamp=timestamp, pk__lte=pk
+        )
+
+
+class Cursor:
+    """ A position in a time series queryset ordered by (timestamp, pk) """
+    def __init__(self, timestamp, pk, reverse=False):
+        self.timestamp = timestamp
+        self.pk = pk
+        self.reverse = reverse
+
+    def encode(self):
+        position = '{}:{}:{}'.format(int(self.reverse), self.timestamp, self.pk)
+        return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    @classmethod
+    def decode(cls, encoded):
+        try:
+            position = base64.urlsafe_b64decode(encoded.encode('ascii'))
+            reverse, timestamp, pk = position.decode('ascii').split(':')
+            return cls(int(timestamp), int(pk), bool(int(reverse)))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound('Invalid cursor')
+
+
+class TimeSeriesPagination(BasePagination):
+    """
+    Keyset pagination for append-only time series models. Results are ordered
+    by (timestamp, pk) and the position of the first or last row of a page is
+    encoded in the `cursor` query parameter of the previous and next links, so
+    every page is a single index range scan no matter how deep it is. No total
+    count is computed.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 1000
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        if limit <= 0:
+            return self.default_limit
+        return min(limit, self.max_limit)
+
+    def get_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None
+        return Cursor.decode(encoded)
+
+    def paginate_queryset(self, queryset, request, view=None,
+                          extra_sources=()):
+        """
+        Returns the page of `queryset` at the cursor of the request.
+
+        :param extra_sources: Callables that add rows which are not stored in
+            `queryset` to the results. Each one is called with the cursor (or
+            `None`) and the number of rows needed, and must return at most
+            that many rows that come after the cursor in (timestamp, pk)
+            order, or before it in reverse order for reverse cursors.
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+        cursor = self.get_cursor(request)
+        reverse = cursor is not None and cursor.reverse
+        if cursor is not None:
+            queryset = filter_after(
+                queryset, cursor.timestamp, cursor.pk, reverse
+            )
+        if reverse:
+            queryset = queryset.order_by('-timestamp', '-pk')
+        else:
+            queryset = queryset.order_by('timestamp', 'pk')
+        # Fetch one extra row to find out whether there is anything beyond
+        # this page
+        page = list(queryset[:self.limit + 1])
+        if extra_sources:
+            for source in extra_sources:
+                page.extend(source(cursor, self.limit + 1))
+            page.sort(
+                key=lambda row: (row.timestamp, row.pk), reverse=reverse
+            )
+            page = page[:self.limit + 1]
+        has_more = len(page) > self.limit
+        page = page[:self.limit]
+        if reverse:
+            page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        self.page = page
+        return page
+
+    def get_link(self, cursor):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor.encode())
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # We paged backwards past the start of the results, so the next
+            # page is the first one
+            url = self.request.build_absolute_uri()
+            return remove_query_param(url, self.cursor_query_param)
+        last = self.page[-1]
+        return self.get_link(Cursor(last.timestamp, last.pk))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        first = self.page[0]
+        return self.get_link(Cursor(first.timestamp, first.pk, reverse=True))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
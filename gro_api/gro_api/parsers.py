@@ -0,0 +1,39 @@
+"""
+This module defines a parser for a packed binary format for batches of time
+series rows, for gateways that are too slow to generate and parse JSON.
+"""
+import struct
+from rest_framework.parsers import BaseParser
+from rest_framework.exceptions import ParseError
+
+
+class PackedRows(list):
+    """
+    A list of `(series id, timestamp, value)` tuples that were read from a
+    packed batch and are already of the correct types
+    """
+    pass
+
+
+class PackedTimeSeriesParser(BaseParser):
+    """
+    Parses a body made of fixed-width little-endian records of a 32-bit
+    unsigned series id, a 64-bit signed integer timestamp and a 64-bit float
+    value, with no header or padding. Records are unpacked directly into
+    tuples.
+    """
+    media_type = 'application/x-gro-timeseries'
+    record = struct.Struct('<Iqd')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        data = stream.read() if stream is not None else b''
+        if len(data) % self.record.size:
+            raise ParseError(
+                'Packed time series bodies must be a whole number of '
+                '{}-byte records'.format(self.record.size)
+            )
+        rows = PackedRows(self.record.iter_unpack(memoryview(data)))
+        # NaN is the only value that is not equal to itself
+        if any(row[2] != row[2] for row in rows):
+            raise ParseError('Packed time series values must not be NaN')
+        return rows
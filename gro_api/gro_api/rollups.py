@@ -0,0 +1,249 @@
+"""
+This module defines hourly and daily summaries ("rollups") of the time series
+models in this project, so that charts of long periods of history can be drawn
+without reading every raw row.
+
+Each time series app defines a concrete subclass of :class:`RollupModel` with a
+foreign key to the series, a concrete subclass of :class:`RollupMarkModel`, and
+a :class:`TimeSeriesRollup` that ties them to the raw model. A cron job calls
+:meth:`TimeSeriesRollup.fold` periodically to fold the rows inserted since the
+last run into the rollups.
+"""
+from django.db import models, transaction
+from django.db.models import Min, Max, Sum, Count
+from .history import bucket_history, merge_bucket
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+#: The bucket widths in seconds that rollups are kept for, from the finest to
+#: the coarsest
+RESOLUTIONS = (HOUR, DAY)
+
+
+class RollupModel(models.Model):
+    """
+    The minimum, maximum, sum and number of values recorded for one series in
+    the bucket of :attr:`resolution` seconds starting at :attr:`timestamp`.
+    Subclasses must add a foreign key to the series model and should make it
+    unique together with :attr:`resolution` and :attr:`timestamp`.
+    """
+    class Meta:
+        abstract = True
+        ordering = ['timestamp']
+
+    resolution = models.PositiveIntegerField(
+        choices=((HOUR, 'Hourly'), (DAY, 'Daily'))
+    )
+    timestamp = models.IntegerField()
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField()
+    count = models.PositiveIntegerField()
+
+
+class RollupMarkModel(models.Model):
+    """
+    Holds the primary key of the last raw row that was folded into the
+    rollups of a time series model. Only one row (with primary key 1) is used.
+    """
+    class Meta:
+        abstract = True
+
+    last_pk = models.IntegerField(default=0)
+
+
+class TimeSeriesRollup:
+    """
+    Maintains the rollups of a time series model (a model with a foreign key
+    identifying the series, a `timestamp` and a `value`).
+
+    Raw rows are folded in primary key order, so the rollups summarize exactly
+    the rows whose primary key is at most the high-water mark, and the rows
+    after it have to be read from the raw table. The raw models are append-only
+    through the API; views that change or delete rows must call
+    :meth:`refold` for them.
+
+    :param model: The time series model
+    :param rollup_model: The subclass of :class:`RollupModel` for `model`
+    :param mark_model: The subclass of :class:`RollupMarkModel` for `model`
+    :param str series_field: The name of the foreign key that identifies the
+        series a row belongs to, on both `model` and `rollup_model`
+    """
+    #: The maximum number of raw rows folded in one transaction
+    chunk_size = 100000
+    #: The :class:`~gro_api.gro_api.archive.TimeSeriesArchive` that old raw
+    #: rows are moved to, if any. Archives set this themselves.
+    archive = None
+
+    def __init__(self, model, rollup_model, mark_model, series_field):
+        self.model = model
+        self.rollup_model = rollup_model
+        self.mark_model = mark_model
+        self.series_field = series_field
+        self.series_attname = model._meta.get_field(series_field).attname
+
+    def get_mark(self):
+        """ Returns the primary key of the last raw row that was folded """
+        marks = self.mark_model.objects.filter(pk=1).values_list(
+            'last_pk', flat=True
+        )
+        return marks[0] if marks else 0
+
+    def set_mark(self, last_pk):
+        updated = self.mark_model.objects.filter(pk=1).update(last_pk=last_pk)
+        if not updated:
+            self.mark_model.objects.create(pk=1, last_pk=last_pk)
+
+    def get_resolution(self, width):
+        """
+        Returns the coarsest resolution that buckets of `width` seconds can be
+        built from, or `None` if no rollups can be used
+        """
+        for resolution in reversed(RESOLUTIONS):
+            if width % resolution == 0:
+                return resolution
+        return None
+
+    def fold(self):
+        """
+        Fold the raw rows inserted since the last call into the rollups and
+        return the number of rows folded
+        """
+        last_pk = self.get_mark()
+        max_pk = self.model.objects.aggregate(Max('pk'))['pk__max']
+        if max_pk is None:
+            return 0
+        count = 0
+        while last_pk < max_pk:
+            upper_pk = min(last_pk + self.chunk_size, max_pk)
+            with transaction.atomic():
+                count += self.fold_range(last_pk, upper_pk)
+                self.set_mark(upper_pk)
+            last_pk = upper_pk
+        return count
+
+    def fold_range(self, lower_pk, upper_pk):
+        """
+        Fold the raw rows with primary keys in (`lower_pk`, `upper_pk`] into
+        the rollups. The raw rows are read once, grouped by hour, and the daily
+        rollups are built from the hourly groups.
+        """
+        rows = self.model.objects.filter(pk__gt=lower_pk, pk__lte=upper_pk)
+        new_buckets = {resolution: {} for resolution in RESOLUTIONS}
+        count = 0
+        for row in bucket_history(rows, self.series_field, RESOLUTIONS[0]):
+            count += row['count']
+            for resolution, buckets in new_buckets.items():
+                key = (
+                    row[self.series_field],
+                    row['bucket'] // resolution * resolution
+                )
+                merge_bucket(
+                    buckets, key, row['min_value'], row['max_value'],
+                    row['sum_value'], row['count']
+                )
+        for resolution, buckets in new_buckets.items():
+            self.merge(resolution, buckets)
+        return count
+
+    def merge(self, resolution, buckets):
+        """
+        Merge `buckets`, a dictionary mapping `(series id, timestamp)` to
+        `[min, max, sum, count]`, into the stored rollups of `resolution`
+        """
+        if not buckets:
+            return
+        series_ids = set(key[0] for key in buckets)
+        timestamps = [key[1] for key in buckets]
+        existing = self.rollup_model.objects.filter(**{
+            'resolution': resolution,
+            '{}__in'.format(self.series_field): series_ids,
+            'timestamp__gte': min(timestamps),
+            'timestamp__lte': max(timestamps),
+        }).values_list(
+            'pk', self.series_field, 'timestamp', 'min_value', 'max_value',
+            'sum_value', 'count'
+        )
+        replaced = []
+        for pk, series_id, timestamp, min_value, max_value, sum_value, count \
+                in existing:
+            key = (series_id, timestamp)
+            if key in buckets:
+                merge_bucket(
+                    buckets, key, min_value, max_value, sum_value, count
+                )
+                replaced.append(pk)
+        for start in range(0, len(replaced), 500):
+            self.rollup_model.objects.filter(
+                pk__in=replaced[start:start + 500]
+            ).delete()
+        self.rollup_model.objects.bulk_create([
+            self.rollup_model(**{
+                self.series_attname: series_id, 'resolution': resolution,
+                'timestamp': timestamp, 'min_value': min_value,
+                'max_value': max_value, 'sum_value': sum_value,
+                'count': count,
+            }) for (series_id, timestamp), (min_value, max_value, sum_value,
+                                            count) in buckets.items()
+        ], batch_size=500)
+
+    def refold(self, rows):
+        """
+        Rebuild the rollups that cover `rows`, a list of
+        `(series id, timestamp)` tuples, from the raw rows, including archived
+        ones. This should be called for the old and new positions of rows that
+        are changed and for rows that are deleted.
+        """
+        with transaction.atomic():
+            last_pk = self.get_mark()
+            for resolution in RESOLUTIONS:
+                keys = set(
+                    (series_id, timestamp // resolution * resolution)
+                    for series_id, timestamp in rows
+                )
+                for series_id, timestamp in keys:
+                    self.rollup_model.objects.filter(**{
+                        self.series_field: series_id,
+                        'resolution': resolution, 'timestamp': timestamp
+                    }).delete()
+                    summary = self.model.objects.filter(**{
+                        self.series_field: series_id,
+                        'timestamp__gte': timestamp,
+                        'timestamp__lt': timestamp + resolution,
+                        'pk__lte': last_pk,
+                    }).aggregate(
+                        min_value=Min('value'), max_value=Max('value'),
+                        sum_value=Sum('value'), count=Count('pk')
+                    )
+                    if self.archive is not None:
+                        self.merge_archived(
+                            summary, series_id, timestamp,
+                            timestamp + resolution - 1
+                        )
+                    if summary['count']:
+                        self.rollup_model.objects.create(**dict(
+                            summary, resolution=resolution,
+                            timestamp=timestamp,
+                            **{self.series_attname: series_id}
+                        ))
+
+    def merge_archived(self, summary, series_id, min_time, max_time):
+        """
+        Merge the archived rows of the series `series_id` between `min_time`
+        and `max_time` inclusive into `summary`, a dictionary of the kind
+        returned by the aggregate query in :meth:`refold`
+        """
+        archived = self.archive.read([series_id], min_time, max_time)
+        if archived is None:
+            return
+        for _, _, value in archived:
+            if summary['count']:
+                summary['min_value'] = min(summary['min_value'], value)
+                summary['max_value'] = max(summary['max_value'], value)
+                summary['sum_value'] += value
+                summary['count'] += 1
+            else:
+                summary.update(
+                    min_value=value, max_value=value, sum_value=value, count=1
+                )
@@ -170,6 +170,16 @@ if SERVER_MODE == DEVELOPMENT:
 else:
     MEDIA_ROOT = '/var/www/gro_api/media'
 
+# Whether new recipe runs compute their set points from the compiled recipe
+# when they are read instead of writing them to the `SetPoint` table
+LAZY_SET_POINTS = False
+
+# Time series rows that are older than their retention period
+if SERVER_MODE == DEVELOPMENT:
+    ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+else:
+    ARCHIVE_ROOT = '/var/lib/gro_api/archive'
+
 if SERVER_TYPE == LEAF:
     # TODO: We could dynamically generate this from the current ip address?
     # There is no guarantee about what host leaf servers will run behind
@@ -221,8 +231,20 @@ if SERVER_TYPE == LEAF:
     CACHES = {
         'default': {
             'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        }
+        },
+        # State that has to be visible to every uWSGI worker process
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': '',
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        },
     }
+    if SERVER_MODE == DEVELOPMENT:
+        CACHES['shared']['LOCATION'] = os.path.join(BASE_DIR, 'cache')
+    else:
+        CACHES['shared']['LOCATION'] = '/var/cache/gro_api'
     SOLO_CACHE = 'default'
     SOLO_CACHE_TIMEOUT = 60
 else:
@@ -333,6 +355,10 @@ REST_FRAMEWORK['TEST_REQUEST_DEFAULT_FORMAT'] = 'json'
 
 CRON_CLASSES = (
     'gro_api.farms.cron.UpdateFarmIp',
+    'gro_api.sensors.cron.UpdateDataPointRollups',
+    'gro_api.actuators.cron.UpdateActuatorStateRollups',
+    'gro_api.sensors.cron.ArchiveDataPoints',
+    'gro_api.actuators.cron.ArchiveActuatorStates',
 )
 
 # Sites
@@ -78,13 +78,19 @@ class TestSuite(unittest.TestSuite):
             self.unconfigured_tests.append(test)
 
     def run_test(self, test, result, debug):
+        # The previous class has to be torn down before the next one is set
+        # up so that their class-wide transactions don't overlap
+        self._tearDownPreviousClass(test, result)
         self._handleClassSetUp(test, result)
+        result._previousTestClass = test.__class__
         if not debug:
             test(result)
         else:
             test.debug()
-        self._tearDownPreviousClass(test, result)
-        result._previousTestClass = test.__class__
+
+    def tear_down_last_class(self, result):
+        self._tearDownPreviousClass(None, result)
+        result._previousTestClass = None
 
     def run_unconfigured_tests(self, result, debug):
         result.stream.writeln('\nRunning tests on unconfigured farm')
@@ -109,6 +115,9 @@ class TestSuite(unittest.TestSuite):
         if result.shouldStop:
             return result
         for layout in self.configured_tests.keys():
+            # Class level fixtures live in the database that is about to be
+            # reset, so the first test of each layout sets its class up again
+            self.tear_down_last_class(result)
             Reset()()
             farm = Farm.get_solo()
             farm.root_id = None
@@ -118,6 +127,7 @@ class TestSuite(unittest.TestSuite):
             self.run_configured_tests(layout, result, debug)
             if result.shouldStop:
                 break
+        self.tear_down_last_class(result)
         return result
 
     def debug(self):
@@ -1,8 +1,8 @@
 import time
-from django.db import models
+from django.db import models, connections, router
+from django.db.models import Case, When, Value
 from django.db.utils import OperationalError
 from django.db.models.signals import post_save
-from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.contenttypes.fields import GenericRelation
 from django.dispatch import receiver
 from ..gro_api.utils import system_layout
@@ -122,21 +122,72 @@ class Tray(models.Model):
     )
 
     def update_current_recipe_run(self):
+        Tray.update_current_recipe_runs([self])
+
+    @classmethod
+    def update_current_recipe_runs(cls, trays):
+        """
+        Set the :attr:`current_recipe_run` of every tray in the list `trays`
+        to the recipe run that is active on it right now. An active run stays
+        current until it ends, after which the earliest run that has not
+        ended yet takes its place once it has started. The runs of all of the
+        trays are read with one query for every 500 trays and the trays that
+        changed are saved with one update.
+        """
         current_time = time.time()
-        if self.current_recipe_run and \
-                current_time > self.current_recipe_run.end_timestamp:
-            self.current_recipe_run = None
-            self.save()
-        if not self.current_recipe_run:
-            try:
-                next_recipe_run = RecipeRun.objects.filter(
-                    tray=self, end_timestamp__gte=time.time()
-                ).earliest()
-                if current_time >= next_recipe_run.start_timestamp:
-                    self.current_recipe_run = next_recipe_run
-                    self.save()
-            except ObjectDoesNotExist:
-                pass
+        pending = [
+            tray for tray in trays if not (
+                tray.current_recipe_run and
+                current_time <= tray.current_recipe_run.end_timestamp
+            )
+        ]
+        if not pending:
+            return
+        next_runs = {}
+        tray_ids = [tray.pk for tray in pending]
+        for start in range(0, len(tray_ids), 500):
+            for run in cls.query_next_recipe_runs(
+                    tray_ids[start:start + 500], current_time):
+                next_runs[run.tray_id] = run
+        changed = {}
+        for tray in pending:
+            run = next_runs.get(tray.pk, None)
+            if run is not None and current_time < run.start_timestamp:
+                run = None
+            if tray.current_recipe_run_id != (run and run.pk):
+                changed[tray.pk] = run and run.pk
+            tray.current_recipe_run = run
+        if changed:
+            cls.objects.filter(pk__in=changed.keys()).update(
+                current_recipe_run=Case(*(
+                    When(pk=pk, then=Value(run_id)) for pk, run_id in
+                    changed.items() if run_id is not None
+                ), default=Value(None), output_field=models.IntegerField())
+            )
+
+    @staticmethod
+    def query_next_recipe_runs(tray_ids, current_time):
+        """
+        Returns a queryset of the earliest recipe run that has not ended by
+        `current_time` on each of the trays `tray_ids`, using a single
+        greatest-per-group query
+        """
+        opts = RecipeRun._meta
+        connection = connections[router.db_for_read(RecipeRun)]
+        qn = connection.ops.quote_name
+        sql = (
+            '{table}.{pk} = (SELECT run.{pk} FROM {table} run '
+            'WHERE run.{tray} = {table}.{tray} AND run.{end} >= %s '
+            'ORDER BY run.{start}, run.{pk} LIMIT 1)'
+        ).format(
+            table=qn(opts.db_table), pk=qn(opts.pk.column),
+            tray=qn(opts.get_field('tray').column),
+            start=qn(opts.get_field('start_timestamp').column),
+            end=qn(opts.get_field('end_timestamp').column),
+        )
+        return RecipeRun.objects.filter(tray__in=tray_ids).extra(
+            where=[sql], params=[current_time]
+        ).order_by()
 
     def __str__(self):
         return self.name
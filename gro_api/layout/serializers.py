@@ -133,6 +133,7 @@ class LayoutObjectSerializer(BaseSerializer, ResourcesMixin):
             )
         return attrs
 
+    @staticmethod
     def ranges_overlap(range1, range2):
         return (range1[1] > range2[0]) and (range1[0] < range2[1])
 
@@ -147,7 +148,7 @@ class LayoutObjectSerializer(BaseSerializer, ResourcesMixin):
             if self.ranges_overlap(other_x_range, this_x_range) \
                     and self.ranges_overlap(other_y_range, this_y_range) \
                     and self.ranges_overlap(other_z_range, this_z_range):
-                raise ValidationError(
+                raise serializers.ValidationError(
                     'Entity cannot overlap with another entity of the same '
                     'type'
                 )
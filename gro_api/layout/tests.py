@@ -1,3 +1,4 @@
+import time
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
@@ -7,7 +8,9 @@ from ..gro_api.utils import system_layout
 from ..gro_api.test import (
     APITestCase, run_with_layouts, run_with_all_layouts
 )
+from ..recipes.models import Recipe, RecipeRun
 from .schemata import all_schemata
+from .models import Tray
 
 class LayoutAuthMixin:
     @classmethod
@@ -108,3 +111,65 @@ class TrayCRUDTestCase(LayoutAuthMixin, APITestCase):
         res = self.client.get(self.url_for_object('tray'))
         self.assertEqual(res.status_code, 200)
         self.assertEqual(len(res.data['results']), 1)
+
+    @run_with_layouts('tray')
+    def test_tray_overlap(self):
+        tray_info = dict(generic_obj_info)
+        tray_info['parent'] = self.url_for_object('enclosure', 1)
+        res = self.client.post(self.url_for_object('tray'), tray_info)
+        self.assertEqual(res.status_code, 201)
+        # A tray right next to the first one is allowed
+        tray_info['x'] = 1
+        res = self.client.post(self.url_for_object('tray'), tray_info)
+        self.assertEqual(res.status_code, 201)
+        # but one that overlaps either of them isn't
+        tray_info['x'] = 0.5
+        res = self.client.post(self.url_for_object('tray'), tray_info)
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_layouts('tray')
+    def test_current_recipe_run(self):
+        tray_ids = []
+        for i in range(3):
+            tray_info = dict(generic_obj_info)
+            tray_info['parent'] = self.url_for_object('enclosure', 1)
+            # Trays in the same enclosure can't overlap
+            tray_info['x'] = 2 * i
+            res = self.client.post(self.url_for_object('tray'), tray_info)
+            self.assertEqual(res.status_code, 201)
+            tray_ids.append(int(res.data['url'].split('/')[-2]))
+        now = int(time.time())
+        recipe = Recipe.objects.create(name='test', file='recipes/test')
+        active = RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_ids[0], start_timestamp=now - 100,
+            end_timestamp=now + 1000
+        )
+        RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_ids[1], start_timestamp=now - 200,
+            end_timestamp=now - 100
+        )
+        RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_ids[1], start_timestamp=now + 100,
+            end_timestamp=now + 1000
+        )
+        res = self.client.get(self.url_for_object('tray'))
+        self.assertEqual(res.status_code, 200)
+        runs = {
+            int(tray['url'].split('/')[-2]): tray['current_recipe_run']
+            for tray in res.data['results']
+        }
+        self.assertTrue(runs[tray_ids[0]].endswith(
+            self.url_for_object('recipeRun', active.pk)
+        ))
+        self.assertIsNone(runs[tray_ids[1]])
+        self.assertIsNone(runs[tray_ids[2]])
+        self.assertEqual(
+            dict(Tray.objects.values_list('pk', 'current_recipe_run')),
+            {tray_ids[0]: active.pk, tray_ids[1]: None, tray_ids[2]: None}
+        )
+        # The current run is kept without querying the runs again
+        trays = list(Tray.objects.select_related(
+            'current_recipe_run'
+        ).filter(pk=tray_ids[0]))
+        with self.assertNumQueries(0):
+            Tray.update_current_recipe_runs(trays)
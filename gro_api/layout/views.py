@@ -1,11 +1,13 @@
 import time
-from django.core.exceptions import ObjectDoesNotExist
+from rest_framework.reverse import reverse
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.utils.field_mapping import get_detail_view_name
 from ..gro_api.viewsets import SingletonModelViewSet
-from ..recipes.models import SetPoint
-from ..resources.models import ResourceProperty
+from ..recipes.models import RecipeRun
+from ..recipes.serializers import RecipeRunSerializer
+from ..recipes.set_points import current_set_points
 from .serializers import (
     Model3DSerializer, TrayLayoutSerializer, PlantSiteLayoutSerializer,
     EnclosureSerializer, TraySerializer, PlantSiteSerializer,
@@ -45,27 +47,27 @@ class EnclosureViewSet(SingletonModelViewSet):
 class TrayViewSet(ModelViewSet):
     """ The lowest level in the layout tree; contains plant sites """
     model = Tray
-    queryset = Tray.objects.all()
+    queryset = Tray.objects.select_related('current_recipe_run')
     serializer_class = TraySerializer
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.update_current_recipe_run()
+        Tray.update_current_recipe_runs([instance])
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
 
-        for instance in queryset:
-            instance.update_current_recipe_run()
-
         page = self.paginate_queryset(queryset)
         if page is not None:
+            Tray.update_current_recipe_runs(page)
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(queryset, many=True)
+        trays = list(queryset)
+        Tray.update_current_recipe_runs(trays)
+        serializer = self.get_serializer(trays, many=True)
         return Response(serializer.data)
 
     @detail_route(methods=["get"])
@@ -75,18 +77,68 @@ class TrayViewSet(ModelViewSet):
         values
         """
         tray = self.get_object()
-        set_points = {}
-        for property in ResourceProperty.objects.all():
-            try:
-                set_point = SetPoint.objects.filter(
-                    tray=tray, property=property, timestamp__lt=time.time()
-                ).latest()
-            except ObjectDoesNotExist:
-                continue
+        return Response({
+            code: value for code, value in
+            current_set_points.get(tray.pk).values()
+        })
+
+    @detail_route(methods=["get"])
+    def schedule(self, request, pk=None):
+        """
+        Get the recipe runs of the tray in chronological order, split into
+        `past` (ended), `current` and `future` (not started) runs
+        ---
+        serializer: gro_api.recipes.serializers.RecipeRunSerializer
+        """
+        tray = self.get_object()
+        now = time.time()
+        runs = RecipeRun.objects.filter(tray=tray).order_by(
+            'start_timestamp', 'pk'
+        )
+        past, current, future = [], None, []
+        for run in runs:
+            if run.end_timestamp < now:
+                past.append(run)
+            elif run.start_timestamp > now or current is not None:
+                future.append(run)
             else:
-                code = ''.join(set_point.property.natural_key())
-                set_points[code] = set_point.value
-        return Response(set_points)
+                # Earlier runs take precedence, like in
+                # `Tray.update_current_recipe_runs`
+                current = run
+        context = self.get_serializer_context()
+        return Response({
+            'past': RecipeRunSerializer(
+                past, many=True, context=context
+            ).data,
+            'current': current and RecipeRunSerializer(
+                current, context=context
+            ).data,
+            'future': RecipeRunSerializer(
+                future, many=True, context=context
+            ).data,
+        })
+
+    @list_route(methods=["get"])
+    def all_set_points(self, request):
+        """
+        Get the current set points of every tray, as a list of objects holding
+        the URL of a tray and a dictionary mapping resource property codes to
+        current set point values
+        """
+        trays = list(self.filter_queryset(self.get_queryset()))
+        set_points = current_set_points.get_many([tray.pk for tray in trays])
+        view_name = get_detail_view_name(Tray)
+        return Response([
+            {
+                'tray': reverse(
+                    view_name, kwargs={'pk': tray.pk}, request=request
+                ),
+                'set_points': {
+                    code: value for code, value in
+                    set_points[tray.pk].values()
+                },
+            } for tray in trays
+        ])
 
 
 class PlantSiteViewSet(ModelViewSet):
@@ -0,0 +1,122 @@
+"""
+This module defines the parser of recipe files.
+
+A recipe file holds one command per line, prefixed by the time at which it
+should run relative to the start of the recipe run as `days:hours:minutes:
+seconds`. `S<resource type code><property code> <value>` commands set the set
+point of a resource property and the `GHAR` command ends the recipe. Anything
+after a `#` is a comment.
+"""
+import logging
+from array import array
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework.exceptions import ValidationError
+from ..resources.models import ResourceProperty
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidTimeString(Exception):
+    pass
+
+
+def parse_time_string(time_string):
+    time_args = time_string.split(b':')
+    if len(time_args) != 4:
+        raise InvalidTimeString()
+    try:
+        time_args = [int(arg) for arg in time_args]
+    except ValueError:
+        raise InvalidTimeString()
+    return time_args.pop() + 60*time_args.pop() + 60*60*time_args.pop() + \
+            60*60*24*time_args.pop()
+
+
+def compile_recipe(lines, name):
+    """
+    Parses the recipe file with the lines `lines` and returns a tuple
+    `(offsets, property_ids, values, end_offset, max_offset)`, where the first
+    three are parallel arrays holding the set points of the recipe in file
+    order, `end_offset` is the offset of the `GHAR` command and `max_offset`
+    is the largest offset of any command that was read.
+
+    :param lines: An iterable of lines of the file, as bytes
+    :param str name: The name of the recipe, used in log messages
+    """
+    properties = {}
+    offsets = array('q')
+    property_ids = array('q')
+    values = array('d')
+    end_offset = None
+    max_offset = None
+    for line in lines:
+        line = line.strip()
+        args = line.split(b' ')
+        try:
+            comment_start = args.index(b'#')
+            args = args[0:comment_start]
+        except ValueError:
+            pass
+        if not args or not args[0]:
+            continue
+        time_string = args.pop(0)
+        try:
+            offset = parse_time_string(time_string)
+        except InvalidTimeString:
+            logger.warning(
+                'Encountered invalid time string "%s" in recipe "%s"',
+                time_string, name
+            )
+            continue
+        if max_offset is None or offset > max_offset:
+            max_offset = offset
+        if not args:
+            logger.warning(
+                'Recipe line "%s" in recipe "%s" has no command', line, name
+            )
+            continue
+        command = args.pop(0)
+        command_type = command[0:1]
+        if command_type == b'S':
+            natural_key = (command[1:2], command[2:4])
+            if natural_key not in properties:
+                try:
+                    properties[natural_key] = \
+                        ResourceProperty.objects.get_by_natural_key(
+                            *natural_key
+                        ).pk
+                except ObjectDoesNotExist:
+                    raise ValidationError(
+                        'Recipe "{}" sets unknown resource property '
+                        '"{}"'.format(name, command[1:4].decode())
+                    )
+            try:
+                value = float(args.pop(0))
+            except (IndexError, ValueError):
+                raise ValidationError(
+                    'Recipe line "{}" has an invalid set point value'.format(
+                        line.decode()
+                    )
+                )
+            offsets.append(offset)
+            property_ids.append(properties[natural_key])
+            values.append(value)
+        elif command_type == b'G':
+            if command == b'GHAR':
+                end_offset = offset
+                break
+        else:
+            logger.warning(
+                'Encountered invalid command type "%s" in recipe "%s"',
+                command_type, name
+            )
+            continue
+        if args:
+            logger.warning(
+                'Recipe line "%s" contained extra arguments', line
+            )
+    if end_offset is None:
+        raise ValidationError(
+            'Recipe file did not include an end timestamp.'
+        )
+    return offsets, property_ids, values, end_offset, max_offset
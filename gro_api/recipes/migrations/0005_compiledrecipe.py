@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_auto_20150902_1801'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompiledRecipe',
+            fields=[
+                ('id', models.AutoField(serialize=False, primary_key=True, auto_created=True, verbose_name='ID')),
+                ('content_hash', models.CharField(unique=True, max_length=64)),
+                ('offsets', models.BinaryField()),
+                ('property_ids', models.BinaryField()),
+                ('values', models.BinaryField()),
+                ('end_offset', models.IntegerField()),
+                ('max_offset', models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='compiled',
+            field=models.ForeignKey(null=True, related_name='recipes+', to='recipes.CompiledRecipe', editable=False, on_delete=django.db.models.deletion.SET_NULL),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_compiledrecipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reciperun',
+            name='compiled',
+            field=models.ForeignKey(null=True, related_name='runs+', to='recipes.CompiledRecipe', editable=False, on_delete=django.db.models.deletion.PROTECT),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_reciperun_compiled'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='setpoint',
+            index_together=set([('tray', 'property', 'timestamp')]),
+        ),
+    ]
@@ -1,19 +1,147 @@
 import time
-from django.db import models
+import hashlib
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from django.db import models, IntegrityError, transaction
+from ..gro_api.intervals import ModelIntervalIndex
 from ..plants.models import PlantType
 from ..resources.models import ResourceProperty
 
 
+#: The set points of a compiled recipe sorted by offset. `by_property` maps
+#: property ids to `(offsets, values)` tuples holding the set points of one
+#: property in the same order.
+RecipeSteps = namedtuple(
+    'RecipeSteps', ('offsets', 'property_ids', 'values', 'by_property')
+)
+
+
+class CompiledRecipe(models.Model):
+    """
+    The set points of a recipe file in compact form, shared by every recipe
+    with the same file contents. :attr:`offsets`, :attr:`property_ids` and
+    :attr:`values` are packed parallel arrays holding, for every set point,
+    its time relative to the start of the run, the id of its resource
+    property and its value.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    offsets = models.BinaryField()
+    property_ids = models.BinaryField()
+    values = models.BinaryField()
+    end_offset = models.IntegerField()
+    max_offset = models.IntegerField()
+
+    @classmethod
+    def get_or_compile(cls, content, name, save=True):
+        """
+        Returns the compiled form of the recipe file with the contents
+        `content`, compiling it if no recipe file with the same contents has
+        been compiled before. If `save` is false, a newly compiled recipe is
+        returned without being saved.
+        """
+        from .compiler import compile_recipe
+        content_hash = hashlib.sha256(content).hexdigest()
+        try:
+            return cls.objects.get(content_hash=content_hash)
+        except cls.DoesNotExist:
+            pass
+        offsets, property_ids, values, end_offset, max_offset = \
+            compile_recipe(content.splitlines(), name)
+        compiled = cls(
+            content_hash=content_hash, offsets=offsets.tobytes(),
+            property_ids=property_ids.tobytes(), values=values.tobytes(),
+            end_offset=end_offset, max_offset=max_offset
+        )
+        if not save:
+            return compiled
+        try:
+            with transaction.atomic():
+                compiled.save()
+                return compiled
+        except IntegrityError:
+            # Compiled concurrently by another process
+            return cls.objects.get(content_hash=content_hash)
+
+    def get_arrays(self):
+        """ Returns the `(offsets, property_ids, values)` arrays """
+        offsets = array('q')
+        offsets.frombytes(bytes(self.offsets))
+        property_ids = array('q')
+        property_ids.frombytes(bytes(self.property_ids))
+        values = array('d')
+        values.frombytes(bytes(self.values))
+        return offsets, property_ids, values
+
+    #: Maps `(pk, content_hash)` tuples to the :class:`RecipeSteps` of
+    #: compiled recipes, which never change once they have been created
+    steps_cache = {}
+    #: The maximum number of entries in :attr:`steps_cache`
+    max_cached_steps = 64
+
+    def get_steps(self):
+        """
+        Returns the :class:`RecipeSteps` of this recipe. Set points with the
+        same offset are kept in file order.
+        """
+        cache_key = (self.pk, self.content_hash)
+        steps = self.steps_cache.get(cache_key, None)
+        if steps is not None:
+            return steps
+        offsets, property_ids, values = self.get_arrays()
+        order = sorted(range(len(offsets)), key=offsets.__getitem__)
+        offsets = array('q', (offsets[i] for i in order))
+        property_ids = array('q', (property_ids[i] for i in order))
+        values = array('d', (values[i] for i in order))
+        by_property = {}
+        for offset, property_id, value in zip(offsets, property_ids, values):
+            if property_id not in by_property:
+                by_property[property_id] = (array('q'), array('d'))
+            by_property[property_id][0].append(offset)
+            by_property[property_id][1].append(value)
+        steps = RecipeSteps(offsets, property_ids, values, by_property)
+        if len(self.steps_cache) >= self.max_cached_steps:
+            self.steps_cache.clear()
+        self.steps_cache[cache_key] = steps
+        return steps
+
+
 class Recipe(models.Model):
     name = models.CharField(max_length=100)
     plant_types = models.ManyToManyField(
         PlantType, related_name='recipes', blank=True
     )
     file = models.FileField(upload_to='recipes')
+    compiled = models.ForeignKey(
+        CompiledRecipe, null=True, editable=False, related_name='recipes+',
+        on_delete=models.SET_NULL
+    )
 
     def __str__(self):
         return self.name
 
+    def get_compiled(self, save=True):
+        """
+        Returns the :class:`CompiledRecipe` of the file of this recipe. The
+        file is only read the first time this is called for a given file. If
+        `save` is false, nothing is written to the database.
+        """
+        if self.compiled_id is None:
+            self.file.open('rb')
+            try:
+                content = self.file.read()
+            finally:
+                self.file.close()
+            compiled = CompiledRecipe.get_or_compile(
+                content, self.name, save=save
+            )
+            if compiled.pk is None:
+                return compiled
+            self.compiled = compiled
+            if save:
+                Recipe.objects.filter(pk=self.pk).update(compiled=compiled)
+        return self.compiled
+
 
 class RecipeRun(models.Model):
     class Meta:
@@ -24,12 +152,181 @@ class RecipeRun(models.Model):
     end_timestamp = models.IntegerField(blank=True)
     recipe = models.ForeignKey(Recipe, related_name='runs')
     tray = models.ForeignKey('layout.Tray', related_name='recipe_runs+')
+    # Lazy runs reference the compiled recipe instead of having `SetPoint`
+    # rows, and their set points are computed when they are read
+    compiled = models.ForeignKey(
+        CompiledRecipe, null=True, editable=False, related_name='runs+',
+        on_delete=models.PROTECT
+    )
+
+    # The set points of lazy runs are given negative ids made of the id of
+    # the run in the high bits and the position of the set point in the low
+    # bits. Positions below the number of steps of the recipe refer to steps
+    # and the others to the null set points written at the end of the run
+    # (one per resource property, offset by the id of the property). Ids grow
+    # with the position, so the (timestamp, id) order of the set points of a
+    # run is their position order.
+    set_point_id_bits = 32
+
+    @property
+    def is_lazy(self):
+        return self.compiled_id is not None
+
+    def get_set_point_id(self, position):
+        mask = (1 << self.set_point_id_bits) - 1
+        return -((self.pk << self.set_point_id_bits) | (mask - position))
+
+    @classmethod
+    def get_lazy_set_point(cls, set_point_id):
+        """
+        Returns the set point of a lazy run with the (negative) id
+        `set_point_id`, or `None` if there is no such set point
+        """
+        mask = (1 << cls.set_point_id_bits) - 1
+        run_id = -set_point_id >> cls.set_point_id_bits
+        position = mask - (-set_point_id & mask)
+        try:
+            run = cls.objects.select_related('compiled').get(
+                pk=run_id, compiled__isnull=False
+            )
+        except cls.DoesNotExist:
+            return None
+        steps = run.compiled.get_steps()
+        if position < len(steps.offsets):
+            if position >= run.get_step_count(steps):
+                return None
+            return run.make_set_point(
+                position, run.start_timestamp + steps.offsets[position],
+                steps.property_ids[position], steps.values[position]
+            )
+        property_id = position - len(steps.offsets)
+        if not ResourceProperty.objects.filter(pk=property_id).exists():
+            return None
+        return run.make_set_point(
+            position, run.end_timestamp, property_id, None
+        )
+
+    def get_step_count(self, steps):
+        """
+        Returns the number of steps of `steps` that come no later than the end
+        of this run
+        """
+        return bisect_right(
+            steps.offsets, self.end_timestamp - self.start_timestamp
+        )
+
+    def make_set_point(self, position, timestamp, property_id, value):
+        return SetPoint(
+            pk=self.get_set_point_id(position), tray_id=self.tray_id,
+            property_id=property_id, timestamp=timestamp, value=value,
+            recipe_run=self
+        )
+
+    def iterate_set_points(self, position=None, reverse=False,
+                           property_ids=None):
+        """
+        Yields the set points of this lazy run as unsaved :class:`SetPoint`
+        instances in (timestamp, id) order, starting after the
+        `(timestamp, id)` tuple `position`. If `reverse` is true, the set
+        points before `position` are yielded in reverse order instead.
+        `property_ids` is the sorted list of all resource property ids, which
+        is queried if it isn't given.
+        """
+        steps = self.compiled.get_steps()
+        step_count = self.get_step_count(steps)
+        if property_ids is None:
+            property_ids = list(
+                ResourceProperty.objects.order_by('pk').values_list(
+                    'pk', flat=True
+                )
+            )
+
+        def get_row(index):
+            if index < step_count:
+                return (
+                    index, self.start_timestamp + steps.offsets[index],
+                    steps.property_ids[index], steps.values[index]
+                )
+            property_id = property_ids[index - step_count]
+            return (
+                len(steps.offsets) + property_id, self.end_timestamp,
+                property_id, None
+            )
+
+        def get_key(index):
+            position, timestamp = get_row(index)[:2]
+            return (timestamp, self.get_set_point_id(position))
+
+        count = step_count + len(property_ids)
+        # Find the first row that comes after `position` with a binary search
+        # over the keys, which are strictly increasing
+        low, high = 0, count
+        if position is not None:
+            position = tuple(position)
+            while low < high:
+                middle = (low + high) // 2
+                if get_key(middle) <= position:
+                    low = middle + 1
+                else:
+                    high = middle
+        if reverse:
+            if position is not None:
+                # Skip the row at `position` itself
+                while low > 0 and get_key(low - 1) >= position:
+                    low -= 1
+            else:
+                low = count
+            indexes = range(low - 1, -1, -1)
+        else:
+            indexes = range(low, count)
+        for index in indexes:
+            yield self.make_set_point(*get_row(index))
+
+    def get_next_set_point_timestamp(self, timestamp):
+        """
+        Returns the timestamp of the first set point of this lazy run that is
+        later than `timestamp`, or `None` if there is none
+        """
+        if timestamp >= self.end_timestamp:
+            return None
+        steps = self.compiled.get_steps()
+        index = bisect_right(steps.offsets, timestamp - self.start_timestamp)
+        if index < len(steps.offsets):
+            return min(
+                self.start_timestamp + steps.offsets[index], self.end_timestamp
+            )
+        return self.end_timestamp
+
+    def get_set_points_at(self, timestamp):
+        """
+        Returns a dictionary mapping property ids to `(timestamp, value)`
+        tuples describing the latest set point of this lazy run for the
+        property that is no later than `timestamp`
+        """
+        if timestamp < self.start_timestamp:
+            return {}
+        if timestamp >= self.end_timestamp:
+            return {
+                property_id: (self.end_timestamp, None) for property_id in
+                ResourceProperty.objects.values_list('pk', flat=True)
+            }
+        offset = timestamp - self.start_timestamp
+        set_points = {}
+        for property_id, (offsets, values) in \
+                self.compiled.get_steps().by_property.items():
+            index = bisect_right(offsets, offset) - 1
+            if index >= 0:
+                set_points[property_id] = (
+                    self.start_timestamp + offsets[index], values[index]
+                )
+        return set_points
 
 
 class SetPoint(models.Model):
     class Meta:
         ordering = ['timestamp']
         get_latest_by = 'timestamp'
+        index_together = [('tray', 'property', 'timestamp')]
 
     tray = models.ForeignKey('layout.Tray', related_name='set_points+')
     property = models.ForeignKey(ResourceProperty, related_name='set_points+')
@@ -48,3 +345,6 @@ class ActuatorOverride(models.Model):
     actuator = models.ForeignKey('actuators.Actuator', related_name='overrides+')
     value = models.FloatField()
 
+
+#: The recipe runs that have not ended yet, by tray
+recipe_run_index = ModelIntervalIndex(RecipeRun, 'tray')
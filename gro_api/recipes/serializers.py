@@ -1,18 +1,19 @@
 import time
-import logging
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import IntegerField
 from ..gro_api.serializers import BaseSerializer
 from ..resources.models import ResourceProperty
-from .models import Recipe, RecipeRun, SetPoint, ActuatorOverride
-
-logger = logging.getLogger(__name__)
+from .models import (
+    Recipe, RecipeRun, SetPoint, ActuatorOverride, recipe_run_index
+)
+from .set_points import current_set_points
 
 
 class RecipeSerializer(BaseSerializer):
     class Meta:
         model = Recipe
+        exclude = ('compiled',)
 
     def validate_plant_types(self, value):
         for first_type in value:
@@ -28,29 +29,21 @@ class RecipeSerializer(BaseSerializer):
                     )
         return value
 
-
-class InvalidTimeString(Exception):
-    pass
+    def update(self, instance, validated_data):
+        if 'file' in validated_data:
+            # The new file is compiled when the next run is started
+            validated_data['compiled'] = None
+        return super().update(instance, validated_data)
 
 
 class RecipeRunSerializer(BaseSerializer):
     class Meta:
         model = RecipeRun
+        exclude = ('compiled',)
 
     start_timestamp = IntegerField(required=False, allow_null=True)
     end_timestamp = IntegerField(required=False, allow_null=True)
 
-    def parse_time_string(self, time_string):
-        time_args = time_string.split(b':')
-        if len(time_args) != 4:
-            raise InvalidTimeString()
-        try:
-            time_args = [int(arg) for arg in time_args]
-        except ValueError:
-            raise InvalidTimeString()
-        return time_args.pop() + 60*time_args.pop() + 60*60*time_args.pop() + \
-                60*60*24*time_args.pop()
-
     def create(self, validated_data):
         current_time = time.time()
         recipe = validated_data['recipe']
@@ -60,90 +53,51 @@ class RecipeRunSerializer(BaseSerializer):
             raise ValidationError(
                 'Start timestamp must be a time in the future.'
             )
-        qs = RecipeRun.objects.filter(
-            tray=tray, start_timestamp__lt=start_timestamp,
-            end_timestamp__gt=start_timestamp
-        )
-        if qs.count():
+        # Check that the run does not start during another one before reading
+        # the recipe, and then that it does not reach the next one
+        if recipe_run_index.get_overlapping(
+                tray.pk, start_timestamp, start_timestamp):
             raise ValidationError(
                 'The proposed recipe run overlaps with an existing recipe run.'
             )
-        try:
-            next_start_timestamp = RecipeRun.objects.filter(
-                tray=tray, start_timestamp__gte=start_timestamp
-            ).earliest().start_timestamp
-        except ObjectDoesNotExist:
-            next_start_timestamp = float("inf")
-        set_points = []
-        end_timestamp = None
-        for line in recipe.file:
-            line = line.strip()
-            args = line.split(b' ')
-            try:
-                comment_start = args.index(b'#')
-                args = args[0:comment_start]
-            except ValueError:
-                pass
-            if not args:
-                continue
-            time_string = args.pop(0)
-            try:
-                timedelta = self.parse_time_string(time_string)
-            except InvalidTimeString:
-                logger.warning(
-                    'Encountered invalid time string "%s" in recipe "%s"',
-                    time_string, recipe.name
-                )
-                continue
-            command_timestamp = start_timestamp + timedelta
-            if command_timestamp >= next_start_timestamp:
-                raise ValidationError(
-                    'The proposed recipe run overlaps with an existing recipe '
-                    'run.'
-                )
-            command = args.pop(0)
-            command_type = command[0:1]
-            if command_type == b'S':
-                property = ResourceProperty.objects.get_by_natural_key(
-                        command[1:2], command[2:4]
-                )
-                value = float(args.pop(0))
-                set_point = SetPoint(
-                    tray=tray, property=property, timestamp=command_timestamp,
-                    value=value
-                )
-                set_points.append(set_point)
-            elif command_type == b'G':
-                if command == b'GHAR':
-                    end_timestamp = command_timestamp
-                    set_points.extend([
-                        SetPoint(
-                            tray=tray, property=property,
-                            timestamp=end_timestamp, value=None
-                        ) for property in ResourceProperty.objects.all()
-                    ])
-                    break
-            else:
-                logger.warning(
-                    'Encountered invalid command type "%s" in recipe "%s"',
-                    command_type, recipe.name
-                )
-                continue
-            if args:
-                logger.warning(
-                    'Recipe line "%s" contained extra arguments', line
-                )
-        if not end_timestamp:
+        compiled = recipe.get_compiled()
+        if recipe_run_index.get_overlapping(
+                tray.pk, start_timestamp,
+                start_timestamp + compiled.max_offset):
             raise ValidationError(
-                'Recipe file did not include an end timestamp.'
+                'The proposed recipe run overlaps with an existing recipe '
+                'run.'
             )
+        end_timestamp = start_timestamp + compiled.end_offset
         validated_data['start_timestamp'] = start_timestamp
         validated_data['end_timestamp'] = end_timestamp
+        if settings.LAZY_SET_POINTS:
+            # The set points are computed from the compiled recipe when they
+            # are read
+            validated_data['compiled'] = compiled
+            return super().create(validated_data)
         instance = super().create(validated_data)
         try:
-            for set_point in set_points:
-                set_point.recipe_run = instance
+            offsets, property_ids, values = compiled.get_arrays()
+            set_points = [
+                SetPoint(
+                    tray=tray, property_id=property_id,
+                    timestamp=start_timestamp + offset, value=value,
+                    recipe_run=instance
+                ) for offset, property_id, value in zip(
+                    offsets, property_ids, values
+                )
+            ]
+            set_points.extend(
+                SetPoint(
+                    tray=tray, property_id=property_id,
+                    timestamp=end_timestamp, value=None, recipe_run=instance
+                ) for property_id in ResourceProperty.objects.values_list(
+                    'pk', flat=True
+                )
+            )
             SetPoint.objects.bulk_create(set_points)
+            current_set_points.invalidate()
         except:
             instance.delete()
             raise
@@ -177,7 +131,7 @@ class RecipeRunSerializer(BaseSerializer):
             raise ValidationError(
                 'Extending a recipe run is not allowed.'
             )
-        if end_timestamp < instance.end_timestamp:
+        if end_timestamp < instance.end_timestamp and not instance.is_lazy:
             SetPoint.objects.filter(
                 recipe_run=instance,
                 timestamp__gt=validated_data['end_timestamp']
@@ -188,6 +142,7 @@ class RecipeRunSerializer(BaseSerializer):
                     value=None, recipe_run=instance
                 ) for property in ResourceProperty.objects.all()
             ])
+            current_set_points.invalidate()
         return super().update(instance, validated_data)
 
 
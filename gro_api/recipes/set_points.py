@@ -0,0 +1,155 @@
+"""
+This module defines a cache of the current set points of every tray.
+"""
+import time
+from collections import defaultdict
+from django.db import connections, router
+from django.db.models import Min
+from django.db.models.signals import post_save, post_delete
+from ..gro_api.cache import get_shared_cache, get_farm_cache_key
+from ..resources.models import ResourceProperty
+from .models import RecipeRun, SetPoint
+
+
+class CurrentSetPointStore:
+    """
+    Keeps the current set points of each tray in the shared cache.
+
+    The set points of a tray are read with one greatest-per-group query
+    (joined to the codes of the properties) and cached until the timestamp of
+    the next set point of the tray, so repeated reads between two set points
+    cost no queries. Every cached entry is tagged with a version counter that
+    is bumped whenever set points, recipe runs or resource properties change,
+    which invalidates the entries of every tray in every process at once.
+    Code that writes set points without sending signals (e.g. with
+    `bulk_create`) must call :meth:`invalidate`.
+    """
+    version_key = 'currentSetPoints:version'
+
+    def __init__(self):
+        for model in (SetPoint, RecipeRun, ResourceProperty):
+            post_save.connect(self.invalidate, sender=model, weak=False)
+            post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def get_cache_key(self, tray_id):
+        return get_farm_cache_key('currentSetPoints', tray_id)
+
+    def invalidate(self, **kwargs):
+        """ Forget the set points of every tray """
+        cache = get_shared_cache()
+        key = get_farm_cache_key(self.version_key)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+    def get(self, tray_id):
+        """
+        Returns a dictionary mapping the ids of the resource properties that
+        have a current set point for the tray `tray_id` to `(code, value)`
+        tuples, where `code` is the code of the resource type followed by the
+        code of the property
+        """
+        return self.get_many([tray_id])[tray_id]
+
+    def get_many(self, tray_ids):
+        """
+        Like :meth:`get`, but returns a dictionary mapping every id in
+        `tray_ids` to the set points of the tray. Takes two cache reads if
+        every tray is cached and three queries otherwise.
+        """
+        now = time.time()
+        cache = get_shared_cache()
+        version = cache.get(get_farm_cache_key(self.version_key), 0)
+        keys = {self.get_cache_key(tray_id): tray_id for tray_id in tray_ids}
+        results = {}
+        for key, entry in cache.get_many(list(keys.keys())).items():
+            entry_version, computed_at, valid_until, set_points = entry
+            if entry_version == version and computed_at <= now and \
+                    (valid_until is None or now < valid_until):
+                results[keys[key]] = set_points
+        missing = [
+            tray_id for tray_id in tray_ids if tray_id not in results
+        ]
+        if missing:
+            entries = self.load(missing, now)
+            cache.set_many({
+                self.get_cache_key(tray_id): (version, now) + entry
+                for tray_id, entry in entries.items()
+            }, None)
+            for tray_id, (valid_until, set_points) in entries.items():
+                results[tray_id] = set_points
+        return results
+
+    def load(self, tray_ids, now):
+        """
+        Reads the set points of the trays `tray_ids` at the time `now` from
+        the database and returns a dictionary mapping tray ids to
+        `(valid_until, set_points)` tuples
+        """
+        opts = SetPoint._meta
+        connection = connections[router.db_for_read(SetPoint)]
+        qn = connection.ops.quote_name
+        # The latest set point of each property of each tray, in one query
+        latest = (
+            '{table}.{timestamp} = (SELECT MAX(latest.{timestamp}) FROM '
+            '{table} latest WHERE latest.{tray} = {table}.{tray} AND '
+            'latest.{property} = {table}.{property} AND '
+            'latest.{timestamp} < %s)'
+        ).format(
+            table=qn(opts.db_table),
+            timestamp=qn(opts.get_field('timestamp').column),
+            tray=qn(opts.get_field('tray').column),
+            property=qn(opts.get_field('property').column),
+        )
+        rows = SetPoint.objects.filter(tray__in=tray_ids).extra(
+            where=[latest], params=[now]
+        ).order_by('pk').values_list(
+            'tray', 'property', 'property__resource_type__code',
+            'property__code', 'timestamp', 'value'
+        )
+        latest_set_points = defaultdict(dict)
+        for tray_id, property_id, type_code, code, timestamp, value in rows:
+            latest_set_points[tray_id][property_id] = (
+                timestamp, type_code + code, value
+            )
+        valid_until = dict(SetPoint.objects.filter(
+            tray__in=tray_ids, timestamp__gte=now
+        ).values_list('tray').annotate(Min('timestamp')).order_by())
+
+        lazy_runs = list(RecipeRun.objects.filter(
+            tray__in=tray_ids, compiled__isnull=False
+        ).select_related('compiled'))
+        if lazy_runs:
+            codes = {
+                pk: type_code + code for pk, type_code, code in
+                ResourceProperty.objects.values_list(
+                    'pk', 'resource_type__code', 'code'
+                )
+            }
+        for run in lazy_runs:
+            tray_set_points = latest_set_points[run.tray_id]
+            for property_id, (timestamp, value) in \
+                    run.get_set_points_at(now).items():
+                current = tray_set_points.get(property_id, None)
+                if current is None or timestamp >= current[0]:
+                    tray_set_points[property_id] = (
+                        timestamp, codes[property_id], value
+                    )
+            next_timestamp = run.get_next_set_point_timestamp(now)
+            if next_timestamp is not None:
+                current = valid_until.get(run.tray_id, None)
+                if current is None or next_timestamp < current:
+                    valid_until[run.tray_id] = next_timestamp
+
+        return {
+            tray_id: (valid_until.get(tray_id, None), {
+                property_id: (code, value) for property_id, (
+                    timestamp, code, value
+                ) in latest_set_points[tray_id].items()
+            }) for tray_id in tray_ids
+        }
+
+
+current_set_points = CurrentSetPointStore()
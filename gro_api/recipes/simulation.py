@@ -0,0 +1,63 @@
+"""
+Dry runs of compiled recipes
+"""
+from ..gro_api.history import resample
+
+
+def get_segments(offsets, values, end_offset):
+    """
+    Returns the step function described by the set points with the sorted
+    offsets `offsets` and the values `values` as a list of `(start, end,
+    value)` tuples. Set points with the same offset replace each other in
+    order and set points at or after `end_offset` are ignored.
+    """
+    segments = []
+    for offset, value in zip(offsets, values):
+        if offset >= end_offset:
+            break
+        if segments:
+            start, end, previous = segments.pop()
+            if start < offset:
+                segments.append((start, offset, previous))
+        segments.append((offset, end_offset, value))
+    return segments
+
+
+def simulate_recipe(steps, end_offset, step, ranges):
+    """
+    Computes the set point curve of every property of a recipe without
+    starting it.
+
+    :param steps: The :class:`~gro_api.recipes.models.RecipeSteps` of the
+        recipe
+    :param int end_offset: The offset at which the recipe ends
+    :param int step: The number of seconds between two samples of the curves
+    :param ranges: A dictionary mapping property ids to `(min, max)` tuples
+        holding the operating range of the property, or `None` if the range
+        should not be checked
+    :returns: A tuple `(offsets, curves, violations)`, where `offsets` is the
+        list of sample offsets, `curves` maps property ids to the list of set
+        points at those offsets (`None` before the first one) and `violations`
+        is a list of `(property id, start, end, value)` tuples describing the
+        periods during which a set point is outside the operating range of its
+        property
+    """
+    count = (end_offset - 1) // step + 1 if end_offset > 0 else 0
+    offsets = list(range(0, count * step, step))
+    curves = {}
+    violations = []
+    for property_id, (property_offsets, values) in \
+            sorted(steps.by_property.items()):
+        curves[property_id] = resample(
+            property_offsets, values, 0, step, count, 'locf'
+        )
+        operating_range = ranges.get(property_id, None)
+        if operating_range is None:
+            continue
+        low, high = operating_range
+        for start, end, value in get_segments(
+                property_offsets, values, end_offset):
+            if value < low or value > high:
+                violations.append((property_id, start, end, value))
+    violations.sort(key=lambda violation: (violation[1], violation[0]))
+    return offsets, curves, violations
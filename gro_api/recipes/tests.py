@@ -0,0 +1,293 @@
+import time
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from ..gro_api.test import APITestCase, run_with_layouts
+from ..resources.models import ResourceProperty
+from .models import (
+    CompiledRecipe, Recipe, RecipeRun, SetPoint, recipe_run_index
+)
+from .set_points import current_set_points
+
+RECIPE_FILE = b"""
+# A short recipe
+0:0:0:0 SATM 25 # Warm up
+0:0:1:0 SAHU 60
+0:0:2:0 SATM 20
+0:0:2:0 XNOP
+0:1:0:0 GHAR
+0:2:0:0 SATM 30
+"""
+
+
+class RecipeAuthMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            'recipes', 'recipes@test.com', 'recipes'
+        )
+        cls.user.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='recipes'
+        ))
+        layout_editors_group = Group.objects.get(name='LayoutEditors')
+        cls.user.groups.add(layout_editors_group)
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        self.tray_count = 0
+
+    def tearDown(self):
+        self.client.force_authenticate()
+
+    def create_tray(self):
+        # Trays in the same enclosure can't overlap, so each one is placed
+        # next to the last
+        res = self.client.post(self.url_for_object('tray'), data={
+            'parent': self.url_for_object('enclosure', 1),
+            'x': 2 * self.tray_count, 'y': 0, 'z': 0,
+            'length': 1, 'width': 1, 'height': 1
+        })
+        self.assertEqual(res.status_code, 201)
+        self.tray_count += 1
+        return int(res.data['url'].split('/')[-2])
+
+    def create_recipe(self, content=RECIPE_FILE):
+        recipe = Recipe(name='test')
+        recipe.file.save('test', ContentFile(content))
+        self.addCleanup(recipe.file.delete, save=False)
+        return recipe
+
+    def start_run(self, recipe, tray_id, start_timestamp):
+        return self.client.post(self.url_for_object('recipeRun'), data={
+            'recipe': self.url_for_object('recipe', recipe.pk),
+            'tray': self.url_for_object('tray', tray_id),
+            'start_timestamp': start_timestamp,
+        })
+
+
+class RecipeRunTestCase(RecipeAuthMixin, APITestCase):
+    @run_with_layouts('tray')
+    def test_compiled_recipe(self):
+        tray_id = self.create_tray()
+        recipe = self.create_recipe()
+        other_recipe = self.create_recipe()
+        start = int(time.time()) + 4000
+        res = self.start_run(recipe, tray_id, start)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['end_timestamp'], start + 3600)
+        # A run that would reach the start of the next one is rejected
+        res = self.start_run(other_recipe, tray_id, start - 3600)
+        self.assertEqual(res.status_code, 400)
+        # Recipes with the same file share the compiled form
+        res = self.start_run(other_recipe, tray_id, start - 3700)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(CompiledRecipe.objects.count(), 1)
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).compiled_id,
+            Recipe.objects.get(pk=other_recipe.pk).compiled_id
+        )
+        run = RecipeRun.objects.get(start_timestamp=start)
+        air_temp = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        air_humidity = ResourceProperty.objects.get_by_natural_key('A', 'HU')
+        set_points = [
+            (set_point.property_id, set_point.timestamp, set_point.value)
+            for set_point in SetPoint.objects.filter(
+                recipe_run=run, value__isnull=False
+            ).order_by('timestamp', 'pk')
+        ]
+        self.assertEqual(set_points, [
+            (air_temp.pk, start, 25), (air_humidity.pk, start + 60, 60),
+            (air_temp.pk, start + 120, 20)
+        ])
+        self.assertEqual(
+            SetPoint.objects.filter(recipe_run=run, value=None).count(),
+            ResourceProperty.objects.count()
+        )
+
+    @run_with_layouts('tray')
+    def test_lazy_set_points(self):
+        tray_id = self.create_tray()
+        recipe = self.create_recipe()
+        start = int(time.time()) + 100
+        with override_settings(LAZY_SET_POINTS=True):
+            res = self.start_run(recipe, tray_id, start)
+        self.assertEqual(res.status_code, 201)
+        self.assertFalse(SetPoint.objects.exists())
+        run = RecipeRun.objects.get()
+        self.assertTrue(run.is_lazy)
+        air_temp = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        self.assertEqual(run.get_set_points_at(start + 119), {
+            air_temp.pk: (start, 25),
+            ResourceProperty.objects.get_by_natural_key('A', 'HU').pk:
+                (start + 60, 60),
+        })
+        self.assertEqual(
+            run.get_set_points_at(start + 120)[air_temp.pk], (start + 120, 20)
+        )
+        # Stored set points of other runs are merged in (timestamp, id) order
+        SetPoint.objects.create(
+            tray_id=tray_id, property=air_temp, timestamp=start + 30,
+            value=22, recipe_run=run
+        )
+        # The next links keep the limit
+        url = self.url_for_object('setPoint') + '?limit=2'
+        rows = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            rows.extend(res.data['results'])
+            url = res.data['next']
+        property_count = ResourceProperty.objects.count()
+        self.assertEqual(len(rows), 4 + property_count)
+        self.assertEqual(
+            [(row['timestamp'], row['value']) for row in rows[:4]],
+            [(start, 25), (start + 30, 22), (start + 60, 60), (start + 120, 20)]
+        )
+        self.assertEqual(
+            set(row['value'] for row in rows[4:]), set([None])
+        )
+        res = self.client.get(rows[2]['url'])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['value'], 60)
+        res = self.client.delete(rows[2]['url'])
+        self.assertEqual(res.status_code, 400)
+        # Shortening the run drops the later steps without writing rows
+        res = self.client.put(self.url_for_object('recipeRun', run.pk), data={
+            'recipe': self.url_for_object('recipe', recipe.pk),
+            'tray': self.url_for_object('tray', tray_id),
+            'start_timestamp': start,
+            'end_timestamp': start + 90,
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(SetPoint.objects.count(), 1)
+        run = RecipeRun.objects.get()
+        self.assertEqual(
+            [set_point.timestamp for set_point in run.iterate_set_points()],
+            [start, start + 60] + [start + 90] * property_count
+        )
+        self.assertIsNone(
+            RecipeRun.get_lazy_set_point(run.get_set_point_id(2))
+        )
+
+    @run_with_layouts('tray')
+    def test_current_set_points(self):
+        tray_id = self.create_tray()
+        other_tray_id = self.create_tray()
+        now = int(time.time())
+        recipe = Recipe.objects.create(name='test', file='recipes/test')
+        run = RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_id, start_timestamp=now - 100,
+            end_timestamp=now + 1000
+        )
+        air_temp = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        for offset, value in ((-90, 10), (-50, 25)):
+            SetPoint.objects.create(
+                tray_id=tray_id, property=air_temp, recipe_run=run,
+                timestamp=now + offset, value=value
+            )
+        url = self.url_for_object('tray', tray_id) + 'set_points/'
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {'ATM': 25})
+        # Served from the cache until the next set point
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                current_set_points.get(tray_id), {air_temp.pk: ('ATM', 25)}
+            )
+        SetPoint.objects.create(
+            tray_id=tray_id, property=air_temp, recipe_run=run,
+            timestamp=now - 10, value=30
+        )
+        res = self.client.get(self.url_for_object('tray') + 'all_set_points/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            {
+                int(row['tray'].split('/')[-2]): row['set_points']
+                for row in res.data
+            },
+            {tray_id: {'ATM': 30}, other_tray_id: {}}
+        )
+
+    @run_with_layouts('tray')
+    def test_schedule(self):
+        tray_id = self.create_tray()
+        recipe = self.create_recipe()
+        now = int(time.time())
+        past = RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_id, start_timestamp=now - 5000,
+            end_timestamp=now - 4000
+        )
+        current = RecipeRun.objects.create(
+            recipe=recipe, tray_id=tray_id, start_timestamp=now - 100,
+            end_timestamp=now + 1000
+        )
+        self.assertEqual(
+            recipe_run_index.get_overlapping(tray_id, now + 500, now + 600),
+            current
+        )
+        # Runs can start when the previous one ends
+        self.assertIsNone(
+            recipe_run_index.get_overlapping(tray_id, now + 1000, now + 4600)
+        )
+        res = self.start_run(recipe, tray_id, now + 900)
+        self.assertEqual(res.status_code, 400)
+        res = self.start_run(recipe, tray_id, now + 1000)
+        self.assertEqual(res.status_code, 201)
+        future = RecipeRun.objects.get(start_timestamp=now + 1000)
+        res = self.start_run(recipe, tray_id, now + 4000)
+        self.assertEqual(res.status_code, 400)
+        url = self.url_for_object('tray', tray_id) + 'schedule/'
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        run_url = lambda run: self.url_for_object('recipeRun', run.pk)
+        self.assertEqual(len(res.data['past']), 1)
+        self.assertTrue(res.data['past'][0]['url'].endswith(run_url(past)))
+        self.assertTrue(res.data['current']['url'].endswith(run_url(current)))
+        self.assertEqual(len(res.data['future']), 1)
+        self.assertTrue(
+            res.data['future'][0]['url'].endswith(run_url(future))
+        )
+
+    @run_with_layouts('tray')
+    def test_simulate(self):
+        recipe = self.create_recipe()
+        air_temp = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        air_temp.min_operating_value = 21
+        air_temp.max_operating_value = 30
+        air_temp.save()
+        url = self.url_for_object('recipe', recipe.pk) + 'simulate/'
+        res = self.client.get(url, data={'step': 60})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['end_offset'], 3600)
+        self.assertEqual(res.data['offsets'], list(range(0, 3600, 60)))
+        curves = {
+            row['code']: row['values'] for row in res.data['properties']
+        }
+        self.assertEqual(curves['ATM'][:3], [25, 25, 20])
+        self.assertEqual(curves['ATM'][-1], 20)
+        self.assertEqual(curves['AHU'][:2], [None, 60])
+        self.assertEqual(len(res.data['violations']), 1)
+        violation = res.data['violations'][0]
+        self.assertEqual(violation['code'], 'ATM')
+        self.assertEqual(
+            (violation['start_offset'], violation['end_offset']), (120, 3600)
+        )
+        self.assertEqual(violation['value'], 20)
+        # Nothing is written
+        self.assertFalse(CompiledRecipe.objects.exists())
+        res = self.client.get(url, data={'step': 0})
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_layouts('tray')
+    def test_invalid_recipe(self):
+        tray_id = self.create_tray()
+        start = int(time.time()) + 100
+        recipe = self.create_recipe(b'0:0:0:0 SATM 25\n')
+        res = self.start_run(recipe, tray_id, start)
+        self.assertEqual(res.status_code, 400)
+        recipe = self.create_recipe(b'0:0:0:0 SXXX 25\n0:1:0:0 GHAR\n')
+        res = self.start_run(recipe, tray_id, start)
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(RecipeRun.objects.exists())
+        self.assertFalse(CompiledRecipe.objects.exists())
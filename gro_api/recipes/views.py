@@ -1,5 +1,17 @@
+from itertools import islice
+from collections import OrderedDict
+from django.http import Http404
+from rest_framework.reverse import reverse
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.decorators import detail_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.field_mapping import get_detail_view_name
+from ..gro_api.history import parse_positive_int
+from ..gro_api.pagination import TimeSeriesPagination
+from ..resources.models import ResourceProperty
 from .models import Recipe, RecipeRun, SetPoint, ActuatorOverride
+from .simulation import simulate_recipe
 from .serializers import (
     RecipeSerializer, RecipeRunSerializer, SetPointSerializer,
     ActuatorOverrideSerializer
@@ -9,6 +21,73 @@ class RecipeViewSet(ModelViewSet):
     """ A recipe uploaded by a user that can be run on a tray """
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
+    #: The maximum number of samples in one simulation response
+    max_simulated_samples = 100000
+
+    @detail_route(methods=["get"])
+    def simulate(self, request, pk=None):
+        """
+        Preview the set points that the recipe would produce without starting
+        it. The set point curve of every property is sampled every `step`
+        seconds (3600 by default) from the start of the recipe, with offsets
+        relative to the start of the run. `violations` lists the periods
+        during which a set point is outside the operating range of its
+        property. Properties whose operating range is empty (as it is until
+        one is configured) are not checked.
+        """
+        instance = self.get_object()
+        step = parse_positive_int(request.query_params, 'step', 3600)
+        compiled = instance.get_compiled(save=False)
+        steps = compiled.get_steps()
+        count = (compiled.end_offset - 1) // step + 1
+        if count * len(steps.by_property) > self.max_simulated_samples:
+            raise ValidationError(
+                'Too many samples. Use a larger step.'
+            )
+        properties = {
+            property.pk: property for property in
+            ResourceProperty.objects.filter(
+                pk__in=steps.by_property.keys()
+            ).select_related('resource_type')
+        }
+        ranges = {
+            pk: (property.min_operating_value, property.max_operating_value)
+            for pk, property in properties.items() if
+            property.min_operating_value < property.max_operating_value
+        }
+        offsets, curves, violations = simulate_recipe(
+            steps, compiled.end_offset, step, ranges
+        )
+        view_name = get_detail_view_name(ResourceProperty)
+
+        def describe(property_id):
+            return OrderedDict([
+                ('property', reverse(
+                    view_name, kwargs={'pk': property_id}, request=request
+                )),
+                ('code', ''.join(properties[property_id].natural_key())),
+            ])
+
+        results = []
+        for property_id, values in curves.items():
+            result = describe(property_id)
+            result['values'] = values
+            results.append(result)
+        violation_results = []
+        for property_id, start, end, value in violations:
+            result = describe(property_id)
+            result['start_offset'] = start
+            result['end_offset'] = end
+            result['value'] = value
+            result['min_operating_value'] = ranges[property_id][0]
+            result['max_operating_value'] = ranges[property_id][1]
+            violation_results.append(result)
+        return Response(OrderedDict([
+            ('end_offset', compiled.end_offset),
+            ('offsets', offsets),
+            ('properties', results),
+            ('violations', violation_results),
+        ]))
 
 
 class RecipeRunViewSet(ModelViewSet):
@@ -23,6 +102,79 @@ class SetPointViewSet(ModelViewSet):
     """
     queryset = SetPoint.objects.all()
     serializer_class = SetPointSerializer
+    pagination_class = TimeSeriesPagination
+
+    def get_lazy_sources(self):
+        """
+        Returns a pagination source for the set points of every lazy recipe
+        run that has set points past the cursor of the request
+        """
+        runs = RecipeRun.objects.filter(compiled__isnull=False)
+        cursor = self.paginator.get_cursor(self.request)
+        if cursor is not None:
+            # Runs that end before a forward cursor or start after a reverse
+            # one can't have set points on the page
+            if cursor.reverse:
+                runs = runs.filter(start_timestamp__lte=cursor.timestamp)
+            else:
+                runs = runs.filter(end_timestamp__gte=cursor.timestamp)
+        runs = list(runs.select_related('compiled'))
+        if not runs:
+            return []
+        property_ids = list(
+            ResourceProperty.objects.order_by('pk').values_list(
+                'pk', flat=True
+            )
+        )
+
+        def make_source(run):
+            def source(cursor, limit):
+                if cursor is None:
+                    rows = run.iterate_set_points(property_ids=property_ids)
+                else:
+                    rows = run.iterate_set_points(
+                        (cursor.timestamp, cursor.pk), cursor.reverse,
+                        property_ids
+                    )
+                return list(islice(rows, limit))
+            return source
+        return [make_source(run) for run in runs]
+
+    def paginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return self.paginator.paginate_queryset(
+            queryset, self.request, view=self,
+            extra_sources=self.get_lazy_sources()
+        )
+
+    def get_object(self):
+        try:
+            pk = int(self.kwargs['pk'])
+        except ValueError:
+            pk = None
+        if pk is None or pk >= 0:
+            return super().get_object()
+        instance = RecipeRun.get_lazy_set_point(pk)
+        if instance is None:
+            raise Http404
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    def check_stored(self, instance):
+        if instance.pk < 0:
+            raise ValidationError(
+                'Set points of lazy recipe runs are computed from their '
+                'recipe and cannot be changed.'
+            )
+
+    def perform_update(self, serializer):
+        self.check_stored(serializer.instance)
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        self.check_stored(instance)
+        instance.delete()
 
 
 class ActuatorOverrideViewSet(ModelViewSet):
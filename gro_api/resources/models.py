@@ -101,3 +101,25 @@ class Resource(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class RetentionPolicy(models.Model):
+    """
+    Raw time series rows recorded for :attr:`property` are moved out of the
+    database into compressed archive files once they are older than
+    :attr:`days` days
+    """
+    property = models.OneToOneField(ResourceProperty, related_name='+')
+    days = models.PositiveIntegerField()
+
+    def get_cutoff(self, now):
+        """
+        Returns the timestamp before which rows should be archived at the
+        time `now`. The cutoff is always the start of a day (in UTC) so that
+        no hourly or daily bucket is only partially archived.
+        """
+        day = 24 * 60 * 60
+        return (int(now) // day - self.days) * day
+
+    def __str__(self):
+        return '{} ({} days)'.format(self.property, self.days)
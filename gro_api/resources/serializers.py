@@ -9,7 +9,9 @@ from ..gro_api.utils import system_layout
 from ..gro_api.serializers import BaseSerializer, DUMMY_VIEW_NAME
 from ..layout.models import Enclosure, Tray, dynamic_models
 from ..layout.schemata import all_schemata
-from .models import ResourceType, ResourceProperty, ResourceEffect, Resource
+from .models import (
+    ResourceType, ResourceProperty, ResourceEffect, Resource, RetentionPolicy
+)
 
 
 class ResourceTypeSerializer(BaseSerializer):
@@ -168,3 +170,15 @@ class ResourceSerializer(BaseSerializer):
         # The default unique together validators will try to force `index` to
         # be required, so we have to silence them
         return []
+
+
+class RetentionPolicySerializer(BaseSerializer):
+    class Meta:
+        model = RetentionPolicy
+
+    def validate_days(self, val):
+        if val < 1:
+            raise ValidationError(
+                'Retention periods must be at least 1 day long'
+            )
+        return val
@@ -1,6 +1,6 @@
 from .views import (
     ResourceTypeViewSet, ResourcePropertyViewSet, ResourceEffectViewSet,
-    ResourceViewSet
+    ResourceViewSet, RetentionPolicyViewSet
 )
 
 def contribute_to_router(router):
@@ -8,3 +8,4 @@ def contribute_to_router(router):
     router.register(r'resourceProperty', ResourcePropertyViewSet)
     router.register(r'resourceEffect', ResourceEffectViewSet)
     router.register(r'resource', ResourceViewSet)
+    router.register(r'retentionPolicy', RetentionPolicyViewSet)
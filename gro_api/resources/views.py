@@ -2,11 +2,11 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
 from ..gro_api.permissions import EnforceReadOnly
 from .models import (
-    ResourceType, ResourceProperty, ResourceEffect, Resource
+    ResourceType, ResourceProperty, ResourceEffect, Resource, RetentionPolicy
 )
 from .serializers import (
     ResourceTypeSerializer, ResourcePropertySerializer,
-    ResourceEffectSerializer, ResourceSerializer
+    ResourceEffectSerializer, ResourceSerializer, RetentionPolicySerializer
 )
 
 
@@ -43,3 +43,12 @@ class ResourceViewSet(ModelViewSet):
     """
     queryset = Resource.objects.all()
     serializer_class = ResourceSerializer
+
+
+class RetentionPolicyViewSet(ModelViewSet):
+    """
+    How long raw sensor data and actuator states recorded for a resource
+    property are kept in the database before they are archived
+    """
+    queryset = RetentionPolicy.objects.all()
+    serializer_class = RetentionPolicySerializer
@@ -0,0 +1,55 @@
+import time
+import logging
+from django.conf import settings
+from django_cron import CronJobBase, Schedule
+from ..resources.models import RetentionPolicy
+from .models import SensingPoint, data_point_rollups, data_point_archive
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDataPointRollups(CronJobBase):
+    """
+    This job folds the :class:`~gro_api.sensors.models.DataPoint` objects
+    recorded since it last ran into the hourly and daily
+    :class:`~gro_api.sensors.models.DataPointRollup` objects every 5 minutes.
+    """
+    RUN_EVERY_MINS = 5
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'sensors.update_data_point_rollups'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', UpdateDataPointRollups.code)
+        if not settings.SERVER_TYPE == settings.LEAF:
+            logger.error('This cron job should only be run on leaf servers')
+            return
+        count = data_point_rollups.fold()
+        logger.info('Folded %d data points into rollups', count)
+
+
+class ArchiveDataPoints(CronJobBase):
+    """
+    This job moves the :class:`~gro_api.sensors.models.DataPoint` objects that
+    are older than the :class:`~gro_api.resources.models.RetentionPolicy` of
+    the property of their sensing point into the archive every hour
+    """
+    RUN_EVERY_MINS = 60
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+    code = 'sensors.archive_data_points'
+
+    @staticmethod
+    def do():
+        logger.info('Running cron job %s', ArchiveDataPoints.code)
+        if not settings.SERVER_TYPE == settings.LEAF:
+            logger.error('This cron job should only be run on leaf servers')
+            return
+        now = time.time()
+        for policy in RetentionPolicy.objects.all():
+            sensing_point_ids = SensingPoint.objects.filter(
+                property_id=policy.property_id
+            ).values_list('pk', flat=True)
+            count = data_point_archive.archive(
+                sensing_point_ids, policy.get_cutoff(now)
+            )
+            logger.info('Archived %d data points for %s', count, policy)
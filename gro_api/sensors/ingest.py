@@ -0,0 +1,59 @@
+from collections import Counter
+from django.db.models import F, Case, When, Value, IntegerField
+from ..gro_api.ingest import TimeSeriesIngester
+from .models import (
+    SensingPoint, DataPoint, latest_data_points, data_point_rollups
+)
+
+
+class DataPointIngester(TimeSeriesIngester):
+    """
+    Inserts batches of data points in a compact format. Readings of sensing
+    points with a deadband are dropped if they are within the deadband of the
+    last stored value, unless the `max_silence` of the sensing point has
+    passed since that value was recorded.
+    """
+    model = DataPoint
+    series_field = 'sensing_point'
+    latest_store = latest_data_points
+    series_fields = ('deadband', 'max_silence')
+    conflict_fields = ('sensing_point', 'timestamp')
+    rollup = data_point_rollups
+
+    def filter_rows(self, rows):
+        filtered_ids = [
+            pk for pk, (deadband, max_silence) in self.series.items()
+            if deadband > 0
+        ]
+        if not filtered_ids:
+            return rows
+        # The last stored values are read from the latest value store, which
+        # only queries the database for series that are not cached yet
+        last_values = {
+            pk: (data_point.timestamp, data_point.value) for pk, data_point in
+            self.latest_store.get_many(filtered_ids).items()
+        }
+        kept = []
+        suppressed = Counter()
+        for row in rows:
+            series_id, timestamp, value = row
+            deadband, max_silence = self.series[series_id]
+            last = last_values.get(series_id, None)
+            # Readings older than the last stored value are always kept
+            if deadband > 0 and (last is None or timestamp >= last[0]):
+                if last is not None and \
+                        abs(value - last[1]) <= deadband and \
+                        (max_silence is None or
+                         timestamp - last[0] < max_silence):
+                    suppressed[series_id] += 1
+                    continue
+                last_values[series_id] = (timestamp, value)
+            kept.append(row)
+        if suppressed:
+            SensingPoint.objects.filter(pk__in=suppressed.keys()).update(
+                suppressed_count=F('suppressed_count') + Case(*(
+                    When(pk=pk, then=Value(count)) for pk, count in
+                    suppressed.items()
+                ), output_field=IntegerField())
+            )
+        return kept
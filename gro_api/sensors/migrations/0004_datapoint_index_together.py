@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0003_auto_20150902_1801'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='datapoint',
+            index_together=set([('sensing_point', 'timestamp')]),
+        ),
+    ]
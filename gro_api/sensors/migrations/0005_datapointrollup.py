@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0004_datapoint_index_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataPointRollup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(3600, 'Hourly'), (86400, 'Daily')])),
+                ('timestamp', models.IntegerField()),
+                ('min_value', models.FloatField()),
+                ('max_value', models.FloatField()),
+                ('sum_value', models.FloatField()),
+                ('count', models.PositiveIntegerField()),
+                ('sensing_point', models.ForeignKey(to='sensors.SensingPoint', related_name='rollups+')),
+            ],
+            options={
+                'ordering': ['timestamp'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DataPointRollupMark',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('last_pk', models.IntegerField(default=0)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='datapointrollup',
+            unique_together=set([('sensing_point', 'resolution', 'timestamp')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0005_datapointrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataPointArchiveFile',
+            fields=[
+                ('id', models.AutoField(primary_key=True, auto_created=True, serialize=False, verbose_name='ID')),
+                ('month', models.IntegerField()),
+                ('min_timestamp', models.IntegerField()),
+                ('max_timestamp', models.IntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('sensing_point', models.ForeignKey(to='sensors.SensingPoint', related_name='archive_files+')),
+            ],
+            options={
+                'ordering': ['month'],
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='datapointarchivefile',
+            unique_together=set([('sensing_point', 'month')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0006_datapointarchivefile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensingpoint',
+            name='deadband',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sensingpoint',
+            name='max_silence',
+            field=models.PositiveIntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='sensingpoint',
+            name='suppressed_count',
+            field=models.PositiveIntegerField(editable=False, default=0),
+        ),
+    ]
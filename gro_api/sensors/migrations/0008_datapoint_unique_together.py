@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def remove_duplicate_data_points(apps, schema_editor):
+    """
+    Keep only the newest of the data points that share a sensing point and a
+    timestamp, so that the unique constraint can be added
+    """
+    DataPoint = apps.get_model('sensors', 'DataPoint')
+    duplicates = DataPoint.objects.values(
+        'sensing_point', 'timestamp'
+    ).annotate(
+        max_pk=models.Max('pk'), count=models.Count('pk')
+    ).filter(count__gt=1).order_by()
+    removed = False
+    for duplicate in duplicates:
+        DataPoint.objects.filter(
+            sensing_point=duplicate['sensing_point'],
+            timestamp=duplicate['timestamp'], pk__lt=duplicate['max_pk']
+        ).delete()
+        removed = True
+    if removed:
+        # The rollups counted the removed rows, so they are rebuilt from
+        # scratch by the next run of the rollup cron job
+        apps.get_model('sensors', 'DataPointRollup').objects.all().delete()
+        apps.get_model('sensors', 'DataPointRollupMark').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0007_sensingpoint_deadband'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            remove_duplicate_data_points, migrations.RunPython.noop
+        ),
+        migrations.AlterUniqueTogether(
+            name='datapoint',
+            unique_together=set([('sensing_point', 'timestamp')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='datapoint',
+            index_together=set([]),
+        ),
+    ]
@@ -1,5 +1,9 @@
 import time
 from django.db import models
+from ..gro_api.cache import LatestValueStore
+from ..gro_api.archive import ArchiveFileModel, TimeSeriesArchive
+from ..gro_api.events import EventSource, event_buffer
+from ..gro_api.rollups import RollupModel, RollupMarkModel, TimeSeriesRollup
 from ..resources.models import ResourceType, ResourceProperty, Resource
 
 
@@ -55,6 +59,13 @@ class SensingPoint(models.Model):
     is_active = models.BooleanField(default=True)
     is_pseudo = models.BooleanField(default=True)
     auto_created = models.BooleanField(editable=False, default=False)
+    #: Readings that differ from the last stored value by at most this much
+    #: are not stored
+    deadband = models.FloatField(default=0)
+    #: The maximum number of seconds that readings can be suppressed by the
+    #: deadband before one is stored anyway
+    max_silence = models.PositiveIntegerField(null=True, blank=True)
+    suppressed_count = models.PositiveIntegerField(editable=False, default=0)
 
     def __str__(self):
         return self.sensor.name + ' - ' + self.property.name
@@ -64,7 +75,41 @@ class DataPoint(models.Model):
     class Meta:
         ordering = ['timestamp']
         get_latest_by = 'timestamp'
+        unique_together = ('sensing_point', 'timestamp')
 
     sensing_point = models.ForeignKey(SensingPoint, related_name='data_points+')
     timestamp = models.IntegerField(blank=True, default=time.time)
     value = models.FloatField()
+
+
+class DataPointRollup(RollupModel):
+    class Meta(RollupModel.Meta):
+        unique_together = ('sensing_point', 'resolution', 'timestamp')
+
+    sensing_point = models.ForeignKey(SensingPoint, related_name='rollups+')
+
+
+class DataPointRollupMark(RollupMarkModel):
+    pass
+
+
+class DataPointArchiveFile(ArchiveFileModel):
+    class Meta(ArchiveFileModel.Meta):
+        unique_together = ('sensing_point', 'month')
+
+    sensing_point = models.ForeignKey(
+        SensingPoint, related_name='archive_files+'
+    )
+
+
+latest_data_points = LatestValueStore(DataPoint, 'sensing_point')
+data_point_rollups = TimeSeriesRollup(
+    DataPoint, DataPointRollup, DataPointRollupMark, 'sensing_point'
+)
+data_point_archive = TimeSeriesArchive(
+    DataPoint, DataPointArchiveFile, 'sensing_point', data_point_rollups,
+    latest_data_points
+)
+event_buffer.register(EventSource(
+    'dataPoint', DataPoint, 'sensing_point', 'sensor__resource'
+))
@@ -76,6 +76,11 @@ class SensingPointSerializer(BaseSerializer):
 
     index = ReadOnlyField()
 
+    def validate_deadband(self, val):
+        if val < 0:
+            raise ValidationError('Deadbands must not be negative')
+        return val
+
     def validate(self, data):
         sensor = data.get('sensor', None)
         property = data.get('property', None)
@@ -126,9 +131,13 @@ class SensingPointSerializer(BaseSerializer):
 class OptionalHyperlinkedIdentityField(HyperlinkedIdentityField):
     def get_attribute(self, instance):
         try:
-            instance.pk
+            pk = instance.pk
         except AttributeError:
             raise SkipField()
+        if pk is not None and pk < 0:
+            # Archived rows are not stored in the database, so they have no
+            # detail view. See `HistoryListMixin`.
+            raise SkipField()
         return super().get_attribute(instance)
 
 
@@ -137,3 +146,8 @@ class DataPointSerializer(BaseSerializer):
         model = DataPoint
 
     serializer_url_field = OptionalHyperlinkedIdentityField
+
+    def get_unique_together_validators(self):
+        # Duplicate readings are rejected by the database instead of with a
+        # query per reading. See `DataPointViewSet`.
+        return []
@@ -1,8 +1,20 @@
+import json
+import shutil
+import tempfile
+from unittest import mock
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.test import override_settings
 from ..gro_api.test import APITestCase, run_with_any_layout
-from ..resources.models import ResourceType, ResourceProperty
-from .models import SensorType, Sensor, SensingPoint, DataPoint
+from ..gro_api.cache import get_shared_cache
+from ..gro_api.events import EventStreamView
+from ..gro_api.parsers import PackedTimeSeriesParser
+from ..layout.models import Enclosure
+from ..resources.models import ResourceType, ResourceProperty, Resource
+from .models import (
+    SensorType, Sensor, SensingPoint, DataPoint, DataPointRollup,
+    data_point_rollups, data_point_archive, latest_data_points
+)
 from .serializers import SensorTypeSerializer, SensorSerializer
 
 class SensorAuthMixin:
@@ -175,3 +187,623 @@ class SensorTestCase(SensorAuthMixin, APITestCase):
 class SensingPointTestCase(APITestCase):
     # TODO: Test data routes
     pass
+
+
+class DataPointTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            'firmware', 'firmware@test.com', 'firmware'
+        )
+        firmware_group = Group.objects.get(name='Firmware')
+        cls.user.groups.add(firmware_group)
+
+    def setUp(self):
+        self.client.force_authenticate(user=self.user)
+        self.sensor = None
+
+    def tearDown(self):
+        self.client.force_authenticate()
+
+    def create_sensing_point(self):
+        if self.sensor is None:
+            air = ResourceType.objects.get_by_natural_key('A')
+            resource = Resource.objects.create(
+                index=1, resource_type=air, location=Enclosure.get_solo()
+            )
+            dht22 = SensorType.objects.get_by_natural_key('DHT22')
+            self.sensor = Sensor.objects.create(
+                index=1, sensor_type=dht22, resource=resource
+            )
+        air_temp = ResourceProperty.objects.get_by_natural_key('A', 'TM')
+        air_temp.sensing_point_count += 1
+        air_temp.save()
+        return SensingPoint.objects.create(
+            index=air_temp.sensing_point_count, sensor=self.sensor,
+            property=air_temp
+        )
+
+    @run_with_any_layout
+    def test_aggregate(self):
+        sensing_point = self.create_sensing_point()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=v)
+            for t, v in ((0, 1), (10, 3), (59, 5), (60, 10), (150, 7))
+        ])
+        url = self.url_for_object('dataPoint') + 'aggregate/'
+        res = self.client.get(url, {
+            'sensing_point': sensing_point.pk, 'bucket': 60
+        })
+        self.assertEqual(res.status_code, 200)
+        summary = [
+            (row['timestamp'], row['min'], row['max'], row['mean'],
+             row['count']) for row in res.data
+        ]
+        self.assertEqual(summary, [
+            (0, 1, 5, 3, 3), (60, 10, 10, 10, 1), (120, 7, 7, 7, 1)
+        ])
+        res = self.client.get(url, {
+            'sensing_point': sensing_point.pk, 'bucket': 60, 'min_time': 60
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data), 2)
+
+    @run_with_any_layout
+    def test_align(self):
+        first = self.create_sensing_point()
+        second = self.create_sensing_point()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=first, timestamp=t, value=v)
+            for t, v in ((-5, 2), (0, 1), (10, 3), (59, 5), (60, 10), (150, 7))
+        ] + [
+            DataPoint(sensing_point=second, timestamp=t, value=v)
+            for t, v in ((70, 4), (100, 8))
+        ])
+        url = self.url_for_object('dataPoint') + 'align/'
+        params = {
+            'sensing_point': [first.pk, second.pk], 'min_time': 1,
+            'max_time': 180, 'step': 60
+        }
+        res = self.client.get(url, params)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data['sensing_point']), 2)
+        self.assertTrue(res.data['sensing_point'][0].endswith(
+            self.url_for_object('sensingPoint', first.pk)
+        ))
+        self.assertEqual(res.data['timestamps'], [1, 61, 121])
+        self.assertEqual(
+            res.data['values'], [[1, None], [10, None], [10, 8]]
+        )
+        params['method'] = 'mean'
+        res = self.client.get(url, params)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res.data['values'], [[6, None], [None, 6], [7, None]]
+        )
+        params['method'] = 'median'
+        res = self.client.get(url, params)
+        self.assertEqual(res.status_code, 400)
+        del params['method']
+        params['sensing_point'] = [first.pk, 0]
+        res = self.client.get(url, params)
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_aggregate_rollups(self):
+        sensing_point = self.create_sensing_point()
+        hour = 60 * 60
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=v)
+            for t, v in ((0, 1), (hour - 1, 3), (hour, 5), (25 * hour, 7))
+        ])
+        self.assertEqual(data_point_rollups.fold(), 4)
+        self.assertEqual(data_point_rollups.fold(), 0)
+        self.assertEqual(DataPointRollup.objects.filter(
+            resolution=hour
+        ).count(), 3)
+        # Rows after the high-water mark should be merged with the rollups
+        DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=10, value=-1
+        )
+        url = self.url_for_object('dataPoint') + 'aggregate/'
+        expected = {
+            hour: [(0, -1, 3, 1, 3), (hour, 5, 5, 5, 1),
+                   (25 * hour, 7, 7, 7, 1)],
+            24 * hour: [(0, -1, 5, 2, 4), (24 * hour, 7, 7, 7, 1)],
+        }
+        for width, summary in expected.items():
+            res = self.client.get(url, {
+                'sensing_point': sensing_point.pk, 'bucket': width
+            })
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([
+                (row['timestamp'], row['min'], row['max'], row['mean'],
+                 row['count']) for row in res.data
+            ], summary)
+        self.assertEqual(data_point_rollups.fold(), 1)
+        daily = DataPointRollup.objects.get(resolution=24 * hour, timestamp=0)
+        self.assertEqual(
+            (daily.min_value, daily.max_value, daily.sum_value, daily.count),
+            (-1, 5, 8, 4)
+        )
+
+    @run_with_any_layout
+    def test_aggregate_invalid_bucket(self):
+        url = self.url_for_object('dataPoint') + 'aggregate/'
+        self.assertEqual(self.client.get(url).status_code, 400)
+        res = self.client.get(url, {'bucket': 'abc'})
+        self.assertEqual(res.status_code, 400)
+        res = self.client.get(url, {'bucket': -5})
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_current_value(self):
+        sensing_point = self.create_sensing_point()
+        sensing_point_url = self.url_for_object(
+            'sensingPoint', sensing_point.pk
+        )
+        res = self.client.get(sensing_point_url + 'value/')
+        self.assertEqual(res.status_code, 500)
+        DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=100, value=1
+        )
+        res = self.client.get(sensing_point_url + 'value/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['value'], 1)
+        # Newer readings should replace the cached value
+        data = [
+            {'sensing_point': sensing_point_url, 'timestamp': 200, 'value': 2},
+            {'sensing_point': sensing_point_url, 'timestamp': 300, 'value': 3},
+        ]
+        res = self.client.post(
+            self.url_for_object('dataPoint') + '?many=true', data=data
+        )
+        self.assertEqual(res.status_code, 201)
+        res = self.client.get(sensing_point_url + 'value/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['timestamp'], 300)
+        self.assertEqual(res.data['value'], 3)
+        # Older readings should not
+        data = {
+            'sensing_point': sensing_point_url, 'timestamp': 250, 'value': 4
+        }
+        res = self.client.post(self.url_for_object('dataPoint'), data=data)
+        self.assertEqual(res.status_code, 201)
+        res = self.client.get(sensing_point_url + 'value/')
+        self.assertEqual(res.data['value'], 3)
+
+    @run_with_any_layout
+    def test_current_value_race(self):
+        sensing_point = self.create_sensing_point()
+        stale = DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=100, value=1
+        )
+        # Another worker reads the stale row from the database but only
+        # caches it after a newer row has been inserted and recorded
+        new = DataPoint.objects.create(
+            sensing_point=sensing_point, timestamp=200, value=2
+        )
+        latest_data_points.update([new])
+        get_shared_cache().add(
+            latest_data_points.get_cache_key(sensing_point.pk),
+            latest_data_points.to_entry(stale), None
+        )
+        self.assertEqual(latest_data_points.get(sensing_point.pk).value, 2)
+
+    @run_with_any_layout
+    def test_current_values(self):
+        sensing_points = [self.create_sensing_point() for _ in range(3)]
+        inactive = self.create_sensing_point()
+        inactive.is_active = False
+        inactive.save()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=t + i)
+            for i, sensing_point in enumerate(sensing_points[:2] + [inactive])
+            for t in (100, 300, 200)
+        ])
+        url = self.url_for_object('sensingPoint') + 'values/'
+        # Read it twice so that the second request is served from the cache
+        for _ in range(2):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(
+                [(row['timestamp'], row['value']) for row in res.data],
+                [(300, 300), (300, 301)]
+            )
+            for row, sensing_point in zip(res.data, sensing_points):
+                self.assertTrue(row['sensing_point'].endswith(
+                    self.url_for_object('sensingPoint', sensing_point.pk)
+                ))
+        property_id = sensing_points[0].property_id
+        res = self.client.get(url, {'property': property_id})
+        self.assertEqual(len(res.data), 2)
+        res = self.client.get(url, {'property': property_id + 1})
+        self.assertEqual(res.data, [])
+
+    @run_with_any_layout
+    def test_cursor_pagination(self):
+        # Readings of different sensing points can share a timestamp
+        sensing_points = [self.create_sensing_point() for _ in range(3)]
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_points[i], timestamp=t, value=t)
+            for i, t in ((0, 10), (0, 20), (1, 20), (2, 20), (0, 30))
+        ])
+        url = self.url_for_object('dataPoint')
+        res = self.client.get(url, {'limit': 2})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('count', res.data)
+        self.assertIsNone(res.data['previous'])
+        pages = [res.data['results']]
+        while res.data['next']:
+            res = self.client.get(res.data['next'])
+            self.assertEqual(res.status_code, 200)
+            pages.append(res.data['results'])
+        self.assertEqual(
+            [[row['timestamp'] for row in page] for page in pages],
+            [[10, 20], [20, 20], [30]]
+        )
+        # Walk back to the first page
+        res = self.client.get(res.data['previous'])
+        self.assertEqual(
+            [row['timestamp'] for row in res.data['results']], [20, 20]
+        )
+        res = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(res.status_code, 404)
+
+    @run_with_any_layout
+    def test_events(self):
+        sensing_point = self.create_sensing_point()
+        other = self.create_sensing_point()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=10, value=1),
+            DataPoint(sensing_point=other, timestamp=15, value=2),
+            DataPoint(sensing_point=sensing_point, timestamp=20, value=3),
+        ])
+        first_pk = DataPoint.objects.order_by('pk')[0].pk
+        url = self.url_prefix + '/events/'
+        with mock.patch.object(EventStreamView, 'max_duration', 0):
+            res = self.client.get(
+                url, {'sensing_point': sensing_point.pk},
+                HTTP_LAST_EVENT_ID='dataPoint:{}'.format(first_pk - 1)
+            )
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res['Content-Type'], 'text/event-stream')
+            content = b''.join(res.streaming_content).decode()
+        events = [
+            dict(line.split(': ', 1) for line in block.splitlines())
+            for block in content.split('\n\n') if 'data: ' in block
+        ]
+        self.assertEqual([event['event'] for event in events], ['dataPoint'] * 2)
+        self.assertEqual([
+            json.loads(event['data'])['value'] for event in events
+        ], [1, 3])
+        self.assertIn('dataPoint:{}'.format(first_pk + 2), events[-1]['id'])
+
+    @run_with_any_layout
+    def test_events_limit(self):
+        sensing_point = self.create_sensing_point()
+        url = self.url_prefix + '/events/'
+        with mock.patch.object(EventStreamView, 'max_duration', 0), \
+                mock.patch.object(EventStreamView, 'max_streams', 1):
+            stream = self.client.get(url)
+            self.assertEqual(stream.status_code, 200)
+            content = stream.streaming_content
+            self.assertTrue(next(content).startswith(b'retry: '))
+            # Other requests are served while the stream is open
+            res = self.client.get(
+                self.url_for_object('sensingPoint', sensing_point.pk)
+            )
+            self.assertEqual(res.status_code, 200)
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 503)
+            list(content)
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            list(res.streaming_content)
+
+    @run_with_any_layout
+    def test_export(self):
+        sensing_point = self.create_sensing_point()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=t / 2)
+            for t in (10, 20, 30)
+        ])
+        url = self.url_for_object('dataPoint') + 'export/'
+        res = self.client.get(url, {
+            'sensing_point': sensing_point.pk, 'min_time': 20
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual(lines, [
+            'sensing_point,timestamp,value',
+            '{},20,10.0'.format(sensing_point.pk),
+            '{},30,15.0'.format(sensing_point.pk),
+        ])
+        res = self.client.get(url, {
+            'sensing_point': sensing_point.pk, 'output': 'ndjson'
+        })
+        self.assertEqual(res.status_code, 200)
+        rows = [
+            json.loads(line) for line in
+            b''.join(res.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual([row['value'] for row in rows], [5.0, 10.0, 15.0])
+        res = self.client.get(url, {'output': 'xml'})
+        self.assertEqual(res.status_code, 400)
+
+    @run_with_any_layout
+    def test_archive(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        sensing_point = self.create_sensing_point()
+        day = 24 * 60 * 60
+        # Two months of old readings, a late one and a recent one
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=t / day)
+            for t in (day, 40 * day, 50 * day)
+        ])
+        with override_settings(ARCHIVE_ROOT=archive_root):
+            count = data_point_archive.archive([sensing_point.pk], 45 * day)
+            self.assertEqual(count, 2)
+            DataPoint.objects.create(
+                sensing_point=sensing_point, timestamp=2 * day, value=2
+            )
+            count = data_point_archive.archive([sensing_point.pk], 45 * day)
+            self.assertEqual(count, 1)
+            self.assertEqual(
+                DataPoint.objects.filter(sensing_point=sensing_point).count(),
+                1
+            )
+            self.assertEqual(list(data_point_archive.read()), [
+                (sensing_point.pk, day, 1), (sensing_point.pk, 2 * day, 2),
+                (sensing_point.pk, 40 * day, 40)
+            ])
+            url = self.url_for_object('dataPoint') + 'export/'
+            res = self.client.get(url, {
+                'sensing_point': sensing_point.pk, 'min_time': 2 * day
+            })
+            self.assertEqual(res.status_code, 200)
+            lines = b''.join(res.streaming_content).decode().splitlines()
+            self.assertEqual(lines[1:], [
+                '{},{},{!r}'.format(sensing_point.pk, t * day, float(t))
+                for t in (2, 40, 50)
+            ])
+            url = self.url_for_object('dataPoint') + 'aggregate/'
+            res = self.client.get(url, {
+                'sensing_point': sensing_point.pk, 'bucket': 30 * day
+            })
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([row['count'] for row in res.data], [2, 2])
+            # The cached latest value is dropped once it has been archived
+            latest = latest_data_points.get(sensing_point.pk)
+            self.assertEqual(latest.timestamp, 50 * day)
+            data_point_archive.archive([sensing_point.pk], 60 * day)
+            self.assertIsNone(latest_data_points.get(sensing_point.pk))
+
+    @run_with_any_layout
+    def test_archive_history(self):
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        first = self.create_sensing_point()
+        second = self.create_sensing_point()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=t)
+            for sensing_point, t in (
+                (first, 10), (second, 20), (first, 20), (first, 30),
+                (second, 100), (first, 110)
+            )
+        ])
+        with override_settings(ARCHIVE_ROOT=archive_root):
+            data_point_archive.archive([first.pk, second.pk], 50)
+            url = self.url_for_object('dataPoint')
+            res = self.client.get(url, {'limit': 2, 'min_time': 15})
+            self.assertEqual(res.status_code, 200)
+            pages = [res.data['results']]
+            while res.data['next']:
+                res = self.client.get(res.data['next'])
+                self.assertEqual(res.status_code, 200)
+                pages.append(res.data['results'])
+            self.assertEqual([
+                [(row['timestamp'], row['value']) for row in page]
+                for page in pages
+            ], [[(20, 20), (20, 20)], [(30, 30), (100, 100)], [(110, 110)]])
+            # Archived rows can't be retrieved on their own
+            self.assertNotIn('url', pages[0][0])
+            self.assertIn('url', pages[1][1])
+            res = self.client.get(res.data['previous'])
+            self.assertEqual(
+                [row['timestamp'] for row in res.data['results']], [30, 100]
+            )
+            res = self.client.get(res.data['previous'])
+            self.assertEqual(
+                [row['timestamp'] for row in res.data['results']], [20, 20]
+            )
+            sensing_point_url = self.url_for_object('sensingPoint', first.pk)
+            res = self.client.get(url, {'sensing_point': first.pk})
+            self.assertEqual([
+                row['timestamp'] for row in res.data['results']
+                if row['sensing_point'].endswith(sensing_point_url)
+            ], [10, 20, 30, 110])
+            # The value before the range is carried forward from the archive
+            res = self.client.get(url + 'align/', {
+                'sensing_point': first.pk, 'min_time': 60, 'max_time': 120,
+                'step': 60
+            })
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.data['values'], [[30], [110]])
+            # Refolded rollups still count the archived rows of their bucket
+            DataPoint.objects.filter(sensing_point=first).delete()
+            data_point_rollups.refold([(first.pk, 110)])
+            rollup = DataPointRollup.objects.get(
+                sensing_point=first, resolution=60 * 60, timestamp=0
+            )
+            self.assertEqual(
+                (rollup.min_value, rollup.max_value, rollup.sum_value,
+                 rollup.count), (10, 30, 60, 3)
+            )
+
+    @run_with_any_layout
+    def test_ingest(self):
+        first = self.create_sensing_point()
+        second = self.create_sensing_point()
+        url = self.url_for_object('dataPoint') + 'ingest/'
+        data = [
+            [first.pk, 100, 1.5],
+            {'sensing_point': second.pk, 'timestamp': 100, 'value': 2.5},
+        ]
+        res = self.client.post(url, data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['count'], 2)
+        data = {
+            'sensing_points': [first.pk, second.pk],
+            'data': [[0, 200, 3], [1, 200, 4], [1, 300, 5]],
+        }
+        res = self.client.post(url, data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['count'], 3)
+        self.assertEqual(
+            list(DataPoint.objects.filter(sensing_point=second).values_list(
+                'timestamp', 'value'
+            )), [(100, 2.5), (200, 4), (300, 5)]
+        )
+        # Invalid batches should not insert anything
+        for data in ([[first.pk, 400, 'abc']], [[first.pk + 1000, 400, 1]],
+                     {'sensing_points': [first.pk], 'data': [[1, 400, 1]]}):
+            res = self.client.post(url, data=data)
+            self.assertEqual(res.status_code, 400)
+        self.assertEqual(DataPoint.objects.count(), 5)
+
+    @run_with_any_layout
+    def test_ingest_deadband(self):
+        sensing_point = self.create_sensing_point()
+        sensing_point.deadband = 0.5
+        sensing_point.max_silence = 60
+        sensing_point.save()
+        url = self.url_for_object('dataPoint') + 'ingest/'
+        data = [
+            [sensing_point.pk, t, v] for t, v in (
+                (0, 20), (10, 20.2), (20, 20.5), (30, 20.6), (40, 20.9),
+                (100, 20.6), (25, 20.1)
+            )
+        ]
+        res = self.client.post(url, data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['count'], 4)
+        self.assertEqual(
+            list(DataPoint.objects.filter(
+                sensing_point=sensing_point
+            ).values_list('timestamp', flat=True)), [0, 25, 30, 100]
+        )
+        # The last stored value carries over to the next batch
+        res = self.client.post(url, data=[[sensing_point.pk, 110, 20.4]])
+        self.assertEqual(res.data['count'], 0)
+        sensing_point.refresh_from_db()
+        self.assertEqual(sensing_point.suppressed_count, 4)
+
+    @run_with_any_layout
+    def test_create_deadband(self):
+        sensing_point = self.create_sensing_point()
+        sensing_point.deadband = 0.5
+        sensing_point.save()
+        sensing_point_url = self.url_for_object(
+            'sensingPoint', sensing_point.pk
+        )
+        data = [
+            {'sensing_point': sensing_point_url, 'timestamp': t, 'value': v}
+            for t, v in ((0, 20), (10, 20.2), (20, 20.6), (30, 20.9))
+        ]
+        res = self.client.post(
+            self.url_for_object('dataPoint') + '?many=true', data=data
+        )
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(
+            list(DataPoint.objects.filter(
+                sensing_point=sensing_point
+            ).values_list('timestamp', flat=True)), [0, 20]
+        )
+        # Single readings go through the deadband as well
+        data = {
+            'sensing_point': sensing_point_url, 'timestamp': 40, 'value': 20.4
+        }
+        res = self.client.post(self.url_for_object('dataPoint'), data=data)
+        self.assertEqual(res.status_code, 204)
+        data['value'] = 21.2
+        res = self.client.post(self.url_for_object('dataPoint'), data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(
+            DataPoint.objects.filter(sensing_point=sensing_point).count(), 3
+        )
+        sensing_point.refresh_from_db()
+        self.assertEqual(sensing_point.suppressed_count, 3)
+
+    @run_with_any_layout
+    def test_ingest_conflict(self):
+        sensing_point = self.create_sensing_point()
+        DataPoint.objects.bulk_create([
+            DataPoint(sensing_point=sensing_point, timestamp=t, value=t)
+            for t in (0, 10)
+        ])
+        self.assertEqual(data_point_rollups.fold(), 2)
+        url = self.url_for_object('dataPoint') + 'ingest/'
+        data = [[sensing_point.pk, 10, 11], [sensing_point.pk, 20, 21]]
+        res = self.client.post(url, data=data)
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post(url + '?on_conflict=merge', data=data)
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post(url + '?on_conflict=ignore', data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data['count'], 1)
+        self.assertEqual(list(DataPoint.objects.filter(
+            sensing_point=sensing_point
+        ).values_list('timestamp', 'value')), [(0, 0), (10, 10), (20, 21)])
+        res = self.client.post(url + '?on_conflict=replace', data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(list(DataPoint.objects.filter(
+            sensing_point=sensing_point
+        ).values_list('timestamp', 'value')), [(0, 0), (10, 11), (20, 21)])
+        # The replaced reading should be replaced in the rollups as well
+        data_point_rollups.fold()
+        rollup = DataPointRollup.objects.get(
+            sensing_point=sensing_point, resolution=60 * 60, timestamp=0
+        )
+        self.assertEqual((rollup.sum_value, rollup.count), (32, 3))
+        # Retried lists of readings should be handled the same way
+        sensing_point_url = self.url_for_object(
+            'sensingPoint', sensing_point.pk
+        )
+        data = [
+            {'sensing_point': sensing_point_url, 'timestamp': t, 'value': 5}
+            for t in (20, 30)
+        ]
+        url = self.url_for_object('dataPoint') + '?many=true'
+        res = self.client.post(url, data=data)
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post(url + '&on_conflict=ignore', data=data)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(
+            DataPoint.objects.filter(sensing_point=sensing_point).count(), 4
+        )
+
+    @run_with_any_layout
+    def test_ingest_packed(self):
+        sensing_point = self.create_sensing_point()
+        record = PackedTimeSeriesParser.record
+        body = b''.join(
+            record.pack(sensing_point.pk, t, t / 10) for t in (10, 20, 30)
+        )
+        content_type = PackedTimeSeriesParser.media_type
+        for url in (self.url_for_object('dataPoint'),
+                    self.url_for_object('dataPoint') + 'ingest/'):
+            res = self.client.post(url, body, content_type=content_type)
+            self.assertEqual(res.status_code, 201)
+            self.assertEqual(res.data['count'], 3)
+            body = b''.join(
+                record.pack(sensing_point.pk, t + 1, t / 10)
+                for t in (10, 20, 30)
+            )
+        self.assertEqual(
+            DataPoint.objects.filter(sensing_point=sensing_point).count(), 6
+        )
+        res = self.client.post(url, body[:-1], content_type=content_type)
+        self.assertEqual(res.status_code, 400)
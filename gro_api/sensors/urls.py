@@ -1,3 +1,5 @@
+from django.conf.urls import url
+from ..gro_api.events import EventStreamView
 from .views import (
     SensorTypeViewSet, SensorViewSet, SensingPointViewSet, DataPointViewSet
 )
@@ -7,3 +9,8 @@ def contribute_to_router(router):
     router.register(r'sensor', SensorViewSet)
     router.register(r'sensingPoint', SensingPointViewSet)
     router.register(r'dataPoint', DataPointViewSet)
+    # The stream also carries actuator states, which are registered by the
+    # `actuators` app
+    router.add_api_view(
+        'events', url(r'^events/$', EventStreamView.as_view(), name='events')
+    )
@@ -1,15 +1,26 @@
 import time
 import django_filters
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction, IntegrityError
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.decorators import detail_route
-from rest_framework.exceptions import APIException
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
 from ..gro_api.filters import HistoryFilterMixin
+from ..gro_api.history import (
+    HistoryAggregateMixin, HistoryAlignMixin, HistoryExportMixin,
+    HistoryIngestMixin, HistoryListMixin
+)
+from ..gro_api.pagination import TimeSeriesPagination
+from ..gro_api.parsers import PackedRows, PackedTimeSeriesParser
 from ..gro_api.permissions import EnforceReadOnly
-from .models import SensorType, Sensor, SensingPoint, DataPoint
+from .models import (
+    SensorType, Sensor, SensingPoint, DataPoint, latest_data_points,
+    data_point_rollups, data_point_archive
+)
+from .ingest import DataPointIngester
 from .serializers import (
     SensorTypeSerializer, SensorSerializer, SensingPointSerializer,
     DataPointSerializer
@@ -29,6 +40,20 @@ class SensorViewSet(ModelViewSet):
     serializer_class = SensorSerializer
 
 
+class SensingPointValueFilter(django_filters.FilterSet):
+    resource = django_filters.NumberFilter(name='sensor__resource')
+    location_type = django_filters.CharFilter(
+        name='sensor__resource__location_type__model', lookup_type='iexact'
+    )
+    location_id = django_filters.NumberFilter(
+        name='sensor__resource__location_id'
+    )
+
+    class Meta:
+        model = SensingPoint
+        fields = ['property', 'resource', 'location_type', 'location_id']
+
+
 class SensingPointViewSet(ModelViewSet):
     """
     Used to separate multi-output sensors into abstract single-output units.
@@ -46,17 +71,37 @@ class SensingPointViewSet(ModelViewSet):
         serializer: gro_api.sensors.serializers.DataPointSerializer
         """
         instance = self.get_object()
-        try:
-            queryset = DataPoint.objects.filter(sensing_point=instance).latest()
-        except ObjectDoesNotExist:
+        data_point = latest_data_points.get(instance.pk)
+        if data_point is None:
             raise APIException(
                 'No data has been recorded for this sensor yet'
             )
         serializer = DataPointSerializer(
-            queryset, context={'request': request}
+            data_point, context={'request': request}
         )
         return Response(serializer.data)
 
+    @list_route(methods=["get"])
+    def values(self, request):
+        """
+        Get the current value of every active sensing point that has recorded
+        data. The results can be filtered by `property`, by `resource`, or by
+        the layout object holding the resource with `location_type` (e.g.
+        "tray") and `location_id`.
+        ---
+        serializer: gro_api.sensors.serializers.DataPointSerializer
+        """
+        queryset = SensingPointValueFilter(
+            request.query_params,
+            queryset=self.get_queryset().filter(is_active=True)
+        ).qs.order_by('pk')
+        sensing_point_ids = list(queryset.values_list('pk', flat=True))
+        data_points = latest_data_points.get_many(sensing_point_ids)
+        serializer = DataPointSerializer([
+            data_points[pk] for pk in sensing_point_ids if pk in data_points
+        ], many=True, context={'request': request})
+        return Response(serializer.data)
+
 
 class DataPointFilter(HistoryFilterMixin):
     class Meta:
@@ -64,27 +109,100 @@ class DataPointFilter(HistoryFilterMixin):
         fields = ['sensing_point', 'min_time', 'max_time']
 
 
-class DataPointViewSet(ModelViewSet):
+class DataPointViewSet(HistoryAggregateMixin, HistoryAlignMixin,
+                       HistoryExportMixin, HistoryIngestMixin, HistoryListMixin,
+                       ModelViewSet):
     """ A data point recorded from a sensing point """
     queryset = DataPoint.objects.all()
     serializer_class = DataPointSerializer
+    pagination_class = TimeSeriesPagination
     filter_class = DataPointFilter
+    series_field = 'sensing_point'
+    rollup = data_point_rollups
+    archive = data_point_archive
+    export_fields = ('sensing_point', 'timestamp', 'value')
+    ingester_class = DataPointIngester
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [
+        PackedTimeSeriesParser
+    ]
 
     def create(self, request, *args, **kwargs):
+        """
+        Record a data point, or a list of data points if the query parameter
+        `many` is set. There can only be one data point per sensing point and
+        timestamp. When a list is posted, the query parameter `on_conflict`
+        can be set to "ignore" or "replace" to skip or overwrite data points
+        that already exist, so that failed requests can safely be retried.
+        Readings within the deadband of their sensing point are dropped like
+        they are by `ingest`, and a single dropped reading is answered with an
+        empty response.
+        """
+        if isinstance(request.data, PackedRows):
+            return self.ingest(request)
         many = request.query_params.get('many', False)
         serializer = self.get_serializer(data=request.data, many=many)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        if not self.perform_create(serializer) and not many:
+            return Response(status=status.HTTP_204_NO_CONTENT)
         headers = self.get_success_headers(serializer.data)
         return Response(
             serializer.data, status=status.HTTP_201_CREATED, headers=headers
         )
 
+    def save_unique(self, serializer):
+        try:
+            with transaction.atomic():
+                return serializer.save()
+        except IntegrityError:
+            raise ValidationError(
+                'A data point for this sensing point and timestamp already '
+                'exists'
+            )
+
     def perform_create(self, serializer):
-        if getattr(serializer, 'many', False):
-            DataPoint.objects.bulk_create([
-                DataPoint(**child_attrs) for child_attrs in
-                serializer.validated_data
-            ])
-        else:
-            serializer.save()
+        """
+        Store the validated data points that are not within the deadband of
+        their sensing point and return how many of them were stored
+        """
+        many = getattr(serializer, 'many', False)
+        ingester = self.ingester_class(
+            self.request.query_params.get('on_conflict', None) if many else
+            None
+        )
+        rows = [
+            (
+                attrs['sensing_point'].pk,
+                int(attrs.get('timestamp', time.time())), attrs['value']
+            ) for attrs in (
+                serializer.validated_data if many else
+                [serializer.validated_data]
+            )
+        ]
+        ingester.check_series(rows)
+        rows = ingester.filter_rows(rows)
+        if many:
+            return ingester.insert(rows)
+        if not rows:
+            return 0
+        data_point = self.save_unique(serializer)
+        latest_data_points.update([data_point])
+        return 1
+
+    def perform_update(self, serializer):
+        old_position = (
+            serializer.instance.sensing_point_id, serializer.instance.timestamp
+        )
+        instance = self.save_unique(serializer)
+        latest_data_points.invalidate(
+            {old_position[0], instance.sensing_point_id}
+        )
+        data_point_rollups.refold(
+            [old_position, (instance.sensing_point_id, instance.timestamp)]
+        )
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        latest_data_points.invalidate([instance.sensing_point_id])
+        data_point_rollups.refold(
+            [(instance.sensing_point_id, instance.timestamp)]
+        )